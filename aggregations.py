@@ -0,0 +1,74 @@
+from storage import USERNAME_FIELD, posts_collection
+
+# ===================== SERVER-SIDE ANALYTICS =====================
+# Each function runs a single aggregation pipeline inside MongoDB and returns
+# only the result rows.
+FOLLOWER_BOUNDARIES = [0, 1_000, 10_000, 100_000, 1_000_000, 10_000_000]
+FOLLOWER_EXAMPLES = 5  # Usernames listed per follower bucket
+
+
+def top_posts(collection, limit=10, username=None):
+    """Most liked posts, optionally for a single user."""
+    pipeline = []
+    if username:
+        pipeline.append({"$match": {"username": username}})
+    pipeline += [
+        {"$sort": {"likes": -1}},
+        {"$limit": limit},
+        {"$project": {"_id": 0, "post_id": "$_id", "username": 1, "likes": 1, "comment_count": 1, "caption": 1}},
+    ]
+    return list(posts_collection(collection).aggregate(pipeline))
+
+
+def average_likes(collection, limit=20, min_posts=1):
+    """Users ranked by their average likes per stored post."""
+    pipeline = [
+        {"$group": {
+            "_id": "$user_id",
+            "username": {"$first": "$username"},
+            "posts": {"$sum": 1},
+            "avg_likes": {"$avg": "$likes"},
+            "max_likes": {"$max": "$likes"},
+            "total_comments": {"$sum": "$comment_count"},
+        }},
+        {"$match": {"posts": {"$gte": min_posts}}},
+        {"$sort": {"avg_likes": -1}},
+        {"$limit": limit},
+        {"$project": {"_id": 0, "user_id": "$_id", "username": 1, "posts": 1, "avg_likes": 1,
+                      "max_likes": 1, "total_comments": 1}},
+    ]
+    return list(posts_collection(collection).aggregate(pipeline))
+
+
+def follower_ranges(collection, boundaries=FOLLOWER_BOUNDARIES):
+    """Number of stored profiles per follower-count bucket."""
+    pipeline = [
+        {"$match": {"user_info.Followers": {"$type": "number"}}},
+        {"$bucket": {
+            "groupBy": "$user_info.Followers",
+            "boundaries": boundaries,
+            "default": f"{boundaries[-1]}+",
+            "output": {"profiles": {"$sum": 1}, "usernames": {"$push": "$user_info.Username"}},
+        }},
+        # Only the examples leave the server
+        {"$project": {"profiles": 1, "usernames": {"$slice": ["$usernames", FOLLOWER_EXAMPLES]}}},
+    ]
+    return [
+        {"range": bucket["_id"], "profiles": bucket["profiles"], "examples": bucket["usernames"]}
+        for bucket in collection.aggregate(pipeline)
+    ]
+
+
+def users_by_followers(collection, min_followers=0, max_followers=None, limit=20):
+    """Profiles within a follower range, largest first."""
+    follower_filter = {"$gte": min_followers}
+    if max_followers is not None:
+        follower_filter["$lt"] = max_followers
+    pipeline = [
+        {"$match": {"user_info.Followers": follower_filter}},
+        {"$sort": {"user_info.Followers": -1}},
+        {"$limit": limit},
+        {"$project": {"_id": 0, "username": f"${USERNAME_FIELD}", "followers": "$user_info.Followers",
+                      "following": "$user_info.Following", "category": "$user_info.Category"}},
+    ]
+    return list(collection.aggregate(pipeline))
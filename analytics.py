@@ -0,0 +1,161 @@
+import threading
+import numpy as np
+import pandas as pd
+
+from dataset import FOLLOWERS_COLUMN, USERNAME_COLUMN, dataset_store
+from metrics import timed
+
+# ===================== ENGAGEMENT ANALYTICS =====================
+TOP_K = 5
+RANKING_METRICS = ['mean_likes', 'median_likes', 'p90_likes', 'engagement_rate', 'followers', 'posts']
+
+
+def coalesce_post_field(data, layouts, field, numeric):
+    """Build a profiles x post-slots matrix of ``field``.
+
+    For every cell the first layout (in preference order) that has a value
+    wins, so rows exported under different conventions line up.
+    """
+    n_slots = 1 + max((index for layout in layouts for index in layout.get(field, {})), default=-1)
+    matrix = np.full((len(data), n_slots), np.nan if numeric else None, dtype=float if numeric else object)
+    # Write the least preferred layout first so preferred values overwrite it
+    for layout in reversed(layouts):
+        for index, column in layout.get(field, {}).items():
+            values = data[column].to_numpy()
+            present = pd.notna(values)
+            matrix[present, index] = values[present]
+    return matrix
+
+
+@timed("post_reshape")
+def long_posts(data, layouts):
+    """Reshape the wide per-post columns into one row per existing post.
+
+    Columns: ``profile`` (row position in ``data``), ``post`` (slot index),
+    ``post_id``, ``likes`` and ``caption``. A slot counts as a post if any of
+    its fields is present; missing likes count as 0 and missing captions as "".
+    """
+    likes = coalesce_post_field(data, layouts, 'Likes', numeric=True)
+    captions = coalesce_post_field(data, layouts, 'Caption', numeric=False)
+    post_ids = coalesce_post_field(data, layouts, 'ID', numeric=False)
+    n_slots = max(likes.shape[1], captions.shape[1], post_ids.shape[1])
+
+    def widen(matrix, fill):
+        if matrix.shape[1] == n_slots:
+            return matrix
+        padded = np.full((len(data), n_slots), fill, dtype=matrix.dtype)
+        padded[:, :matrix.shape[1]] = matrix
+        return padded
+
+    likes = widen(likes, np.nan)
+    captions = widen(captions, None)
+    post_ids = widen(post_ids, None)
+
+    present = ~np.isnan(likes) | pd.notna(captions) | pd.notna(post_ids)
+    profile, post = np.nonzero(present)
+    return pd.DataFrame({
+        'profile': profile,
+        'post': post,
+        'post_id': post_ids[present],
+        'likes': np.nan_to_num(likes[present], nan=0.0),
+        'caption': pd.Series(captions[present], dtype=object).fillna("").astype(str).to_numpy(),
+    })
+
+
+@timed("engagement_metrics")
+def engagement_metrics(posts, followers):
+    """Per-profile engagement metrics computed in one grouped pass over ``posts``."""
+    grouped = posts.groupby('profile')['likes']
+    metrics = pd.DataFrame({
+        'posts': grouped.size(),
+        'mean_likes': grouped.mean(),
+        'median_likes': grouped.median(),
+        'p90_likes': grouped.quantile(0.9),
+    }).reindex(np.arange(len(followers)))
+    metrics['posts'] = metrics['posts'].fillna(0).astype(int)
+    metrics['followers'] = followers
+    with np.errstate(divide='ignore', invalid='ignore'):
+        rate = metrics['mean_likes'].to_numpy() / followers
+    metrics['engagement_rate'] = np.where(followers > 0, rate, np.nan)
+    return metrics
+
+
+class EngagementAnalytics:
+    """Cohort-wide engagement results, recomputed only when the dataset changes.
+
+    Single-user views and cross-profile rankings are lookups into the cached
+    results rather than fresh passes over the CSV.
+    """
+
+    def __init__(self, store=dataset_store):
+        self.store = store
+        self._version = None
+        self._lock = threading.Lock()
+        self.data = None
+        self.posts = None
+        self.metrics = None
+        self._post_offsets = None
+
+    def refresh(self):
+        """Recompute everything if the underlying dataset was reloaded."""
+        with self._lock:
+            version = self.store.version()
+            if version == self._version:
+                return
+            data = self.store.frame()
+            if FOLLOWERS_COLUMN in data.columns:
+                followers = data[FOLLOWERS_COLUMN].to_numpy(dtype=float)
+            else:
+                followers = np.full(len(data), np.nan)
+
+            # Sorting once by (profile, likes desc) makes every user's posts a
+            # contiguous, already ranked slice
+            posts = long_posts(data, self.store.post_layouts)
+            posts = posts.sort_values(['profile', 'likes'], ascending=[True, False], kind='stable').reset_index(drop=True)
+            metrics = engagement_metrics(posts, followers)
+            metrics.insert(0, 'username', data[USERNAME_COLUMN].to_numpy())
+
+            self.data = data
+            self.posts = posts
+            self.metrics = metrics
+            self._post_offsets = np.searchsorted(posts['profile'].to_numpy(), np.arange(len(data) + 1))
+            self._version = version
+
+    def user_posts(self, position):
+        """Posts of the profile at ``position``, highest likes first."""
+        return self.posts.iloc[self._post_offsets[position]:self._post_offsets[position + 1]]
+
+    def profile(self, username, top_k=TOP_K):
+        """Engagement summary for one user, or None if the user is not in the dataset."""
+        self.refresh()
+        position = self.store.position(username)
+        if position is None:
+            return None
+        row = self.data.iloc[position]
+        metrics = self.metrics.iloc[position]
+        posts = self.user_posts(position)
+        likes_and_captions = list(zip(posts['likes'].astype(int), posts['caption']))
+        return {
+            'category': row.get('user_info.Category') if pd.notna(row.get('user_info.Category')) else "Unknown",
+            'related_profiles': row.get('user_info.Related Profiles') if pd.notna(row.get('user_info.Related Profiles')) else "None",
+            'followers': float(metrics['followers']),
+            'posts': int(metrics['posts']),
+            'avg_likes': float(metrics['mean_likes']),
+            'median_likes': float(metrics['median_likes']),
+            'p90_likes': float(metrics['p90_likes']),
+            'engagement_rate': float(metrics['engagement_rate']),
+            'sorted_likes_captions': likes_and_captions,
+            'top_posts': likes_and_captions[:top_k],
+        }
+
+    def ranking(self, metric='mean_likes', limit=20, ascending=False):
+        """Profiles ordered by ``metric``; profiles without a value are left out."""
+        if metric not in RANKING_METRICS:
+            raise ValueError(f"Unknown metric: {metric}")
+        self.refresh()
+        ranked = self.metrics.dropna(subset=[metric])
+        ranked = ranked.nsmallest(limit, metric) if ascending else ranked.nlargest(limit, metric)
+        return ranked.reset_index(drop=True)
+
+
+engagement = EngagementAnalytics()
@@ -1,112 +1,97 @@
-import streamlit as st
-import json
-import httpx
-from PIL import Image
-from io import BytesIO
 import time
-from pymongo import MongoClient
-import pandas as pd
+RUN_STARTED = time.perf_counter()  # Start of this script run, for the startup and rerun timings
+
+import streamlit as st
 import os
-import numpy as np
 from datetime import datetime
 
+# pandas, numpy and PIL are imported by the analysis and image modules that
+# need them, and those modules only where they are used, so pages that do
+# not touch the dataset start without loading them.
+from scraper import http_client, response_cache, scrape_user
+from jobs import JobQueue, run_queue
+from crawler import CRAWL_MAX_DEPTH, CRAWL_MAX_PROFILES, most_referenced, run_crawl
+from storage import (BulkUpserter, connect, ensure_indexes, load_comments, load_user, migrate_storage,
+                     search_usernames, upsert_user)
+from aggregations import average_likes, follower_ranges, top_posts
+from export import EXPORT_FORMATS, EXPORT_LAYOUTS, export_collection, scrapes_frame
+from history import ensure_history_indexes, timeline
+from llm import ask, ask_many, llm_client
+from images import GRID_IMAGE_WIDTH, PROFILE_IMAGE_WIDTH, cached_image, placeholder_image, prefetch_images
+from metrics import (METRICS_FILE, METRICS_INTERVAL, histogram_summary, metrics, record_run,
+                     start_textfile_exporter, timed, track_queue, value_summary)
+
 # MongoDB Connection (Local or Atlas)
 MONGO_URI = "mongodb://localhost:27017/"  # Replace with your MongoDB credentials
-client_mongo = MongoClient(MONGO_URI)
-db = client_mongo["SocialScan"]  # Database name
-collection = db["users"]  # Collection name
-
-# Define the HTTP client
-client = httpx.Client(
-    headers={
-        "x-ig-app-id": "936619743392459",
-        "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/62.0.3202.94 Safari/537.36",
-        "Accept-Language": "en-US,en;q=0.9,ru;q=0.8",
-        "Accept-Encoding": "gzip, deflate, br",
-        "Accept": "/",
-        
-    }
-)
+MONGO_DB = "SocialScan"  # Database name
+
+SAVED_PAGE_SIZE = 50  # Profiles per page in the saved-profile picker
+GRID_PAGE_SIZE = 9  # Posts per page of a media grid
+PROFILES_PAGE_SIZE = 10  # Profiles per page of the batch results list
+
+# Clients and queues are process-wide resources created on first use, so a
+# rerun reuses them and a page that never touches MongoDB never waits on it.
+@st.cache_resource
+def get_database():
+    """The MongoDB database and its setup notices, with indexes and migrations applied once per process.
+
+    Connection and index errors propagate, so a failed setup is not cached
+    and the next rerun tries again.
+    """
+    db = connect(MONGO_URI)[MONGO_DB]
+    return db, init_storage(db["users"], db["history"])
+
+def database():
+    db, _ = get_database()
+    st.session_state.database_opened = True
+    return db
+
+def users_collection():
+    return database()["users"]
+
+def history_collection():
+    """Per-scrape baselines and deltas."""
+    return database()["history"]
+
+@st.cache_resource
+def get_job_queue():
+    """Batch scrape jobs, retried until they succeed or fail for good."""
+    queue = JobQueue()
+    track_queue("jobs", queue.counts)
+    return queue
+
+def init_storage(collection, history):
+    """Create MongoDB indexes and migrate old documents; returns ``(level, message)`` notices for the UI."""
+    notices = []
+    if not ensure_indexes(collection):
+        notices.append(("warning", "Duplicate usernames found in MongoDB; created a non-unique username index."))
+    ensure_history_indexes(history)
+    migrated = migrate_storage(collection)
+    if migrated:
+        notices.append(("info", f"Moved posts of {migrated} saved profiles into the posts collection."))
+    return notices
+
+def show_storage_notices():
+    """Show the storage setup notices once per session, after the first run that used MongoDB."""
+    if st.session_state.get("database_opened") and not st.session_state.get("storage_notices_shown"):
+        st.session_state.storage_notices_shown = True
+        for level, message in get_database()[1]:
+            getattr(st.sidebar, level)(message)
+
+@st.cache_resource
+def init_metrics():
+    """Start the metrics textfile export once per process, if configured."""
+    start_textfile_exporter(METRICS_FILE)
 
 # ===================== INSTAGRAM SCRAPER FUNCTIONS =====================
-def scrape_user(username: str):
-    """Scrape Instagram user's data and extract relevant info, including all available images, captions, and comments."""
-    try:
-        result = client.get(f"https://i.instagram.com/api/v1/users/web_profile_info/?username={username}")
-
-        if result.status_code != 200:
-            return f"Failed to retrieve data. Status code: {result.status_code}", []
-
-        try:
-            data = json.loads(result.content)
-        except json.JSONDecodeError:
-            return "Error decoding JSON response from the server.", []
-
-        user_info = data.get("data", {}).get("user", {})
-        if not user_info:
-            return "User not found or unable to retrieve data.", []
-
-        # Extract User Details
-        user = {
-            "Username": user_info.get("username", "N/A"),
-            "Full Name": user_info.get("full_name", "N/A"),
-            "ID": user_info.get("id", "N/A"),
-            "Category": user_info.get("category_name", "N/A"),
-            "Business Category": user_info.get("business_category_name", "N/A"),
-            "Phone": user_info.get("business_phone_number", "N/A"),
-            "Email": user_info.get("business_email", "N/A"),
-            "Biography": user_info.get("biography", "N/A"),
-            "Bio Links": [link.get("url") for link in user_info.get("bio_links", []) if link.get("url")],
-            "Homepage": user_info.get("external_url", "N/A"),
-            "Followers": f"{user_info.get('edge_followed_by', {}).get('count', 0):,}",
-            "Following": f"{user_info.get('edge_follow', {}).get('count', 0):,}",
-            "Facebook ID": user_info.get("fbid", "N/A"),
-            "Is Private": user_info.get("is_private", "N/A"),
-            "Is Verified": user_info.get("is_verified", "N/A"),
-            "Profile Image": user_info.get("profile_pic_url_hd", "N/A"),
-            "Video Count": user_info.get("edge_felix_video_timeline", {}).get("count", 0),
-            "Image Count": user_info.get("edge_owner_to_timeline_media", {}).get("count", 0),
-            "Saved Count": user_info.get("edge_saved_media", {}).get("count", 0),
-            "Collections Count": user_info.get("edge_saved_media", {}).get("count", 0),
-            "Related Profiles": [profile.get("node", {}).get("username", "N/A") for profile in user_info.get("edge_related_profiles", {}).get("edges", [])],
-        }
-
-        # Extract Images, Captions, and Comments
-        images = user_info.get("edge_owner_to_timeline_media", {}).get("edges", [])
-        image_info = []
-
-        for image in images:
-            image_node = image.get("node", {})
-            comments = []
-            if image_node.get("edge_media_to_comment", {}).get("count", 0) > 0:
-                comments_query = client.get(f"https://i.instagram.com/api/v1/media/{image_node.get('id')}/comments/")
-                if comments_query.status_code == 200:
-                    comments_data = comments_query.json()
-                    comments = [comment.get("text", "") for comment in comments_data.get("comments", [])]
-
-            image_info.append({
-                "ID": image_node.get("id", "N/A"),
-                "Source": image_node.get("display_url", "N/A"),
-                "Likes": image_node.get("edge_liked_by", {}).get("count", 0),
-                "Caption": image_node.get("edge_media_to_caption", {}).get("edges", [{}])[0].get("node", {}).get("text", "N/A"),
-                "Comments": comments,
-            })
-
-        return user, image_info
-    except Exception as e:
-        return f"An error occurred: {e}", []
-
-def fetch_image(url):
-    """Fetch image from URL and return PIL Image object, or a placeholder if failed."""
-    try:
-        response = client.get(url, timeout=5)
-        if response.status_code == 200:
-            return Image.open(BytesIO(response.content))
-    except Exception:
-        pass  # Handle errors silently
+def fetch_image(url, width=GRID_IMAGE_WIDTH):
+    """Fetch image from URL and return the path of its thumbnail, or a placeholder image if failed."""
+    path = cached_image(http_client(), url, width)
+    if path is not None:
+        return path
 
     # Return a placeholder image if loading fails
-    return Image.open("placeholder.png")  # Ensure placeholder.png exists
+    return placeholder_image()
 
 def save_to_mongo(user_info, images):
     """Save scraped data to MongoDB."""
@@ -114,23 +99,10 @@ def save_to_mongo(user_info, images):
         st.error(user_info)
         return False
 
-    user_data = {
-        "user_info": user_info,
-        "images": images,
-        "timestamp": time.time(),
-        "scrape_date": datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-    }
-
-    # Check if user already exists in the database
-    existing_user = collection.find_one({"user_info.Username": user_info["Username"]})
-    if existing_user:
+    # Single upsert instead of a lookup followed by an update or insert
+    if upsert_user(users_collection(), user_info, images, history=history_collection()):
         st.warning("User data already exists in MongoDB. Updating record.")
-        collection.update_one(
-            {"user_info.Username": user_info["Username"]},
-            {"$set": user_data}
-        )
     else:
-        collection.insert_one(user_data)
         st.success("Data successfully saved to MongoDB")
     
     return True
@@ -142,24 +114,44 @@ def display_user_info(user_info):
         st.error(user_info)
     else:
         for key, value in user_info.items():
+            if key in ("Followers", "Following") and isinstance(value, int):
+                value = f"{value:,}"
             st.write(f"{key}:** {value}")
         
         if user_info.get("Profile Image"):
-            try:
-                response = client.get(user_info.get("Profile Image"))
-                img = Image.open(BytesIO(response.content))
-                st.image(img, caption="Profile Picture", use_container_width=True)
-            except Exception as e:
-                st.error(f"Error loading profile image: {e}")
-
-def display_media_grid(media_list, columns=3):
-    """Display images in a responsive Instagram-style grid with Post ID, Likes, Captions, and Comments."""
+            path = cached_image(http_client(), user_info.get("Profile Image"), PROFILE_IMAGE_WIDTH)
+            if path is not None:
+                st.image(path, caption="Profile Picture", use_container_width=True)
+            else:
+                st.error("Error loading profile image")
+
+def page_selector(total, page_size, key):
+    """Page picker for ``total`` items; returns the ``(start, end)`` slice of the chosen page."""
+    pages = max(1, -(-total // page_size))
+    page = 1
+    if pages > 1:
+        page = st.number_input(f"Page (of {pages})", min_value=1, max_value=pages, value=1, key=key)
+    start = (page - 1) * page_size
+    return start, min(start + page_size, total)
+
+def display_media_grid(media_list, columns=3, page_size=GRID_PAGE_SIZE, key="grid"):
+    """Display images in a responsive Instagram-style grid with Post ID, Likes, Captions, and Comments.
+
+    Posts are shown one page at a time. Posts loaded without their comments
+    fetch them from MongoDB only when asked to.
+    """
     st.subheader("User's Latest Posts")
 
     if not media_list:
         st.warning("No images found.")
         return
 
+    start, end = page_selector(len(media_list), page_size, f"{key}_page")
+    media_list = media_list[start:end]
+
+    # Download (or read from the thumbnail cache) the images of this page in parallel before rendering
+    thumbnails = prefetch_images(http_client(), [media["Source"] for media in media_list])
+    
     rows = [media_list[i:i+columns] for i in range(0, len(media_list), columns)]  # Split into rows
     
     for row in rows:
@@ -168,7 +160,7 @@ def display_media_grid(media_list, columns=3):
         for idx, media in enumerate(row):
             if idx < len(row):
                 with cols[idx]:  # Place each image in its respective column
-                    img = fetch_image(media["Source"])  # Fetch the image
+                    img = thumbnails.get(media["Source"]) or placeholder_image()
                     st.image(img, use_container_width=True)  # Ensure it fits the column width
                     st.write(f"❤ {media['Likes']} Likes**")
                     st.caption(f"📌 Post ID: {media['ID']}")
@@ -182,47 +174,54 @@ def display_media_grid(media_list, columns=3):
                         with st.expander(f"View Comments ({len(media['Comments'])})"):
                             for comment in media["Comments"]:
                                 st.write(f"- {comment}")
+                    elif media.get("Comment Count"):
+                        if st.checkbox(f"View Comments ({media['Comment Count']})", key=f"{key}_comments_{media['ID']}"):
+                            for comment in load_comments(users_collection(), media["ID"]):
+                                st.write(f"- {comment}")
 
-def get_saved_usernames():
-    """Get list of usernames saved in MongoDB."""
-    try:
-        users = collection.find({}, {"user_info.Username": 1, "scrape_date": 1})
-        return [(user.get("user_info", {}).get("Username"), 
-                 user.get("scrape_date", "Unknown date")) 
-                for user in users if "user_info" in user and "Username" in user["user_info"]]
-    except Exception as e:
-        st.error(f"Error fetching saved usernames: {e}")
-        return []
+@st.cache_data(ttl=30, show_spinner=False)
+def get_saved_usernames(prefix="", after=None, page_size=SAVED_PAGE_SIZE):
+    """Get one page of usernames saved in MongoDB that start with ``prefix``."""
+    return search_usernames(users_collection(), prefix, after, page_size)
 
-def load_saved_user(username):
-    """Load a previously saved user from MongoDB."""
+def load_saved_user(username, with_comments=False):
+    """Load a previously saved user from MongoDB (comments are loaded on demand unless requested)."""
     try:
-        user_data = collection.find_one({"user_info.Username": username})
+        user_data = load_user(users_collection(), username, with_comments)
         if user_data:
-            return user_data.get("user_info"), user_data.get("images", [])
+            return user_data
         else:
             return f"User {username} not found in database.", []
     except Exception as e:
         return f"Error loading user data: {e}", []
 
+def load_history(username, start=None, end=None):
+    """Return a DataFrame with one row per recorded scrape of ``username``."""
+    import pandas as pd
+    rows = []
+    for timestamp, state, changes in timeline(history_collection(), username, start, end):
+        rows.append({
+            "Scraped": datetime.fromtimestamp(timestamp),
+            "Followers": state["followers"],
+            "Following": state["following"],
+            "Posts Tracked": len(state["posts"]),
+            "Bio Changed": "biography" in changes,
+            "New Posts": len(changes.get("posts_added", {})),
+            "Removed Posts": len(changes.get("posts_removed", [])),
+            "Like Changes": len(changes.get("likes", {})),
+        })
+    return pd.DataFrame(rows)
+
 def export_user_data_to_csv(username):
     """Export user data to CSV file."""
     try:
-        user_data = collection.find_one({"user_info.Username": username})
+        user_data = load_user(users_collection(), username, with_comments=False)
         if not user_data:
             return False, f"User {username} not found in database."
+        user_info, images = user_data
         
-        # Flatten user info
-        flat_user = {"user_info." + k: v for k, v in user_data.get("user_info", {}).items()}
-        
-        # Flatten image data
-        for i, image in enumerate(user_data.get("images", [])):
-            for k, v in image.items():
-                if k != "Comments":  # Skip comments array to keep it simple
-                    flat_user[f"images[{i}].{k}"] = v
-        
-        # Convert to DataFrame and export
-        df = pd.DataFrame([flat_user])
+        # One wide row in the bulk export's profiles layout
+        df = scrapes_frame([(user_info, images, {})], max_posts=max(len(images), 1))
         filename = f"{username}_data.csv"
         df.to_csv(filename, index=False)
         
@@ -231,124 +230,102 @@ def export_user_data_to_csv(username):
         return False, f"Error exporting data: {e}"
 
 # ===================== ANALYSIS FUNCTIONS =====================
+@timed("analyze_behavior")
 def analyze_behavior(username):
     """Analyze behavior of a specific Instagram user based on loaded data."""
-    # Load data
+    from analytics import engagement
+    from dataset import dataset_store
+    # Cohort-wide metrics are computed once per dataset version; this is a lookup
     try:
-        DATA_PATH = 'dataset1_train.csv'
-        data = pd.read_csv(DATA_PATH)
-
-        # Debug: Print unique usernames to check what's available
-        st.write(f"Debug: Available usernames: {data['user_info.Username'].unique()}")
-        
-        # Debug: Print the username we're trying to find
-        st.write(f"Debug: Looking for username: {username}")
-
-        # Select relevant columns
-        columns_to_keep = ['user_info.Username', 'user_info.Category', 'user_info.Related Profiles'] + \
-                          [f'images[{i}].Likes' for i in range(12)] + [f'images[{i}].Caption' for i in range(12)]
-
-        # Check if all columns exist in the dataset
-        existing_columns = [col for col in columns_to_keep if col in data.columns]
-        if len(existing_columns) < len(columns_to_keep):
-            missing_columns = set(columns_to_keep) - set(existing_columns)
-            st.warning(f"Some columns are missing in the dataset: {missing_columns}")
-        
-        # Use only columns that exist in the dataset
-        data = data[existing_columns]
-
-        # Handle missing values and convert data types
-        for i in range(12):
-            likes_col = f'images[{i}].Likes'
-            caption_col = f'images[{i}].Caption'
-            
-            if likes_col in data.columns:
-                data[likes_col] = pd.to_numeric(data[likes_col], errors='coerce').fillna(0)
-            
-            if caption_col in data.columns:
-                data[caption_col] = data[caption_col].fillna("")
+        behavior = engagement.profile(username)
+        if dataset_store.missing_columns:
+            st.warning(f"Some columns are missing in the dataset: {dataset_store.missing_columns}")
+        if not dataset_store.post_layouts:
+            st.warning("No per-post likes or caption columns found in the dataset")
     except Exception as e:
         st.error(f"Error loading data: {e}")
         return None
 
-    # Filter data for the selected user - making sure to check case insensitivity and whitespace
-    # Debug: show the filtering process
-    st.write(f"Total records before filtering: {len(data)}")
-    
-    # Clean username values for comparison
-    data['cleaned_username'] = data['user_info.Username'].str.strip().str.lower()
-    cleaned_input_username = username.strip().lower()
-    
-    user_data = data[data['cleaned_username'] == cleaned_input_username]
-    
-    st.write(f"Records found after filtering: {len(user_data)}")
-    
-    if user_data.empty:
+    if behavior is None:
         st.error(f"No data found for user: {username}")
         return None
     
-    # Fetch user category and related profiles
-    category = user_data['user_info.Category'].iloc[0] if 'user_info.Category' in user_data.columns else "Unknown"
-    related_profiles = user_data['user_info.Related Profiles'].iloc[0] if 'user_info.Related Profiles' in user_data.columns else "None"
-    
-    # Extract likes and captions
-    likes_and_captions = []
-    for i in range(12):
-        likes_column = f'images[{i}].Likes'
-        caption_column = f'images[{i}].Caption'
-        
-        # Check if the columns exist in the dataset
-        if likes_column in user_data.columns and caption_column in user_data.columns:
-            likes = user_data[likes_column].iloc[0]
-            caption = user_data[caption_column].iloc[0]
-            
-            # Ensure likes are numeric and captions are strings
-            if pd.notna(likes) and pd.notna(caption):
-                likes_and_captions.append((int(likes), str(caption)))
-    
-    if not likes_and_captions:
+    if not behavior['sorted_likes_captions']:
         st.warning("No likes and captions data found for this user")
         return None
     
-    # Calculate average likes
-    avg_likes = sum(like for like, _ in likes_and_captions) / len(likes_and_captions)
-    
-    # Sort likes and captions in descending order of likes
-    sorted_likes_captions = sorted(likes_and_captions, key=lambda x: x[0], reverse=True)
+    return behavior
 
-    # Remove debug information before returning the results
-    # st.write("Debug information complete. Returning analysis results.")
-    
-    return {
-        'category': category,
-        'related_profiles': related_profiles,
-        'avg_likes': avg_likes,
-        'sorted_likes_captions': sorted_likes_captions
-    }
-
-def generate_prompt(username, query):
-    """Generate a prompt for the LLM based on user behavior analysis."""
-    behavior = analyze_behavior(username)
+def generate_prompt(username, query, behavior):
+    """Stream the LLM's answer to ``query`` about a user whose ``behavior`` is already analyzed."""
     if not behavior:
-        return "No data available for the selected user."
-    
-    prompt = f"Generate a response for {username}, a {behavior['category']} influencer. "
-    prompt += f"Related profiles: {behavior['related_profiles']}. "
-    prompt += f"Top performing captions include: {', '.join([caption for _, caption in behavior['sorted_likes_captions'][:5]])}. "
-    prompt += f"Average engagement score: {behavior['avg_likes']:.2f}. Query: {query}"
+        yield "No data available for the selected user."
+        return
     
     try:
-        # Note: In the original code, there was a model.generate_content() call here
-        # Since you didn't provide the model configuration, I'll return the prompt for now
-        # Uncomment and modify the code below when you have your LLM model configured
-        
-        # response = model.generate_content(prompt)
-        # return response.text
-        
-        # For now, just return the prompt as a placeholder
-        return f"LLM Query: {prompt}\n\n[LLM response would appear here - model not configured]"
+        # Answers for the same profile snapshot and question come from the completion cache
+        yield from ask(username, behavior, query)
     except Exception as e:
-        return f"❌ Error generating content: {e}"
+        yield f"❌ Error generating content: {e}"
+
+# ===================== DIAGNOSTICS =====================
+def display_diagnostics():
+    """Sidebar panel with stage timings, HTTP and MongoDB traffic, cache hit rates and queue depths."""
+    # A toggle rather than an expander: collapsed, it costs a rerun nothing
+    if not st.sidebar.toggle("📈 Diagnostics"):
+        return
+    import pandas as pd
+    with st.sidebar.container():
+        metrics.collect()
+
+        stages = pd.DataFrame(histogram_summary("socialscan_stage_seconds"))
+        st.markdown("**Stages**")
+        if stages.empty:
+            st.caption("Nothing timed yet.")
+        else:
+            st.dataframe(stages.sort_values("count", ascending=False).round(1), hide_index=True)
+
+        st.markdown("**HTTP**")
+        http = pd.DataFrame(histogram_summary("socialscan_http_request_seconds"))
+        if http.empty:
+            st.caption("No network requests yet.")
+        else:
+            received = {row["endpoint"]: row["value"] for row in value_summary("socialscan_http_received_bytes_total")}
+            http["MB"] = http["endpoint"].map(received).fillna(0) / 1e6
+            st.dataframe(http.round(2), hide_index=True)
+            statuses = pd.DataFrame(value_summary("socialscan_http_responses_total"))
+            errors = pd.DataFrame(value_summary("socialscan_http_errors_total"))
+            if not errors.empty:
+                statuses = pd.concat([statuses, errors.assign(status="error")], ignore_index=True)
+            if not statuses.empty:
+                st.dataframe(statuses.pivot_table(index="endpoint", columns="status", values="value",
+                                                  aggfunc="sum", fill_value=0))
+
+        st.markdown("**MongoDB**")
+        mongo = pd.DataFrame(histogram_summary("socialscan_mongo_command_seconds"))
+        if mongo.empty:
+            st.caption("No MongoDB commands yet.")
+        else:
+            st.dataframe(mongo.sort_values("count", ascending=False).round(1), hide_index=True)
+
+        st.markdown("**Caches**")
+        ratios = pd.DataFrame(value_summary("socialscan_cache_hit_ratio"))
+        if not ratios.empty:
+            lookups = pd.DataFrame(value_summary("socialscan_cache_lookups_total"))
+            lookups = lookups.pivot_table(index="cache", columns="result", values="value", aggfunc="sum")
+            caches = ratios.rename(columns={"value": "hit_rate"}).join(lookups, on="cache")
+            st.dataframe(caches.round(3), hide_index=True)
+
+        st.markdown("**Queues**")
+        queues = pd.DataFrame(value_summary("socialscan_queue_depth"))
+        if not queues.empty:
+            st.dataframe(queues.pivot_table(index="queue", columns="state", values="value", aggfunc="sum",
+                                            fill_value=0))
+
+        st.download_button("Download Prometheus metrics", metrics.render_prometheus(),
+                           file_name="socialscan.prom", mime="text/plain")
+        if METRICS_FILE:
+            st.caption(f"Also written to {METRICS_FILE} every {METRICS_INTERVAL:.0f} s.")
 
 # ===================== STREAMLIT APP =====================
 def main():
@@ -358,6 +335,7 @@ def main():
         layout="wide",
         initial_sidebar_state="expanded"
     )
+    init_metrics()
     
     # Add application title and description
     st.title("📱 SocialScan")
@@ -374,10 +352,17 @@ def main():
     if app_mode == "Instagram Scraper":
         st.header("Instagram Profile Scraper")
         
+        # Response cache statistics for this session
+        cache_stats = response_cache.stats()
+        st.sidebar.caption(
+            f"Response cache: {cache_stats['hits']} hits, {cache_stats['misses']} misses, "
+            f"{cache_stats['entries']} entries ({cache_stats['bytes'] / 1e6:.1f} MB)"
+        )
+        
         # Add sub-navigation for different scraping options
         scraper_option = st.radio(
             "Select scraping option:",
-            ["New Scraper", "Saved Scraper", "Batch Scraper"],
+            ["New Scraper", "Saved Scraper", "Batch Scraper", "Graph Crawler"],
             horizontal=True
         )
         
@@ -387,50 +372,78 @@ def main():
             st.markdown("Enter an Instagram username to scrape their profile data and posts.")
             
             username = st.text_input("Enter the Instagram username", placeholder="Username")
+            force_refresh = st.checkbox("Force refresh", help="Ignore cached responses and fetch fresh data from Instagram")
             
             if st.button("Scrape Data"):
                 if username:
                     with st.spinner(f"Scraping data for {username}..."):
-                        user_info, images = scrape_user(username)
+                        user_info, images = scrape_user(username, force_refresh=force_refresh)
                     
                     # Save to MongoDB
                     save_to_mongo(user_info, images)
                     
-                    # Display user info and images
-                    display_user_info(user_info)
-                    display_media_grid(images)
+                    # Remembered so grid paging and comment toggles survive reruns
+                    st.session_state.scraped_profile = (user_info, images)
+                    st.session_state.pop("scraped_page", None)
                 else:
                     st.error("Please enter a valid username")
+            
+            if "scraped_profile" in st.session_state:
+                # Display user info and images
+                user_info, images = st.session_state.scraped_profile
+                display_user_info(user_info)
+                display_media_grid(images, key="scraped")
         
         # 2. Saved Scraper Option (View previously scraped profiles)
         elif scraper_option == "Saved Scraper":
             st.subheader("View Saved Instagram Profiles")
             st.markdown("Select a previously scraped Instagram profile to view data.")
             
-            # Get list of saved usernames
-            saved_users = get_saved_usernames()
+            # Search saved usernames by prefix; results come one page at a time
+            search = st.text_input("Search saved profiles", placeholder="Username prefix")
+            if st.session_state.get("saved_search") != search:
+                st.session_state.saved_search = search
+                st.session_state.saved_pages = [None]  # start key of every page visited so far
+            try:
+                saved_users, next_after = get_saved_usernames(search, st.session_state.saved_pages[-1])
+            except Exception as e:
+                # Errors are raised out of the cached call so they are shown on every run, not cached
+                st.error(f"Error fetching saved usernames: {e}")
+                saved_users, next_after = [], None
             
-            if not saved_users:
+            if not saved_users and search:
+                st.warning(f"No saved profiles start with '{search}'.")
+            elif not saved_users:
                 st.warning("No saved profiles found. Use the 'New Scraper' option to scrape profiles first.")
             else:
                 # Format usernames with scrape dates for selection
                 user_options = [f"{username} (Scraped: {date})" for username, date in saved_users]
                 selected_option = st.selectbox("Select a saved profile:", user_options)
                 
+                # Page navigation
+                page = len(st.session_state.saved_pages)
+                nav_prev, nav_label, nav_next = st.columns([1, 2, 1])
+                with nav_prev:
+                    if st.button("◀ Previous", disabled=page == 1):
+                        st.session_state.saved_pages.pop()
+                        st.rerun()
+                with nav_label:
+                    st.caption(f"Page {page}")
+                with nav_next:
+                    if st.button("Next ▶", disabled=next_after is None):
+                        st.session_state.saved_pages.append(next_after)
+                        st.rerun()
+                
                 if selected_option:
                     # Extract username from selected option
                     selected_username = selected_option.split(" (Scraped:")[0]
                     
                     # Add action buttons
-                    col1, col2 = st.columns(2)
+                    col1, col2, col3 = st.columns(3)
                     with col1:
                         if st.button("Load Profile Data"):
-                            with st.spinner(f"Loading saved data for {selected_username}..."):
-                                user_info, images = load_saved_user(selected_username)
-                                
-                                # Display user info and images
-                                display_user_info(user_info)
-                                display_media_grid(images)
+                            # Remembered so grid paging and comment toggles survive reruns
+                            st.session_state.viewed_profile = selected_username
                     
                     with col2:
                         if st.button("Export to CSV"):
@@ -449,6 +462,74 @@ def main():
                                         )
                                 else:
                                     st.error(result)
+                    
+                    with col3:
+                        show_history = st.button("Show History")
+                    
+                    if show_history:
+                        with st.spinner(f"Loading history for {selected_username}..."):
+                            history = load_history(selected_username)
+                        if history.empty:
+                            st.info("No scrape history recorded for this profile yet.")
+                        else:
+                            st.subheader("Scrape History")
+                            st.line_chart(history.set_index("Scraped")[["Followers", "Following"]])
+                            st.dataframe(history, hide_index=True)
+                    
+                    if st.session_state.get("viewed_profile") == selected_username:
+                        with st.spinner(f"Loading saved data for {selected_username}..."):
+                            user_info, images = load_saved_user(selected_username)
+                        
+                        # Display user info and images
+                        display_user_info(user_info)
+                        display_media_grid(images, key="saved")
+                
+                # Collection-wide statistics computed by MongoDB aggregation pipelines
+                if st.toggle("📈 Collection insights", help="Runs aggregations over every stored profile"):
+                    import pandas as pd
+                    from features import stored_features
+                    try:
+                        st.write("*Top posts by likes*")
+                        st.dataframe(pd.DataFrame(top_posts(users_collection(), limit=10)), hide_index=True)
+                        st.write("*Average likes per profile*")
+                        st.dataframe(pd.DataFrame(average_likes(users_collection(), limit=20)), hide_index=True)
+                        st.write("*Profiles by follower range*")
+                        st.dataframe(pd.DataFrame(follower_ranges(users_collection())), hide_index=True)
+                        st.write("*Hashtags that go with above-average likes*")
+                        st.dataframe(stored_features.index(users_collection()).hashtag_engagement(), hide_index=True)
+                    except Exception as e:
+                        st.error(f"Error computing insights: {e}")
+                
+                # Streaming export of many profiles at once
+                with st.expander("📦 Bulk export"):
+                    col1, col2 = st.columns(2)
+                    with col1:
+                        export_format = st.selectbox("Format", EXPORT_FORMATS)
+                        export_layout = st.selectbox(
+                            "Layout", EXPORT_LAYOUTS,
+                            help="profiles: one wide row per profile; posts: one row per post; comments: one row per comment"
+                        )
+                    with col2:
+                        date_range = st.date_input("Scraped between", value=())
+                        export_usernames = st.text_area("Only these usernames (one per line, optional)")
+                    
+                    if st.button("Export collection"):
+                        filename = f"socialscan_{export_layout}.{export_format}"
+                        start, end = (date_range[0], date_range[-1]) if date_range else (None, None)
+                        if end is not None:
+                            end = datetime(end.year, end.month, end.day, 23, 59, 59)
+                        usernames_filter = [u.strip() for u in export_usernames.split("\n") if u.strip()]
+                        try:
+                            with st.spinner("Exporting..."):
+                                rows = export_collection(
+                                    users_collection(), filename, export_format, export_layout,
+                                    start=start, end=end, usernames=usernames_filter or None
+                                )
+                            st.success(f"Exported {rows} rows to {filename}")
+                            with open(filename, 'rb') as file:
+                                st.download_button(label="Download export", data=file, file_name=filename)
+                        except Exception as e:
+                            st.error(f"Error exporting data: {e}")
         
         # 3. Batch Scraper Option (Scrape multiple profiles at once)
         elif scraper_option == "Batch Scraper":
@@ -461,14 +542,25 @@ def main():
                 placeholder="username1\nusername2\nusername3"
             )
             
-            # Process rate limit
-            rate_limit = st.slider(
-                "Processing delay between requests (seconds)",
-                min_value=1,
-                max_value=10,
-                value=3,
-                help="Higher values reduce the risk of being rate-limited by Instagram"
-            )
+            # Request budget and concurrency
+            col1, col2 = st.columns(2)
+            with col1:
+                requests_per_minute = st.slider(
+                    "Request budget (requests per minute)",
+                    min_value=5,
+                    max_value=120,
+                    value=20,
+                    help="Shared by all profile and comment requests. Lower values reduce the risk of being rate-limited by Instagram"
+                )
+            with col2:
+                concurrency = st.slider(
+                    "Concurrent profiles",
+                    min_value=1,
+                    max_value=20,
+                    value=5,
+                    help="Number of profiles scraped in parallel"
+                )
+            force_refresh = st.checkbox("Force refresh", help="Ignore cached responses and fetch fresh data from Instagram")
             
             # Session state initialization for storing successful profiles
             if 'successful_profiles' not in st.session_state:
@@ -490,27 +582,45 @@ def main():
                         successful = []
                         failed = []
                         
-                        # Process each username
-                        for i, username in enumerate(usernames):
-                            status_text.text(f"Processing {i+1}/{len(usernames)}: {username}...")
-                            
+                        # Successful profiles are buffered and written with bulk upserts;
+                        # their jobs are marked done only once the write went through
+                        job_queue = get_job_queue()
+                        writer = BulkUpserter(users_collection(), history=history_collection(),
+                                              on_flush=job_queue.complete_many)
+                        
+                        # Record each profile as soon as it completes
+                        def on_result(done, total, username, user_info, images):
+                            status_text.text(f"Processed {done}/{total}: {username}")
                             try:
-                                # Scrape user data
-                                user_info, images = scrape_user(username)
-                                
-                                # Save to MongoDB if successful
-                                if not isinstance(user_info, str) and save_to_mongo(user_info, images):
-                                    successful.append(username)
+                                if isinstance(user_info, str):
+                                    failed.append((username, user_info))
                                 else:
-                                    failed.append((username, "Failed to save data"))
+                                    writer.add(user_info, images)
+                                    successful.append(username)
                             except Exception as e:
                                 failed.append((username, str(e)))
                             
                             # Update progress
-                            progress_bar.progress((i + 1) / len(usernames))
-                            
-                            # Sleep to avoid rate limiting
-                            time.sleep(rate_limit)
+                            progress_bar.progress(done / total)
+                        
+                        # Only this batch's jobs are run; those left over from an interrupted
+                        # run of the same usernames are picked up as well
+                        queued = job_queue.submit(usernames)
+                        status_text.text(f"Scraping {queued} profiles...")
+                        try:
+                            run_queue(
+                                job_queue,
+                                concurrency=concurrency,
+                                requests_per_minute=requests_per_minute,
+                                on_result=on_result,
+                                force_refresh=force_refresh,
+                                flush=writer.flush,
+                                usernames=usernames
+                            )
+                            writer.close()
+                        except Exception as e:
+                            # Unsaved jobs stay leased and are scraped again by the next run
+                            st.error(f"Error saving batch to MongoDB: {e}")
                         
                         # Store successful profiles in session state
                         st.session_state.successful_profiles = successful
@@ -539,32 +649,108 @@ def main():
                 )
                 
                 if st.button("View Selected Profile"):
+                    st.session_state.viewed_batch_profile = profile_to_view
+                
+                if st.session_state.get("viewed_batch_profile") == profile_to_view:
                     with st.spinner(f"Loading data for {profile_to_view}..."):
                         user_info, images = load_saved_user(profile_to_view)
-                        display_user_info(user_info)
-                        display_media_grid(images)
+                    display_user_info(user_info)
+                    display_media_grid(images, key="batch_selected")
                 
-                # Option 2: View all profiles in expanders
+                # Option 2: Browse all profiles, one page at a time; each loads only when asked for
                 if st.checkbox("Show all scraped profiles data"):
-                    for username in st.session_state.successful_profiles:
+                    profiles = st.session_state.successful_profiles
+                    start, end = page_selector(len(profiles), PROFILES_PAGE_SIZE, "batch_profiles_page")
+                    for username in profiles[start:end]:
                         with st.expander(f"Profile: {username}"):
-                            with st.spinner(f"Loading data for {username}..."):
-                                user_info, images = load_saved_user(username)
+                            if st.toggle("Load profile", key=f"batch_load_{username}"):
+                                with st.spinner(f"Loading data for {username}..."):
+                                    user_info, images = load_saved_user(username)
                                 display_user_info(user_info)
-                                display_media_grid(images)
+                                display_media_grid(images, key=f"batch_{username}")
+        
+        # 4. Graph Crawler Option (Follow related profiles outward from seed accounts)
+        elif scraper_option == "Graph Crawler":
+            st.subheader("Crawl Related Profiles")
+            st.markdown("Start from seed accounts and follow their related profiles breadth-first. "
+                        "Each profile is fetched once and saved, and the related-profile graph is stored in MongoDB.")
+            
+            seeds_input = st.text_area("Seed usernames (one per line):", placeholder="username1\nusername2")
+            col1, col2 = st.columns(2)
+            with col1:
+                max_depth = st.slider("Depth (hops from the seeds)", min_value=1, max_value=5, value=CRAWL_MAX_DEPTH)
+                requests_per_minute = st.slider("Request budget (requests per minute)", min_value=5, max_value=120,
+                                                value=20, key="crawl_rpm")
+            with col2:
+                max_profiles = st.number_input("Profile budget", min_value=1, max_value=50_000,
+                                               value=CRAWL_MAX_PROFILES, step=50)
+                concurrency = st.slider("Concurrent profiles", min_value=1, max_value=20, value=5, key="crawl_concurrency")
+            visited_path = st.text_input("Visited store (optional)", placeholder="crawl.sqlite3",
+                                         help="SQLite file of visited usernames; start again with the same file "
+                                              "to resume a stopped crawl")
+            
+            if st.button("Start Crawl"):
+                seeds = [u.strip() for u in seeds_input.split("\n") if u.strip()]
+                if not seeds:
+                    st.error("Please enter at least one seed username.")
+                else:
+                    progress_bar = st.progress(0)
+                    status_text = st.empty()
+                    failed = []
+                    writer = BulkUpserter(users_collection(), history=history_collection())
+                    
+                    def on_result(done, total, username, user_info, images):
+                        status_text.text(f"Fetched {done}/{total}: {username}")
+                        if isinstance(user_info, str):
+                            failed.append((username, user_info))
+                        else:
+                            writer.add(user_info, images)
+                        progress_bar.progress(min(done / total, 1.0))
+                    
+                    summary = run_crawl(users_collection(), seeds, max_depth, int(max_profiles),
+                                        concurrency=concurrency,
+                                        requests_per_minute=requests_per_minute, on_result=on_result,
+                                        visited_path=visited_path.strip() or None)
+                    try:
+                        writer.close()
+                    except Exception as e:
+                        st.error(f"Error saving crawl to MongoDB: {e}")
+                    progress_bar.progress(1.0)
+                    st.success(f"✅ Crawl complete: fetched {summary['fetched']} profiles, "
+                               f"{summary['unfetched_frontier']} left in the frontier, {summary['new_edges']} new edges.")
+                    if failed:
+                        with st.expander("Failed to scrape profiles"):
+                            for username, error in failed:
+                                st.write(f"- {username}: {error}")
+            
+            if st.toggle("Most referenced profiles"):
+                import pandas as pd
+                try:
+                    referenced = most_referenced(users_collection())
+                    if referenced:
+                        st.dataframe(pd.DataFrame(referenced), use_container_width=True)
+                    else:
+                        st.info("No crawl graph stored yet.")
+                except Exception as e:
+                    st.error(f"Error reading the crawl graph: {e}")
     
     # User Behavior Analysis Module
     elif app_mode == "User Behavior Analysis":
+        import pandas as pd
+        from analytics import RANKING_METRICS, engagement
+        from dataset import DATA_PATH, dataset_store
+        from features import dataset_features
+        from similarity import similar_profiles
+
         st.header("📊 User Behavior Analysis")
         st.markdown("Analyze social media behavior and engagement patterns.")
         
         # Check if dataset exists
-        if not os.path.exists('dataset1_train.csv'):
-            st.error("Dataset not found. Please make sure 'dataset1_train.csv' is in the same directory as this script.")
+        if not os.path.exists(DATA_PATH):
+            st.error(f"Dataset not found. Please make sure '{DATA_PATH}' is in the same directory as this script.")
         else:
             try:
-                data = pd.read_csv('dataset1_train.csv')
-                usernames = data['user_info.Username'].unique()
+                usernames = dataset_store.usernames()
                 
                 # Select username
                 selected_user = st.selectbox("👤 Select a username", usernames)
@@ -580,6 +766,9 @@ def main():
                         st.write(f"*Category:* {behavior['category']}")
                         st.write(f"*Related Profiles:* {behavior['related_profiles']}")
                         st.write(f"*Average Engagement Score:* {behavior['avg_likes']:.2f}")
+                        st.write(f"*Median / P90 Likes:* {behavior['median_likes']:.0f} / {behavior['p90_likes']:.0f}")
+                        if pd.notna(behavior['engagement_rate']):
+                            st.write(f"*Likes per Follower:* {behavior['engagement_rate']:.2%}")
                         
                         # Replace the table display code in the User Behavior Analysis section
 
@@ -604,15 +793,73 @@ def main():
                             hide_index=True
                         )
                         
+                        # Caption features are tokenized once per dataset version
+                        caption_index = dataset_features.index()
+                        caption_summary = caption_index.summary(selected_user)
+                        st.write("### 🏷 Caption Features:")
+                        col1, col2, col3 = st.columns(3)
+                        col1.metric("Mean caption length", f"{caption_summary['mean_length']:.0f}")
+                        col2.metric("Hashtags per post", f"{caption_summary['hashtags_per_post']:.1f}")
+                        col3.metric("Emoji per post", f"{caption_summary['emoji_per_post']:.1f}")
+                        st.write(f"*Top terms:* {', '.join(term for term, _ in caption_index.top_terms(selected_user))}")
+                        if caption_summary['top_hashtags']:
+                            st.write(f"*Top hashtags:* {', '.join(caption_summary['top_hashtags'])}")
+                        if caption_summary['top_mentions']:
+                            st.write(f"*Top mentions:* {', '.join(caption_summary['top_mentions'])}")
+                        
+                        # Nearest profiles by caption, engagement and category vectors
+                        similar = similar_profiles.index().query(selected_user)
+                        if similar:
+                            st.write("### 👥 Similar Profiles:")
+                            similar_df = pd.DataFrame(similar, columns=["Username", "Similarity"])
+                            engagement_by_user = engagement.metrics.drop_duplicates("username").set_index("username")
+                            similar_df = similar_df.join(
+                                engagement_by_user[["followers", "mean_likes", "engagement_rate"]], on="Username"
+                            )
+                            st.dataframe(similar_df, hide_index=True)
+                        
                         # Generate LLM response if query is provided
                         if query:
                             st.write("### 🤖 LLM Response:")
-                            result = generate_prompt(selected_user, query)
-                            st.write(result)
+                            st.write_stream(generate_prompt(selected_user, query, behavior))
                     else:
                         st.write("⚠ No data available for the selected user.")
+                
+                # Cross-profile ranking from the cached cohort metrics
+                with st.expander("🏆 Rank all profiles"):
+                    metric = st.selectbox("Rank by", RANKING_METRICS)
+                    limit = st.number_input("Profiles to show", min_value=1, max_value=1000, value=20)
+                    st.dataframe(engagement.ranking(metric, int(limit)), hide_index=True)
+                
+                # Hashtag usage against likes across the whole dataset
+                with st.expander("#️⃣ Hashtags vs engagement"):
+                    min_posts = st.number_input("Minimum posts per hashtag", min_value=1, max_value=100, value=3)
+                    st.dataframe(dataset_features.index().hashtag_engagement(int(min_posts)), hide_index=True)
+                
+                # Ask the same question about many profiles at once
+                with st.expander("📝 Batch LLM report"):
+                    report_users = st.multiselect("Profiles", usernames)
+                    report_query = st.text_input("Question for every profile", key="report_query")
+                    if st.button("Generate report") and report_users and report_query:
+                        progress_bar = st.progress(0)
+                        items = []
+                        for username in report_users:
+                            behavior = engagement.profile(username)
+                            if behavior and behavior['sorted_likes_captions']:
+                                items.append((username, behavior, report_query))
+                        answers = ask_many(items, on_result=lambda done, total, *_: progress_bar.progress(done / total))
+                        report = pd.DataFrame({"Username": [item[0] for item in items], "Answer": answers})
+                        st.dataframe(report, hide_index=True)
+                        st.download_button("Download report", report.to_csv(index=False), "llm_report.csv", "text/csv")
+                st.caption(f"LLM: {llm_client.model} at {llm_client.http.base_url}")
             except Exception as e:
                 st.error(f"Error loading the dataset: {e}")
 
+    show_storage_notices()
+
+    # Rendered last so it includes the work done on this run
+    record_run(time.perf_counter() - RUN_STARTED)
+    display_diagnostics()
+
 if __name__ == "__main__":
     main()
\ No newline at end of file
@@ -0,0 +1,131 @@
+import asyncio
+import time
+import httpx
+
+from metrics import InstrumentedTransport, queue_depth, timed
+from scraper import make_async_client, rate_limit_clock, scrape_user_async
+
+
+class TokenBucket:
+    """Async token-bucket rate limiter shared by every request of a batch.
+
+    ``rate`` is the sustained number of requests per second and ``capacity``
+    the largest burst allowed after an idle period.
+    """
+
+    def __init__(self, rate: float, capacity: float = 1.0):
+        if rate <= 0:
+            raise ValueError("rate must be positive")
+        self.rate = rate
+        self.capacity = max(capacity, 1.0)
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    async def acquire(self):
+        """Wait until a token is available and take it."""
+        # Holding the lock while sleeping keeps waiters in FIFO order
+        async with self._lock:
+            self._refill()
+            while self._tokens < 1:
+                await asyncio.sleep((1 - self._tokens) / self.rate)
+                self._refill()
+            self._tokens -= 1
+
+    def defer(self, seconds):
+        """Hold back every caller for ``seconds``, e.g. when the server sent Retry-After."""
+        self._refill()
+        self._tokens = min(self._tokens, 1 - seconds * self.rate)
+
+
+class RateLimitedTransport(httpx.AsyncBaseTransport):
+    """Takes a token from ``limiter`` before every request that reaches the network.
+
+    It sits behind the response cache, so cache hits do not spend budget.
+    Requests are timed after the token is taken, so HTTP latency metrics do
+    not include time spent waiting on the limiter; that is recorded as the
+    ``rate_limit_wait`` stage, and the comment stage's deadline clock is
+    told when a request starts waiting, gets its token and is answered.
+    """
+
+    instrumented = True
+
+    def __init__(self, limiter, transport):
+        self.limiter = limiter
+        self.transport = InstrumentedTransport(transport)
+
+    async def handle_async_request(self, request):
+        clock = rate_limit_clock.get()
+        if clock is not None:
+            clock.pause()
+        try:
+            with timed("rate_limit_wait"):
+                await self.limiter.acquire()
+        except BaseException:
+            if clock is not None:
+                clock.resume(sending=False)
+            raise
+        if clock is None:
+            return await self.transport.handle_async_request(request)
+        clock.resume()
+        try:
+            return await self.transport.handle_async_request(request)
+        finally:
+            clock.done()
+
+    async def aclose(self):
+        await self.transport.aclose()
+
+
+async def scrape_batch(usernames, concurrency=5, requests_per_minute=20, on_result=None,
+                       force_refresh=False, transport=None, **comment_options):
+    """Scrape ``usernames`` concurrently and return ``(username, user_info, images)`` tuples.
+
+    At most ``concurrency`` profiles are in flight at once, and all profile
+    and comment requests that miss the response cache share a single token
+    bucket so the overall request rate never exceeds ``requests_per_minute``.
+    ``on_result`` is called with ``(done, total, username, user_info, images)``
+    as each profile completes.
+    ``transport`` replaces the network transport (e.g. a mock), and extra
+    keyword arguments are passed to scrape_user_async to tune the comment
+    stage.
+    """
+    limiter = TokenBucket(requests_per_minute / 60.0)
+    semaphore = asyncio.Semaphore(concurrency)
+    if transport is None:
+        limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+        transport = httpx.AsyncHTTPTransport(limits=limits)
+
+    async with make_async_client(RateLimitedTransport(limiter, transport), force_refresh) as async_client:
+
+        async def worker(username):
+            state = "waiting"
+            try:
+                async with semaphore:
+                    queue_depth("batch", "waiting", -1)
+                    queue_depth("batch", "running", 1)
+                    state = "running"
+                    user_info, images = await scrape_user_async(username, async_client, **comment_options)
+            finally:
+                queue_depth("batch", state, -1)
+            return username, user_info, images
+
+        results = []
+        queue_depth("batch", "waiting", len(usernames))
+        tasks = [asyncio.create_task(worker(username)) for username in usernames]
+        for done, task in enumerate(asyncio.as_completed(tasks), start=1):
+            username, user_info, images = await task
+            results.append((username, user_info, images))
+            if on_result is not None:
+                on_result(done, len(tasks), username, user_info, images)
+        return results
+
+
+def run_batch(usernames, concurrency=5, requests_per_minute=20, on_result=None, **options):
+    """Synchronous entry point for scrape_batch, usable from the Streamlit script thread."""
+    return asyncio.run(scrape_batch(usernames, concurrency, requests_per_minute, on_result, **options))
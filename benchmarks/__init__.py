@@ -0,0 +1 @@
+"""Offline benchmarks of the scrape, storage, export and analysis paths; see benchmarks.run."""
@@ -0,0 +1,84 @@
+import asyncio
+import hashlib
+import json
+import os
+import random
+import time
+import httpx
+
+# ===================== FIXTURE REPLAY =====================
+# web_profile_info and comments payloads in fixtures/ are served for every
+# username and post, with the fixture's username, user ID and post IDs
+# rewritten so each profile is distinct.
+FIXTURES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fixtures")
+FIXTURE_USERNAME = "fixture_user"
+FIXTURE_USER_ID = "1000000001"
+FIXTURE_POST_PREFIX = "31000000000000000"
+
+
+def load_fixture(name):
+    with open(os.path.join(FIXTURES_DIR, name), encoding="utf-8") as f:
+        return f.read()
+
+
+def user_id_for(username):
+    return str(int(hashlib.sha1(username.encode("utf-8")).hexdigest()[:12], 16))
+
+
+class FixtureServer:
+    """Answers profile and comment requests from the recorded fixtures.
+
+    Every request waits ``latency`` seconds (plus up to ``jitter``) before
+    the response is returned. ``comment_pages`` pages of comments are served
+    per post. Usernames in ``missing`` get a 404 like a deleted account.
+    ``started`` maps each requested username to when its profile request
+    arrived, so callers can time whole profiles.
+    """
+
+    def __init__(self, latency=0.05, jitter=0.0, comment_pages=2, missing=(), seed=0):
+        self.latency = latency
+        self.jitter = jitter
+        self.comment_pages = comment_pages
+        self.missing = set(missing)
+        self.requests = 0
+        self.bytes = 0
+        self.started = {}
+        self._random = random.Random(seed)
+        # Rewritable placeholders in place of the fixture's identifiers
+        self._profile = (load_fixture("web_profile_info.json")
+                         .replace(FIXTURE_USERNAME, "{{USERNAME}}")
+                         .replace(FIXTURE_USER_ID, "{{USER_ID}}")
+                         .replace(FIXTURE_POST_PREFIX, "{{USER_ID}}_"))
+        self._comments = json.loads(load_fixture("comments.json"))
+
+    def _delay(self):
+        return self.latency + (self._random.uniform(0, self.jitter) if self.jitter else 0.0)
+
+    def respond(self, request):
+        self.requests += 1
+        url = request.url
+        if "/users/web_profile_info/" in url.path:
+            username = url.params.get("username", "")
+            if username in self.missing:
+                return httpx.Response(404, request=request)
+            body = (self._profile.replace("{{USERNAME}}", username)
+                    .replace("{{USER_ID}}", user_id_for(username))).encode("utf-8")
+        elif "/comments/" in url.path:
+            page = int(url.params.get("max_id") or 0)
+            payload = dict(self._comments, has_more_comments=page + 1 < self.comment_pages,
+                           next_max_id=str(page + 1) if page + 1 < self.comment_pages else None)
+            body = json.dumps(payload).encode("utf-8")
+        else:
+            return httpx.Response(404, request=request)
+        self.bytes += len(body)
+        return httpx.Response(200, content=body, headers={"content-type": "application/json"}, request=request)
+
+    async def handle(self, request):
+        if "/users/web_profile_info/" in request.url.path:
+            self.started.setdefault(request.url.params.get("username", ""), time.perf_counter())
+        await asyncio.sleep(self._delay())
+        return self.respond(request)
+
+    def transport(self):
+        """An httpx.MockTransport serving this fixture set to async clients."""
+        return httpx.MockTransport(self.handle)
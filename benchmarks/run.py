@@ -0,0 +1,408 @@
+"""Offline SocialScan benchmarks.
+
+    python -m benchmarks
+    python -m benchmarks --profiles 500 --latency 0.1 --jitter 0.05
+    python -m benchmarks --stages analyze --dataset-sizes 100,10000,1000000 --json results.json
+
+Nothing touches the network. ``scrape`` replays the recorded web_profile_info
+and comments payloads in benchmarks/fixtures through an httpx mock transport
+that waits ``--latency`` seconds per request. ``store`` and ``export`` write to
+an in-memory MongoDB stand-in (mongomock) or to the server given with
+``--mongo-uri``. ``analyze`` and ``features`` run on generated datasets shaped
+like dataset1_train.csv, one per ``--dataset-sizes`` entry. Every stage
+reports wall time, per-operation latency percentiles, throughput and peak
+resident memory. Caches and generated files live in a temporary directory
+that is removed afterwards (kept with ``--workdir``).
+"""
+import argparse
+import asyncio
+import gc
+import json
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+import numpy as np
+
+from benchmarks.replay import FixtureServer, load_fixture
+from benchmarks.synthetic import generate_dataset
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+# ===================== BENCHMARK RUNNER =====================
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+STAGES = ("scrape", "store", "export", "analyze", "features")
+DEFAULT_STAGES = ("scrape", "store", "export", "analyze")
+DEFAULT_DATASET_SIZES = "100,1000,10000,100000"
+BENCH_DB = "socialscan_bench"
+LOOKUP_SAMPLE = 1000
+RSS_SAMPLE_SECONDS = 0.005
+PAGE_SIZE = os.sysconf("SC_PAGE_SIZE") if hasattr(os, "sysconf") else 4096
+MB = 1024 * 1024
+
+
+def latency_summary(latencies):
+    if not latencies:
+        return {}
+    p50, p90, p99 = np.percentile(latencies, [50, 90, 99]) * 1000
+    return {"p50_ms": round(p50, 3), "p90_ms": round(p90, 3), "p99_ms": round(p99, 3),
+            "max_ms": round(max(latencies) * 1000, 3)}
+
+
+def max_rss_mb():
+    if resource is None:
+        return None
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Kilobytes on Linux, bytes on macOS
+    return round(rss / (1024 * 1024 if sys.platform == "darwin" else 1024), 1)
+
+
+class RssSampler:
+    """Samples the resident set size in a background thread and keeps the peak.
+
+    Reads /proc/self/statm, so ``peak`` stays None on systems without it.
+    Sampling costs far less than tracemalloc, which slows pure-Python code
+    such as mongomock severalfold.
+    """
+
+    def __init__(self, interval=RSS_SAMPLE_SECONDS):
+        self.interval = interval
+        self.peak = None
+        self._stop = threading.Event()
+        self._thread = None
+
+    @staticmethod
+    def current():
+        try:
+            with open("/proc/self/statm") as f:
+                return int(f.read().split()[1]) * PAGE_SIZE
+        except (OSError, ValueError, IndexError):
+            return None
+
+    def _run(self):
+        while True:
+            rss = self.current()
+            if rss is None:
+                return
+            self.peak = max(self.peak or 0, rss)
+            if self._stop.wait(self.interval):
+                return
+
+    def __enter__(self):
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self._stop.set()
+        self._thread.join()
+        rss = self.current()
+        if rss is not None:
+            self.peak = max(self.peak or 0, rss)
+
+
+def measure(name, work, trace_memory=False, **details):
+    """Run ``work()``, which returns ``(items, latencies, extra)``, and describe the run.
+
+    ``peak_rss_mb`` is the highest resident memory seen during the stage and
+    ``rss_growth_mb`` how far it rose above the level at the start. With
+    ``trace_memory`` the peak of Python allocations (numpy and pandas buffers
+    included) is reported as ``traced_peak_mb``, at the cost of much slower
+    pure-Python stages.
+    """
+    gc.collect()
+    baseline = RssSampler.current()
+    if trace_memory:
+        tracemalloc.start()
+    started = time.perf_counter()
+    try:
+        with RssSampler() as sampler:
+            items, latencies, extra = work()
+    finally:
+        seconds = time.perf_counter() - started
+        traced = tracemalloc.get_traced_memory()[1] if trace_memory else None
+        if trace_memory:
+            tracemalloc.stop()
+    result = {"stage": name, **details, "items": items, "seconds": round(seconds, 3),
+              "per_second": round(items / seconds, 1) if seconds > 0 else None}
+    result.update(latency_summary(latencies))
+    if sampler.peak is not None:
+        result["peak_rss_mb"] = round(sampler.peak / MB, 1)
+        result["rss_growth_mb"] = round((sampler.peak - baseline) / MB, 1)
+    else:
+        result["max_rss_mb"] = max_rss_mb()
+    if traced is not None:
+        result["traced_peak_mb"] = round(traced / MB, 1)
+    result.update(extra)
+    print(format_result(result), file=sys.stderr)
+    return result
+
+
+def format_result(result):
+    shown = [f"{result['stage']:<18}"]
+    shown += [f"{key}={value}" for key, value in result.items() if key != "stage" and value is not None]
+    return "  ".join(shown)
+
+
+def bench_usernames(count):
+    return [f"bench_{i:06d}" for i in range(count)]
+
+
+def fixture_scrapes(usernames, comment_pages):
+    """``(user_info, images)`` for every username, parsed from the fixtures as the scraper would."""
+    from scraper import parse_comments, parse_profile
+    server = FixtureServer(comment_pages=comment_pages)
+    comments = parse_comments(json.loads(load_fixture("comments.json"))) * comment_pages
+    scrapes = []
+    for username in usernames:
+        user_info, images = parse_profile(server.respond(_profile_request(username)))
+        for image in images:
+            image.comments = comments
+        scrapes.append((user_info, images))
+    return scrapes
+
+
+def _profile_request(username):
+    import httpx
+    from scraper import PROFILE_URL
+    return httpx.Request("GET", PROFILE_URL.format(username=username))
+
+
+def open_database(args):
+    """An empty benchmark database on ``--mongo-uri``, or in mongomock by default."""
+    if args.mongo_uri:
+        from pymongo import MongoClient
+        client = MongoClient(args.mongo_uri)
+    else:
+        try:
+            import mongomock
+        except ImportError:
+            raise SystemExit("The in-memory MongoDB stand-in needs mongomock (pip install mongomock); "
+                             "or pass --mongo-uri to benchmark against a real server.")
+        client = mongomock.MongoClient()
+    client.drop_database(BENCH_DB)
+    return client, client[BENCH_DB]
+
+
+def fresh_collection(database):
+    from storage import ensure_indexes
+    for name in database.list_collection_names():
+        database.drop_collection(name)
+    collection = database["users"]
+    ensure_indexes(collection)
+    return collection
+
+
+# ===================== STAGES =====================
+def bench_scrape(args):
+    from batch import scrape_batch
+
+    def work():
+        server = FixtureServer(args.latency, args.jitter, args.comment_pages, seed=args.seed)
+        latencies = []
+
+        def on_result(done, total, username, user_info, images):
+            latencies.append(time.perf_counter() - server.started[username])
+
+        # No rate limit: the stage measures the pipeline, not the request budget
+        results = asyncio.run(scrape_batch(
+            bench_usernames(args.profiles), args.concurrency, requests_per_minute=1e9, on_result=on_result,
+            force_refresh=True, transport=server.transport(), comment_pages=args.comment_pages,
+        ))
+        failed = sum(1 for _, user_info, _ in results if isinstance(user_info, str))
+        return len(results), latencies, {"requests": server.requests, "mb_received": round(server.bytes / 1e6, 2),
+                                         "failed": failed}
+
+    return [measure("scrape", work, args.trace_memory, latency_s=args.latency, concurrency=args.concurrency)]
+
+
+def bench_store(args, database):
+    from storage import BulkUpserter, upsert_user
+    scrapes = fixture_scrapes(bench_usernames(args.profiles), args.comment_pages)
+    results = []
+
+    def upserts():
+        collection = fresh_collection(database)
+        latencies = []
+        for user_info, images in scrapes:
+            started = time.perf_counter()
+            upsert_user(collection, user_info, images)
+            latencies.append(time.perf_counter() - started)
+        return len(scrapes), latencies, {}
+
+    def bulk():
+        collection = fresh_collection(database)
+        with BulkUpserter(collection) as upserter:
+            for user_info, images in scrapes:
+                upserter.add(user_info, images)
+        return len(scrapes), [], {"inserted": upserter.inserted}
+
+    results.append(measure("store.upsert", upserts, args.trace_memory))
+    results.append(measure("store.bulk", bulk, args.trace_memory))
+    return results
+
+
+def bench_export(args, database):
+    from export import export_collection
+    from storage import BulkUpserter, load_user
+    collection = database["users"]
+    if collection.estimated_document_count() < args.profiles:
+        collection = fresh_collection(database)
+        with BulkUpserter(collection) as upserter:
+            for user_info, images in fixture_scrapes(bench_usernames(args.profiles), args.comment_pages):
+                upserter.add(user_info, images)
+    results = []
+
+    for fmt in ("csv", "parquet"):
+        path = os.path.abspath(f"export.{fmt}")
+
+        def work():
+            rows = export_collection(collection, path, fmt)
+            return rows, [], {"mb_written": round(os.path.getsize(path) / 1e6, 2)}
+
+        try:
+            results.append(measure(f"export.{fmt}", work, args.trace_memory))
+        except RuntimeError as e:
+            print(f"export.{fmt}: skipped ({e})", file=sys.stderr)
+
+    def lookups():
+        latencies = []
+        for username in bench_usernames(min(args.profiles, LOOKUP_SAMPLE)):
+            started = time.perf_counter()
+            load_user(collection, username, with_comments=False)
+            latencies.append(time.perf_counter() - started)
+        return len(latencies), latencies, {}
+
+    results.append(measure("load_user", lookups, args.trace_memory))
+    return results
+
+
+def bench_datasets(args, with_features):
+    from analytics import RANKING_METRICS, EngagementAnalytics
+    from dataset import DatasetStore
+    from features import DatasetCaptionFeatures
+    results = []
+    rng = np.random.default_rng(args.seed)
+
+    for size in args.dataset_sizes:
+        path = os.path.abspath(f"dataset_{size}.csv")
+        if not os.path.exists(path):
+            def generate():
+                written = generate_dataset(path, size, args.seed)
+                return size, [], {"mb": round(written / 1e6, 1)}
+
+            results.append(measure("generate", generate, args.trace_memory, profiles=size))
+        analytics = EngagementAnalytics(DatasetStore(path))
+
+        def load():
+            analytics.refresh()
+            return len(analytics.data), [], {"posts": len(analytics.posts)}
+
+        def lookups():
+            usernames = analytics.metrics["username"].to_numpy()
+            latencies = []
+            for username in rng.choice(usernames, min(size, LOOKUP_SAMPLE), replace=False):
+                started = time.perf_counter()
+                analytics.profile(username)
+                latencies.append(time.perf_counter() - started)
+            return len(latencies), latencies, {}
+
+        def rankings():
+            latencies = []
+            for metric in RANKING_METRICS:
+                started = time.perf_counter()
+                analytics.ranking(metric)
+                latencies.append(time.perf_counter() - started)
+            return len(latencies), latencies, {}
+
+        results.append(measure("analyze.load", load, args.trace_memory, profiles=size))
+        results.append(measure("analyze.profile", lookups, args.trace_memory, profiles=size))
+        results.append(measure("analyze.ranking", rankings, args.trace_memory, profiles=size))
+
+        if with_features:
+            def features():
+                index = DatasetCaptionFeatures(analytics).index()
+                return len(index.posts), [], {"terms": len(index.vocabulary), "entries": len(index.values)}
+
+            results.append(measure("features.tfidf", features, args.trace_memory, profiles=size))
+    return results
+
+
+# ===================== CLI =====================
+def sizes(value):
+    return [int(size.replace("_", "")) for size in value.split(",") if size.strip()]
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(prog="python -m benchmarks",
+                                     description="Offline latency, throughput and memory benchmarks.")
+    parser.add_argument("--stages", default=",".join(DEFAULT_STAGES),
+                        help=f"Comma-separated stages out of {', '.join(STAGES)} (default: %(default)s).")
+    parser.add_argument("--profiles", type=int, default=200, help="Profiles to scrape, store and export.")
+    parser.add_argument("--latency", type=float, default=0.05, help="Seconds the mock server takes per request.")
+    parser.add_argument("--jitter", type=float, default=0.0, help="Extra random latency of up to this many seconds.")
+    parser.add_argument("--concurrency", type=int, default=20, help="Profiles scraped at once.")
+    parser.add_argument("--comment-pages", type=int, default=2, help="Comment pages served per post.")
+    parser.add_argument("--dataset-sizes", type=sizes, default=sizes(DEFAULT_DATASET_SIZES),
+                        help="Comma-separated profile counts of the generated datasets (default: %(default)s).")
+    parser.add_argument("--mongo-uri", help="Benchmark against this MongoDB server instead of mongomock. "
+                                            f"The {BENCH_DB} database is dropped first.")
+    parser.add_argument("--trace-memory", action="store_true",
+                        help="Also report peak Python allocations with tracemalloc (slows pure-Python stages).")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--workdir", help="Keep generated datasets and caches here instead of a temporary directory.")
+    parser.add_argument("--json", dest="json_path", help="Also write the results to this JSON file.")
+    return parser
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    stages = [stage.strip() for stage in args.stages.split(",") if stage.strip()]
+    unknown = set(stages) - set(STAGES)
+    if unknown:
+        raise SystemExit(f"Unknown stages: {', '.join(sorted(unknown))}")
+    json_path = os.path.abspath(args.json_path) if args.json_path else None
+
+    # The project's caches live under relative paths, so the working
+    # directory is switched before any project module is imported.
+    workdir = os.path.abspath(args.workdir) if args.workdir else tempfile.mkdtemp(prefix="socialscan-bench-")
+    os.makedirs(workdir, exist_ok=True)
+    previous = os.getcwd()
+    sys.path.insert(0, REPO_ROOT)
+    os.chdir(workdir)
+    results = []
+    client = None
+    try:
+        if "scrape" in stages:
+            results += bench_scrape(args)
+        if "store" in stages or "export" in stages:
+            client, database = open_database(args)
+            if "store" in stages:
+                results += bench_store(args, database)
+            if "export" in stages:
+                results += bench_export(args, database)
+            client.drop_database(BENCH_DB)
+        if "analyze" in stages or "features" in stages:
+            results += bench_datasets(args, "features" in stages)
+    finally:
+        if client is not None:
+            client.close()
+        os.chdir(previous)
+        if not args.workdir:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    settings = {key: value for key, value in vars(args).items() if key not in ("json_path", "mongo_uri")}
+    settings["mongo"] = "server" if args.mongo_uri else "mongomock"
+    report = {"settings": settings,
+              "results": results}
+    print(json.dumps(report, indent=2))
+    if json_path:
+        with open(json_path, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+    return 0
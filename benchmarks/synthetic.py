@@ -0,0 +1,107 @@
+import numpy as np
+import pandas as pd
+
+# ===================== SYNTHETIC DATASETS =====================
+# Datasets with the column layout of dataset1_train.csv: profile fields, 80
+# related-profile slots and 12 post slots in each of the three per-post
+# layouts. Posts are written to the user_info.Images layout; the other
+# layouts are present but empty, as in most rows of the real file.
+POSTS_PER_PROFILE = 12
+RELATED_SLOTS = 80
+CHUNK_ROWS = 20_000
+CAPTION_POOL = 5_000
+VOCABULARY_SIZE = 20_000
+
+PROFILE_FIELDS = ["Username", "Full Name", "ID", "Followers", "Following", "Biography", "Category",
+                  "Is Private", "Is Verified", "Related Profiles"]
+EXTRA_FIELDS = ["Business Category", "Phone", "Email", "Homepage", "Facebook ID", "Profile Image", "Video Count",
+                "Image Count", "Saved Count", "Collections Count"]
+CATEGORIES = ["Athlete", "Comedian", "Musician/band", "Digital creator", "Artist", "Public figure",
+              "Sports team", "Clothing (Brand)", "Actor", "Entrepreneur"]
+WORDS = ("match day training studio tour live new drop family friends sunset beach city night launch "
+         "collab behind scenes thank you grateful love team win season album show").split()
+HASHTAGS = ["#travel", "#fitness", "#music", "#fashion", "#food", "#art", "#cricket", "#tour", "#ad", "#love"]
+SYLLABLES = "ka lo mi ra ne so tu vi pa de zo ri ma lu fe no sa ti be go".split()
+EMOJI = ["❤️", "🔥", "😂", "🙏", "✨", "😭", "💪", "🏏"]
+
+
+def dataset_columns():
+    """Column names in the order dataset1_train.csv has them."""
+    columns = ["_id"] + [f"user_info.{field}" for field in PROFILE_FIELDS]
+    for field in ("ID", "Likes", "Caption"):
+        columns += [f"user_info.Images[{i}].{field}" for i in range(POSTS_PER_PROFILE)]
+    for field in ("image_ids", "image_likes", "captions"):
+        columns += [f"images.{field}[{i}]" for i in range(POSTS_PER_PROFILE)]
+    columns += ["timestamp"] + [f"user_info.{field}" for field in EXTRA_FIELDS]
+    columns += [f"user_info.Related Profiles[{i}]" for i in range(RELATED_SLOTS)]
+    for field in ("ID", "Source", "Likes", "Caption"):
+        columns += [f"images[{i}].{field}" for i in range(POSTS_PER_PROFILE)]
+    return columns
+
+
+def vocabulary(rng, size=VOCABULARY_SIZE):
+    """Made-up words, so captions have a long tail of rare terms like real ones."""
+    syllables = np.array(SYLLABLES, dtype=object)
+    words = syllables[rng.integers(0, len(syllables), size)]
+    for _ in range(2):
+        words = words + syllables[rng.integers(0, len(syllables), size)]
+    return rng.permutation(np.unique(words))
+
+
+def caption_pool(rng, size=CAPTION_POOL):
+    """Captions mixing common and Zipf-distributed rare words, hashtags, mentions and emoji."""
+    rare = vocabulary(rng)
+    captions = []
+    for i in range(size):
+        common = list(rng.choice(WORDS, rng.integers(2, 10)))
+        tail = list(rare[np.minimum(rng.zipf(1.3, rng.integers(1, 6)), len(rare)) - 1])
+        words = " ".join(rng.permutation(np.array(common + tail, dtype=object)))
+        tags = " ".join(rng.choice(HASHTAGS, rng.integers(0, 4), replace=False))
+        mention = f" @friend_{rng.integers(1000)}" if i % 4 == 0 else ""
+        captions.append(f"{words.capitalize()} {rng.choice(EMOJI)} {tags}{mention}".strip())
+    return np.array(captions, dtype=object)
+
+
+def generate_chunk(rng, start, rows, captions):
+    """One DataFrame of ``rows`` synthetic profiles numbered from ``start``."""
+    numbers = np.arange(start, start + rows)
+    usernames = np.char.add("user", np.char.zfill(numbers.astype(str), 7)).astype(object)
+    followers = np.maximum(rng.lognormal(9, 2.2, rows), 10).astype(np.int64)
+    frame = {
+        "_id": np.char.add("syn", numbers.astype(str)).astype(object),
+        "user_info.Username": usernames,
+        "user_info.Full Name": np.char.add("Synthetic ", numbers.astype(str)).astype(object),
+        "user_info.ID": (10_000_000 + numbers).astype(str).astype(object),
+        "user_info.Followers": followers,
+        "user_info.Following": rng.integers(0, 3000, rows),
+        "user_info.Biography": captions[rng.integers(0, len(captions), rows)],
+        "user_info.Category": np.array(CATEGORIES, dtype=object)[rng.integers(0, len(CATEGORIES), rows)],
+        "user_info.Is Private": "false",
+        "user_info.Image Count": POSTS_PER_PROFILE,
+        "user_info.Is Verified": np.where(followers > 1_000_000, "true", "false"),
+    }
+    related = (numbers[:, None] + rng.integers(1, 5000, (rows, 5))).astype(str)
+    frame["user_info.Related Profiles"] = [", ".join("user" + r.zfill(7) for r in row) for row in related]
+
+    # Likes scale with followers through a per-profile engagement rate
+    rate = rng.lognormal(-3.5, 0.8, rows)
+    likes = (followers[:, None] * rate[:, None] * rng.lognormal(0, 0.6, (rows, POSTS_PER_PROFILE))).astype(np.int64)
+    post_ids = (numbers[:, None] * 100 + np.arange(POSTS_PER_PROFILE)).astype(str)
+    picks = rng.integers(0, len(captions), (rows, POSTS_PER_PROFILE))
+    for i in range(POSTS_PER_PROFILE):
+        frame[f"user_info.Images[{i}].ID"] = post_ids[:, i].astype(object)
+        frame[f"user_info.Images[{i}].Likes"] = likes[:, i]
+        frame[f"user_info.Images[{i}].Caption"] = captions[picks[:, i]]
+    frame["timestamp"] = 1_735_000_000 + numbers
+    return pd.DataFrame(frame).reindex(columns=dataset_columns())
+
+
+def generate_dataset(path, profiles, seed=0, chunk_rows=CHUNK_ROWS):
+    """Write a ``profiles``-row dataset to ``path`` in chunks; returns its size in bytes."""
+    rng = np.random.default_rng(seed)
+    captions = caption_pool(rng)
+    with open(path, "w", newline="", encoding="utf-8") as f:
+        for start in range(0, profiles, chunk_rows):
+            chunk = generate_chunk(rng, start, min(chunk_rows, profiles - start), captions)
+            chunk.to_csv(f, header=start == 0, index=False)
+        return f.tell()
@@ -0,0 +1,197 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+import httpx
+
+# ===================== RESPONSE CACHE =====================
+CACHE_DIR = ".socialscan_cache"
+RESPONSE_CACHE_PATH = os.path.join(CACHE_DIR, "responses.sqlite3")
+
+# Seconds a cached response stays fresh, by URL fragment. URLs that match
+# none of these (e.g. images) are never cached here.
+DEFAULT_TTLS = {
+    "/users/web_profile_info/": 15 * 60,
+    "/comments/": 60 * 60,
+}
+DEFAULT_MAX_BYTES = 256 * 1024 * 1024
+
+# Headers that describe the wire encoding rather than the decoded body we store
+_DROPPED_HEADERS = {"content-encoding", "content-length", "transfer-encoding"}
+
+
+def _decoded_headers(headers):
+    return [(k, v) for k, v in headers.multi_items() if k.lower() not in _DROPPED_HEADERS]
+
+
+class ResponseCache:
+    """Persistent URL-keyed cache of successful GET responses.
+
+    Entries expire after a TTL chosen by endpoint type, and the least
+    recently used entries are evicted once the stored bodies exceed
+    ``max_bytes``.
+    """
+
+    def __init__(self, path=RESPONSE_CACHE_PATH, ttls=None, max_bytes=DEFAULT_MAX_BYTES):
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.ttls = dict(DEFAULT_TTLS if ttls is None else ttls)
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.bypasses = 0
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS responses ("
+            "url TEXT PRIMARY KEY, status INTEGER, headers TEXT, content BLOB, "
+            "size INTEGER, expires_at REAL, accessed_at REAL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS responses_accessed ON responses (accessed_at)")
+        self._conn.commit()
+        self._bytes = self._conn.execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0]
+
+    def ttl_for(self, url):
+        """Return the TTL for ``url``, or None if the endpoint is not cacheable."""
+        for fragment, ttl in self.ttls.items():
+            if fragment in url:
+                return ttl
+        return None
+
+    def get(self, url):
+        """Return ``(status, headers, content)`` for a fresh entry, or None."""
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT status, headers, content, size, expires_at FROM responses WHERE url = ?", (url,)
+            ).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            status, headers, content, size, expires_at = row
+            if expires_at <= now:
+                self._conn.execute("DELETE FROM responses WHERE url = ?", (url,))
+                self._conn.commit()
+                self._bytes -= size
+                self.misses += 1
+                return None
+            self._conn.execute("UPDATE responses SET accessed_at = ? WHERE url = ?", (now, url))
+            self._conn.commit()
+            self.hits += 1
+        return status, json.loads(headers), content
+
+    def set(self, url, status, headers, content):
+        ttl = self.ttl_for(url)
+        if ttl is None or len(content) > self.max_bytes:
+            return
+        now = time.time()
+        with self._lock:
+            old = self._conn.execute("SELECT size FROM responses WHERE url = ?", (url,)).fetchone()
+            self._conn.execute(
+                "INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (url, status, json.dumps(headers), content, len(content), now + ttl, now),
+            )
+            self._bytes += len(content) - (old[0] if old else 0)
+            self._evict()
+            self._conn.commit()
+
+    def _evict(self):
+        """Drop least recently used entries until the size cap is respected."""
+        while self._bytes > self.max_bytes:
+            rows = self._conn.execute(
+                "SELECT url, size FROM responses ORDER BY accessed_at LIMIT 64"
+            ).fetchall()
+            if not rows:
+                break
+            for url, size in rows:
+                self._conn.execute("DELETE FROM responses WHERE url = ?", (url,))
+                self._bytes -= size
+                if self._bytes <= self.max_bytes:
+                    break
+
+    def clear(self):
+        with self._lock:
+            self._conn.execute("DELETE FROM responses")
+            self._conn.commit()
+            self._bytes = 0
+
+    def stats(self):
+        """Hit/miss counters for this process plus the current size of the cache."""
+        with self._lock:
+            entries = self._conn.execute("SELECT COUNT(*) FROM responses").fetchone()[0]
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "bypasses": self.bypasses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "entries": entries,
+            "bytes": self._bytes,
+        }
+
+
+class CachingTransport(httpx.BaseTransport, httpx.AsyncBaseTransport):
+    """httpx transport that answers cacheable GETs from a ResponseCache.
+
+    With ``force_refresh`` the cache is never read but fresh responses are
+    still written back, so the next normal request benefits from them.
+    """
+
+    def __init__(self, cache, transport=None, force_refresh=False):
+        self.cache = cache
+        self.transport = transport
+        self.force_refresh = force_refresh
+
+    def _lookup(self, request):
+        url = str(request.url)
+        if request.method != "GET" or self.cache.ttl_for(url) is None:
+            return url, None
+        if self.force_refresh:
+            self.cache.bypasses += 1
+            return url, None
+        cached = self.cache.get(url)
+        if cached is None:
+            return url, None
+        status, headers, content = cached
+        return url, httpx.Response(status, headers=headers, content=content, request=request)
+
+    def _store(self, request, url, response):
+        """Cache a fully read response and return an equivalent one with a plain body."""
+        headers = _decoded_headers(response.headers)
+        if request.method == "GET" and response.status_code == 200:
+            self.cache.set(url, response.status_code, headers, response.content)
+        return httpx.Response(response.status_code, headers=headers, content=response.content, request=request)
+
+    def handle_request(self, request):
+        url, cached = self._lookup(request)
+        if cached is not None:
+            return cached
+        if self.transport is None:
+            self.transport = httpx.HTTPTransport()
+        response = self.transport.handle_request(request)
+        if self.cache.ttl_for(url) is None:
+            return response
+        response.read()
+        return self._store(request, url, response)
+
+    async def handle_async_request(self, request):
+        url, cached = self._lookup(request)
+        if cached is not None:
+            return cached
+        if self.transport is None:
+            self.transport = httpx.AsyncHTTPTransport()
+        response = await self.transport.handle_async_request(request)
+        if self.cache.ttl_for(url) is None:
+            return response
+        await response.aread()
+        return self._store(request, url, response)
+
+    def close(self):
+        if self.transport is not None:
+            self.transport.close()
+
+    async def aclose(self):
+        if self.transport is not None:
+            await self.transport.aclose()
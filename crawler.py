@@ -0,0 +1,311 @@
+import asyncio
+import hashlib
+import heapq
+import math
+import os
+import sqlite3
+import tempfile
+import time
+import httpx
+from pymongo import ASCENDING, DESCENDING, UpdateOne
+
+from batch import RateLimitedTransport, TokenBucket
+from history import count_value
+from metrics import set_queue_depth
+from scraper import make_async_client, scrape_user_async
+from storage import username_key
+
+# ===================== RELATED-PROFILES CRAWLER =====================
+# The crawl graph is kept next to the users collection: one document per
+# profile seen (fetched or only referenced) and one per related-profile edge.
+NODES_COLLECTION = "graph_nodes"
+EDGES_COLLECTION = "graph_edges"
+CRAWL_MAX_DEPTH = 2
+CRAWL_MAX_PROFILES = 500
+BLOOM_ERROR_RATE = 0.01
+EXPECTED_RELATED = 50  # Related profiles per fetched profile, for sizing the Bloom filter
+GRAPH_FLUSH_OPS = 500
+VISITED_COMMIT_ROWS = 1000  # Visited usernames per SQLite transaction
+
+
+def nodes_collection(collection):
+    return collection.database[NODES_COLLECTION]
+
+
+def edges_collection(collection):
+    return collection.database[EDGES_COLLECTION]
+
+
+def ensure_graph_indexes(collection):
+    edges = edges_collection(collection)
+    edges.create_index([("source", ASCENDING), ("target", ASCENDING)], unique=True, name="source_target")
+    edges.create_index([("target", ASCENDING)], name="target")
+    nodes_collection(collection).create_index([("followers", DESCENDING)], name="followers")
+
+
+class BloomFilter:
+    """Fixed-size Bloom filter over strings.
+
+    Sized for ``capacity`` items at ``error_rate`` false positives; it never
+    gives false negatives.
+    """
+
+    def __init__(self, capacity, error_rate=BLOOM_ERROR_RATE):
+        capacity = max(capacity, 1)
+        self.size = max(8, int(-capacity * math.log(error_rate) / math.log(2) ** 2))
+        self.hashes = max(1, round(self.size / capacity * math.log(2)))
+        self.bits = bytearray((self.size + 7) // 8)
+        self.count = 0
+
+    def _positions(self, item):
+        # Double hashing: k positions from two 64-bit halves of one digest
+        digest = hashlib.blake2b(item.encode("utf-8"), digest_size=16).digest()
+        h1, h2 = int.from_bytes(digest[:8], "little"), int.from_bytes(digest[8:], "little") | 1
+        return [(h1 + i * h2) % self.size for i in range(self.hashes)]
+
+    def add(self, item):
+        for position in self._positions(item):
+            self.bits[position >> 3] |= 1 << (position & 7)
+        self.count += 1
+
+    def __contains__(self, item):
+        return all(self.bits[position >> 3] & (1 << (position & 7)) for position in self._positions(item))
+
+
+class VisitedSet:
+    """Set of usernames seen by a crawl, kept mostly out of RAM.
+
+    The Bloom filter answers most lookups; only its positives are confirmed
+    against an exact SQLite store on disk, so a false positive never causes
+    a profile to be skipped. Inserts are committed every
+    VISITED_COMMIT_ROWS and on close, so a store at ``path`` is reloaded
+    by the next crawl that uses it; ``resumed`` holds the keys it held then.
+    """
+
+    def __init__(self, capacity, path=None, error_rate=BLOOM_ERROR_RATE):
+        if path is None:
+            handle, path = tempfile.mkstemp(prefix="socialscan_crawl_", suffix=".sqlite3")
+            os.close(handle)
+            self._temporary = path
+        else:
+            self._temporary = None
+        self.bloom = BloomFilter(capacity, error_rate)
+        self.exact_lookups = 0
+        self._conn = sqlite3.connect(path)
+        self._conn.execute("CREATE TABLE IF NOT EXISTS seen (key TEXT PRIMARY KEY)")
+        self._uncommitted = 0
+        self.resumed = [key for (key,) in self._conn.execute("SELECT key FROM seen")]
+        for key in self.resumed:
+            self.bloom.add(key)
+
+    def add(self, key):
+        """Mark ``key`` as seen; returns False if it already was."""
+        if key in self.bloom:
+            self.exact_lookups += 1
+            if self._conn.execute("SELECT 1 FROM seen WHERE key = ?", (key,)).fetchone():
+                return False
+        self.bloom.add(key)
+        self._conn.execute("INSERT OR IGNORE INTO seen VALUES (?)", (key,))
+        self._uncommitted += 1
+        if self._uncommitted >= VISITED_COMMIT_ROWS:
+            self._conn.commit()
+            self._uncommitted = 0
+        return True
+
+    def close(self):
+        self._conn.commit()
+        self._conn.close()
+        if self._temporary:
+            os.remove(self._temporary)
+
+
+def unfinished(collection, keys, batch_size=GRAPH_FLUSH_OPS):
+    """``(depth, username)`` of the visited ``keys`` an earlier crawl queued but never fetched.
+
+    Keys with a ``discovered`` node keep the depth they were found at; keys
+    without a node are seeds the crawl stopped before.
+    """
+    nodes = nodes_collection(collection)
+    for start in range(0, len(keys), batch_size):
+        batch = keys[start:start + batch_size]
+        found = {node["_id"]: node
+                 for node in nodes.find({"_id": {"$in": batch}}, {"username": 1, "status": 1, "depth": 1})}
+        for key in batch:
+            node = found.get(key)
+            if node is None:
+                yield 0, key
+            elif node.get("status") == "discovered":
+                yield node.get("depth", 0), node.get("username", key)
+
+
+class GraphWriter:
+    """Buffers node and edge upserts and writes them with unordered bulk_writes."""
+
+    def __init__(self, collection, max_ops=GRAPH_FLUSH_OPS):
+        self.nodes = nodes_collection(collection)
+        self.edges = edges_collection(collection)
+        self.max_ops = max_ops
+        self.edge_count = 0
+        self._node_ops = []
+        self._edge_ops = []
+
+    def fetched(self, user_info, depth):
+        related = [username for username in user_info.get("Related Profiles", []) if username and username != "N/A"]
+        source = username_key(user_info["Username"])
+        self._node_ops.append(UpdateOne({"_id": source}, {
+            "$set": {"username": user_info["Username"], "followers": count_value(user_info.get("Followers", 0)),
+                     "category": user_info.get("Category"), "status": "fetched", "fetched_at": time.time(),
+                     "related": len(related)},
+            "$min": {"depth": depth},
+        }, upsert=True))
+        for username in related:
+            target = username_key(username)
+            self._edge_ops.append(UpdateOne({"source": source, "target": target},
+                                            {"$setOnInsert": {"source": source, "target": target}}, upsert=True))
+            self._node_ops.append(UpdateOne({"_id": target}, {
+                "$setOnInsert": {"username": username, "status": "discovered"},
+                "$min": {"depth": depth + 1},
+            }, upsert=True))
+        self._maybe_flush()
+
+    def failed(self, username, depth, error):
+        self._node_ops.append(UpdateOne({"_id": username_key(username)}, {
+            "$set": {"username": username, "status": "failed", "error": error},
+            "$min": {"depth": depth},
+        }, upsert=True))
+        self._maybe_flush()
+
+    def _maybe_flush(self):
+        if len(self._node_ops) + len(self._edge_ops) >= self.max_ops:
+            self.flush()
+
+    def flush(self):
+        if self._node_ops:
+            self.nodes.bulk_write(self._node_ops, ordered=False)
+        if self._edge_ops:
+            result = self.edges.bulk_write(self._edge_ops, ordered=False)
+            self.edge_count += result.upserted_count
+        self._node_ops, self._edge_ops = [], []
+
+
+async def crawl_related(collection, seeds, max_depth=CRAWL_MAX_DEPTH, max_profiles=CRAWL_MAX_PROFILES,
+                        concurrency=5, requests_per_minute=20, on_result=None, visited_path=None,
+                        force_refresh=False, transport=None, **comment_options):
+    """Crawl outward from ``seeds`` over related profiles and store the graph.
+
+    The frontier is expanded breadth-first up to ``max_depth`` hops and at
+    most ``max_profiles`` profiles are fetched. Within a depth, profiles
+    referenced by the most-followed accounts are fetched first. Every
+    username is fetched at most once per crawl. ``on_result`` is called with
+    ``(done, total, username, user_info, images)`` for each fetched profile,
+    where ``total`` is the profile budget and ``user_info`` the error message
+    on failure. With ``visited_path`` the visited usernames persist, and a
+    crawl restarted on the same store picks up the profiles its earlier run
+    queued but never fetched instead of starting over. Returns a summary of
+    the crawl.
+    """
+    ensure_graph_indexes(collection)
+    visited = VisitedSet(max_profiles * EXPECTED_RELATED, visited_path)
+    graph = GraphWriter(collection)
+    limiter = TokenBucket(requests_per_minute / 60.0)
+    if transport is None:
+        limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+        transport = httpx.AsyncHTTPTransport(limits=limits)
+
+    # Heap of (depth, -priority, sequence, username); sequence keeps pops stable
+    frontier = []
+    sequence = 0
+    for depth, username in unfinished(collection, visited.resumed):
+        if depth <= max_depth:
+            frontier.append((depth, 0, sequence, username))
+            sequence += 1
+    for username in seeds:
+        if visited.add(username_key(username)):
+            frontier.append((0, 0, sequence, username))
+            sequence += 1
+    heapq.heapify(frontier)
+    fetched = failed = completed = in_flight = 0
+    changed = asyncio.Event()
+
+    async with make_async_client(RateLimitedTransport(limiter, transport), force_refresh) as async_client:
+
+        async def worker():
+            nonlocal sequence, fetched, failed, completed, in_flight
+            while True:
+                while not frontier:
+                    if in_flight == 0 or fetched >= max_profiles:
+                        return
+                    changed.clear()
+                    await changed.wait()
+                if fetched >= max_profiles:
+                    return
+                depth, _, _, username = heapq.heappop(frontier)
+                fetched += 1
+                in_flight += 1
+                try:
+                    user_info, images = await scrape_user_async(username, async_client, **comment_options)
+                    if isinstance(user_info, str):
+                        failed += 1
+                        graph.failed(username, depth, user_info)
+                    else:
+                        graph.fetched(user_info, depth)
+                        if depth < max_depth:
+                            priority = count_value(user_info.get("Followers", 0))
+                            for related in user_info.get("Related Profiles", []):
+                                if related and related != "N/A" and visited.add(username_key(related)):
+                                    heapq.heappush(frontier, (depth + 1, -priority, sequence, related))
+                                    sequence += 1
+                    completed += 1
+                    if on_result is not None:
+                        on_result(completed, max_profiles, username, user_info, images)
+                finally:
+                    in_flight -= 1
+                    set_queue_depth("crawl", "waiting", len(frontier))
+                    set_queue_depth("crawl", "running", in_flight)
+                    changed.set()
+
+        try:
+            await asyncio.gather(*(worker() for _ in range(concurrency)))
+        finally:
+            set_queue_depth("crawl", "waiting", 0)
+            set_queue_depth("crawl", "running", 0)
+            graph.flush()
+            visited.close()
+
+    return {
+        "fetched": fetched,
+        "failed": failed,
+        "discovered": visited.bloom.count,
+        "unfetched_frontier": len(frontier),
+        "new_edges": graph.edge_count,
+        "bloom_bytes": len(visited.bloom.bits),
+        "exact_lookups": visited.exact_lookups,
+    }
+
+
+def run_crawl(collection, seeds, max_depth=CRAWL_MAX_DEPTH, max_profiles=CRAWL_MAX_PROFILES, **options):
+    """Synchronous entry point for crawl_related."""
+    return asyncio.run(crawl_related(collection, seeds, max_depth, max_profiles, **options))
+
+
+def related_graph(collection, username, limit=100):
+    """Outgoing and incoming related-profile edges of ``username`` as two username lists."""
+    key = username_key(username)
+    edges = edges_collection(collection)
+    outgoing = [edge["target"] for edge in edges.find({"source": key}, {"_id": 0, "target": 1}).limit(limit)]
+    incoming = [edge["source"] for edge in edges.find({"target": key}, {"_id": 0, "source": 1}).limit(limit)]
+    return outgoing, incoming
+
+
+def most_referenced(collection, limit=20):
+    """Profiles listed as related by the most crawled profiles."""
+    pipeline = [
+        {"$group": {"_id": "$target", "in_degree": {"$sum": 1}}},
+        {"$sort": {"in_degree": -1}},
+        {"$limit": limit},
+        {"$lookup": {"from": NODES_COLLECTION, "localField": "_id", "foreignField": "_id", "as": "node"}},
+        {"$project": {"_id": 0, "username": {"$ifNull": [{"$first": "$node.username"}, "$_id"]},
+                      "in_degree": 1, "followers": {"$first": "$node.followers"},
+                      "status": {"$first": "$node.status"}}},
+    ]
+    return list(edges_collection(collection).aggregate(pipeline))
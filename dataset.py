@@ -0,0 +1,122 @@
+import os
+import re
+import threading
+import numpy as np
+import pandas as pd
+
+from metrics import timed
+
+# ===================== DATASET STORE =====================
+DATA_PATH = 'dataset1_train.csv'
+
+USERNAME_COLUMN = 'user_info.Username'
+FOLLOWERS_COLUMN = 'user_info.Followers'
+PROFILE_COLUMNS = [USERNAME_COLUMN, 'user_info.Category', 'user_info.Related Profiles', FOLLOWERS_COLUMN]
+
+# Per-post columns come in several export layouts, in order of preference:
+# the flattened MongoDB document, the export_user_data_to_csv layout, and
+# the older parallel-array layout.
+POST_COLUMN_PATTERNS = [
+    re.compile(r'^user_info\.Images\[(?P<index>\d+)\]\.(?P<field>ID|Likes|Caption)$'),
+    re.compile(r'^images\[(?P<index>\d+)\]\.(?P<field>ID|Likes|Caption)$'),
+    re.compile(r'^images\.(?P<field>image_ids|image_likes|captions)\[(?P<index>\d+)\]$'),
+]
+FIELD_ALIASES = {'image_ids': 'ID', 'image_likes': 'Likes', 'captions': 'Caption'}
+
+
+def normalize_username(username):
+    return str(username).strip().lower()
+
+
+def is_post_column(column):
+    return any(pattern.match(column) for pattern in POST_COLUMN_PATTERNS)
+
+
+def detect_post_columns(columns):
+    """Return one ``{field: {post_index: column}}`` mapping per layout present in ``columns``."""
+    layouts = []
+    for pattern in POST_COLUMN_PATTERNS:
+        layout = {}
+        for column in columns:
+            match = pattern.match(column)
+            if match:
+                field = FIELD_ALIASES.get(match.group('field'), match.group('field'))
+                layout.setdefault(field, {})[int(match.group('index'))] = column
+        if layout:
+            layouts.append(layout)
+    return layouts
+
+
+def to_count(values):
+    """Parse counts stored either as numbers or as formatted strings like "12,345"."""
+    return pd.to_numeric(values.astype(str).str.replace(',', '', regex=False), errors='coerce')
+
+
+class DatasetStore:
+    """The training CSV parsed once and indexed by normalized username.
+
+    Only the profile and per-post columns the analysis uses are read, all as
+    strings with counts converted to floats afterwards. The file is parsed
+    again only when its modification time changes.
+    """
+
+    def __init__(self, path=DATA_PATH):
+        self.path = path
+        self.missing_columns = set()
+        self.post_layouts = []
+        self._mtime = None
+        self._data = None
+        self._index = {}
+        self._lock = threading.Lock()
+
+    @timed("csv_parse")
+    def _load(self):
+        data = pd.read_csv(
+            self.path,
+            usecols=lambda col: col in PROFILE_COLUMNS or is_post_column(col),
+            dtype=str,
+        )
+
+        self.missing_columns = set(PROFILE_COLUMNS) - set(data.columns)
+        self.post_layouts = detect_post_columns(data.columns)
+        if FOLLOWERS_COLUMN in data.columns:
+            data[FOLLOWERS_COLUMN] = to_count(data[FOLLOWERS_COLUMN])
+        for layout in self.post_layouts:
+            for col in layout.get('Likes', {}).values():
+                data[col] = to_count(data[col])
+
+        # First occurrence wins, matching the previous .iloc[0] lookup
+        keys = data[USERNAME_COLUMN].fillna("").str.strip().str.lower()
+        first = ~keys.duplicated()
+        self._index = dict(zip(keys[first], np.flatnonzero(first.to_numpy())))
+        self._data = data
+
+    def frame(self):
+        """Return the parsed dataset, reloading it if the file has changed."""
+        mtime = os.path.getmtime(self.path)
+        with self._lock:
+            if self._data is None or mtime != self._mtime:
+                self._load()
+                self._mtime = mtime
+            return self._data
+
+    def version(self):
+        """Modification time of the currently loaded file; changes on reload."""
+        self.frame()
+        return self._mtime
+
+    def usernames(self):
+        return self.frame()[USERNAME_COLUMN].dropna().unique()
+
+    def position(self, username):
+        """Row position of ``username`` (case and whitespace insensitive), or None."""
+        self.frame()
+        return self._index.get(normalize_username(username))
+
+    def lookup(self, username):
+        """Return the row for ``username``, or None."""
+        pos = self.position(username)
+        return None if pos is None else self.frame().iloc[pos]
+
+
+dataset_store = DatasetStore()
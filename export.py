@@ -0,0 +1,212 @@
+import csv
+import json
+
+from history import count_value, to_timestamp
+from storage import USERNAME_FIELD, load_posts_for, owner_id
+
+# ===================== BULK EXPORT =====================
+EXPORT_FORMATS = ("csv", "jsonl", "parquet")
+EXPORT_LAYOUTS = ("profiles", "posts", "comments")
+EXPORT_BATCH_SIZE = 500
+MAX_EXPORTED_POSTS = 12
+
+# Exported profile fields and their column types. Lists are joined with
+# ", " like the existing dataset1_train.csv.
+PROFILE_FIELDS = [
+    ("Username", "string"), ("Full Name", "string"), ("ID", "string"), ("Category", "string"),
+    ("Business Category", "string"), ("Phone", "string"), ("Email", "string"), ("Biography", "string"),
+    ("Bio Links", "string"), ("Homepage", "string"), ("Followers", "int"), ("Following", "int"),
+    ("Facebook ID", "string"), ("Is Private", "bool"), ("Is Verified", "bool"), ("Profile Image", "string"),
+    ("Video Count", "int"), ("Image Count", "int"), ("Saved Count", "int"), ("Collections Count", "int"),
+    ("Related Profiles", "string"),
+]
+POST_FIELDS = [("ID", "string"), ("Source", "string"), ("Likes", "int"), ("Caption", "string")]
+
+
+def layout_columns(layout, max_posts=MAX_EXPORTED_POSTS):
+    """Ordered ``(column, type)`` pairs of an export layout."""
+    if layout == "profiles":
+        columns = [(f"user_info.{field}", kind) for field, kind in PROFILE_FIELDS]
+        for i in range(max_posts):
+            columns += [(f"images[{i}].{field}", kind) for field, kind in POST_FIELDS]
+        return columns + [("timestamp", "float"), ("scrape_date", "string")]
+    if layout == "posts":
+        return [("username", "string"), ("user_id", "string"), ("position", "int"), ("post_id", "string"),
+                ("source", "string"), ("likes", "int"), ("caption", "string"), ("comment_count", "int"),
+                ("timestamp", "float")]
+    if layout == "comments":
+        return [("username", "string"), ("user_id", "string"), ("post_id", "string"),
+                ("position", "int"), ("text", "string")]
+    raise ValueError(f"Unknown export layout: {layout}")
+
+
+def _coerce(value, kind):
+    if value is None or value == "N/A":
+        return None
+    if kind == "int":
+        return count_value(value)
+    if kind == "float":
+        return float(value)
+    if kind == "bool":
+        return value if isinstance(value, bool) else None
+    if isinstance(value, list):
+        return ", ".join(str(item) for item in value)
+    return str(value)
+
+
+def profile_records(user_info, images, document, layout, max_posts=MAX_EXPORTED_POSTS):
+    """Flatten one stored profile into the rows of ``layout``."""
+    username, user_id = user_info.get("Username"), owner_id(user_info)
+    if layout == "profiles":
+        record = {f"user_info.{field}": user_info.get(field) for field, _ in PROFILE_FIELDS}
+        for i, image in enumerate(images[:max_posts]):
+            for field, _ in POST_FIELDS:
+                record[f"images[{i}].{field}"] = image.get(field)
+        record["timestamp"] = document.get("timestamp")
+        record["scrape_date"] = document.get("scrape_date")
+        return [record]
+    if layout == "posts":
+        return [{
+            "username": username, "user_id": user_id, "position": position, "post_id": image.get("ID"),
+            "source": image.get("Source"), "likes": image.get("Likes"), "caption": image.get("Caption"),
+            "comment_count": image.get("Comment Count", len(image.get("Comments", []))), "timestamp": document.get("timestamp"),
+        } for position, image in enumerate(images)]
+    return [{
+        "username": username, "user_id": user_id, "post_id": image.get("ID"), "position": position, "text": text,
+    } for image in images for position, text in enumerate(image.get("Comments", []))]
+
+
+def scrapes_frame(scrapes, layout="profiles", max_posts=MAX_EXPORTED_POSTS):
+    """DataFrame of ``(user_info, images, document)`` scrapes in an export layout.
+
+    Works on fresh scrapes (models.Profile and models.Post) as well as on
+    stored documents; pass ``{}`` as the document of an unsaved scrape.
+    Columns are typed like the Parquet export.
+    """
+    import pandas as pd
+    columns = layout_columns(layout, max_posts)
+    data = {name: [] for name, _ in columns}
+    for user_info, images, document in scrapes:
+        for record in profile_records(user_info, images, document, layout, max_posts):
+            for name, kind in columns:
+                data[name].append(_coerce(record.get(name), kind))
+    dtypes = {"string": "string", "int": "Int64", "float": "Float64", "bool": "boolean"}
+    return pd.DataFrame({name: pd.array(data[name], dtype=dtypes[kind]) for name, kind in columns})
+
+
+def iter_profile_batches(collection, start=None, end=None, usernames=None, batch_size=EXPORT_BATCH_SIZE,
+                         with_comments=False):
+    """Stream ``(user_info, images, document)`` lists of up to ``batch_size`` profiles.
+
+    Profiles can be restricted to a scrape-date range and a username list.
+    Posts (and comments) of each batch are fetched with one query apiece.
+    """
+    query = {}
+    if start is not None or end is not None:
+        query["timestamp"] = {}
+        if start is not None:
+            query["timestamp"]["$gte"] = to_timestamp(start)
+        if end is not None:
+            query["timestamp"]["$lte"] = to_timestamp(end)
+    if usernames:
+        query[USERNAME_FIELD] = {"$in": list(usernames)}
+
+    cursor = collection.find(query, {"user_info": 1, "images": 1, "timestamp": 1, "scrape_date": 1},
+                             batch_size=batch_size)
+    batch = []
+
+    def resolve(documents):
+        # Legacy documents still embed their posts; the rest are read in one go
+        user_ids = [owner_id(doc["user_info"]) for doc in documents if "images" not in doc]
+        images_by_user = load_posts_for(collection, user_ids, with_comments) if user_ids else {}
+        return [
+            (doc["user_info"],
+             doc["images"] if "images" in doc else images_by_user.get(owner_id(doc["user_info"]), []),
+             doc)
+            for doc in documents
+        ]
+
+    for document in cursor:
+        if "user_info" not in document:
+            continue
+        batch.append(document)
+        if len(batch) >= batch_size:
+            yield resolve(batch)
+            batch = []
+    if batch:
+        yield resolve(batch)
+
+
+class _CsvWriter:
+    def __init__(self, path, columns):
+        self.file = open(path, "w", newline="", encoding="utf-8")
+        self.writer = csv.DictWriter(self.file, fieldnames=[name for name, _ in columns])
+        self.writer.writeheader()
+
+    def write(self, records):
+        self.writer.writerows(records)
+
+    def close(self):
+        self.file.close()
+
+
+class _JsonlWriter:
+    def __init__(self, path, columns):
+        self.file = open(path, "w", encoding="utf-8")
+
+    def write(self, records):
+        self.file.writelines(json.dumps(record, ensure_ascii=False) + "\n" for record in records)
+
+    def close(self):
+        self.file.close()
+
+
+class _ParquetWriter:
+    def __init__(self, path, columns):
+        try:
+            import pyarrow as pa
+            import pyarrow.parquet as pq
+        except ImportError:
+            raise RuntimeError("Parquet export requires pyarrow (pip install pyarrow)")
+        types = {"string": pa.string(), "int": pa.int64(), "float": pa.float64(), "bool": pa.bool_()}
+        self.pa = pa
+        self.schema = pa.schema([(name, types[kind]) for name, kind in columns])
+        self.writer = pq.ParquetWriter(path, self.schema, compression="snappy")
+
+    def write(self, records):
+        # Each batch becomes one row group, so memory stays bounded by the batch size
+        self.writer.write_table(self.pa.Table.from_pylist(records, schema=self.schema))
+
+    def close(self):
+        self.writer.close()
+
+
+WRITERS = {"csv": _CsvWriter, "jsonl": _JsonlWriter, "parquet": _ParquetWriter}
+
+
+def export_collection(collection, path, fmt="csv", layout="profiles", start=None, end=None, usernames=None,
+                      batch_size=EXPORT_BATCH_SIZE, max_posts=MAX_EXPORTED_POSTS):
+    """Stream stored profiles to ``path``; returns the number of rows written.
+
+    ``layout`` is ``profiles`` (one wide row per profile, readable by the
+    behavior analysis), ``posts`` (one row per post) or ``comments`` (one row
+    per comment). Memory use is bounded by ``batch_size`` profiles.
+    """
+    if fmt not in WRITERS:
+        raise ValueError(f"Unknown export format: {fmt}")
+    columns = layout_columns(layout, max_posts)
+    writer = WRITERS[fmt](path, columns)
+    rows = 0
+    try:
+        for batch in iter_profile_batches(collection, start, end, usernames, batch_size,
+                                          with_comments=layout == "comments"):
+            records = []
+            for user_info, images, document in batch:
+                for record in profile_records(user_info, images, document, layout, max_posts):
+                    records.append({name: _coerce(record.get(name), kind) for name, kind in columns})
+            if records:
+                writer.write(records)
+                rows += len(records)
+    finally:
+        writer.close()
+    return rows
@@ -0,0 +1,278 @@
+import hashlib
+import threading
+import time
+import numpy as np
+import pandas as pd
+from pymongo import ReplaceOne
+
+from analytics import engagement
+from metrics import timed
+from storage import owner_id, posts_collection
+
+# ===================== CAPTION FEATURES =====================
+# Captions are tokenized once per post. Hashtags, mentions, emoji and
+# lengths are kept per post; terms feed a sparse TF-IDF matrix held in
+# coordinate form (entry rows, columns, values) sorted by row, so the posts
+# of one user are a contiguous slice.
+FEATURES_COLLECTION = "post_features"
+FEATURE_BATCH_SIZE = 1000
+TOP_TERMS = 10
+MIN_HASHTAG_POSTS = 3
+# Profiles are timestamped when their document is built and may reach
+# MongoDB a few seconds later (see storage.BulkUpserter), so change checks
+# look back this far past the last rebuild
+WATERMARK_OVERLAP = 60.0
+
+HASHTAG_PATTERN = r"#\w+"
+MENTION_PATTERN = r"@[\w.]+"
+EMOJI_PATTERN = "[\U0001F300-\U0001FAFF\U0001F1E6-\U0001F1FF☀-➿]"
+TERM_PATTERN = r"#\w+|(?<![@#\w])[^\W\d_]{2,}"
+URL_PATTERN = r"https?://\S+"
+STOP_WORDS = frozenset(
+    "a an and are as at be but by for from has have i in is it its me my of on or our so that the this to "
+    "was we were will with you your".split()
+)
+
+
+def features_collection(collection):
+    return collection.database[FEATURES_COLLECTION]
+
+
+def caption_hash(caption):
+    return hashlib.sha1((caption or "").encode("utf-8")).hexdigest()
+
+
+@timed("caption_features")
+def extract_features(captions):
+    """Per-post caption features for a Series of captions, computed column-wise.
+
+    Columns: ``length``, ``words``, ``hashtags``, ``mentions``, ``emoji`` and
+    ``terms`` (list of lowercased words and hashtags, stop words removed).
+    """
+    text = captions.fillna("").astype(str).replace("N/A", "")
+    lowered = text.str.lower()
+    terms = lowered.str.replace(URL_PATTERN, " ", regex=True).str.findall(TERM_PATTERN)
+    return pd.DataFrame({
+        "length": text.str.len(),
+        "words": text.str.split().str.len().fillna(0).astype(int),
+        "hashtags": lowered.str.findall(HASHTAG_PATTERN),
+        "mentions": lowered.str.findall(MENTION_PATTERN),
+        "emoji": text.str.count(EMOJI_PATTERN),
+        "terms": terms.map(lambda tokens: [token for token in tokens if token not in STOP_WORDS]),
+    }, index=captions.index)
+
+
+@timed("tfidf")
+def tfidf(terms):
+    """Sparse, L2-normalized TF-IDF of a Series of term lists.
+
+    Returns ``(vocabulary, rows, columns, values)`` with entries sorted by
+    row. Term frequencies are sublinear (1 + log count).
+    """
+    exploded = pd.DataFrame({"row": np.repeat(np.arange(len(terms)), terms.str.len().to_numpy()),
+                             "term": np.concatenate([np.asarray(t, dtype=object) for t in terms] or [[]])})
+    if exploded.empty:
+        return np.array([], dtype=object), np.array([], dtype=int), np.array([], dtype=int), np.array([])
+    counts = exploded.groupby(["row", "term"], sort=False).size().reset_index(name="count")
+    columns, vocabulary = pd.factorize(counts["term"])
+    rows = counts["row"].to_numpy()
+    document_frequency = np.bincount(columns, minlength=len(vocabulary))
+    idf = np.log((1 + len(terms)) / (1 + document_frequency)) + 1
+    values = (1 + np.log(counts["count"].to_numpy())) * idf[columns]
+    norms = np.sqrt(np.bincount(rows, weights=values ** 2, minlength=len(terms)))
+    values = values / norms[rows]
+    order = np.argsort(rows, kind="stable")
+    return np.asarray(vocabulary, dtype=object), rows[order], columns[order], values[order]
+
+
+class FeatureIndex:
+    """Caption features and TF-IDF of a set of posts, queryable per user and per hashtag.
+
+    ``posts`` needs ``post_id``, ``username``, ``likes`` and the feature
+    columns of extract_features.
+    """
+
+    def __init__(self, posts):
+        posts = posts.sort_values("username", kind="stable").reset_index(drop=True)
+        self.posts = posts
+        self.vocabulary, self.rows, self.columns, self.values = tfidf(posts["terms"])
+        self.entry_offsets = np.searchsorted(self.rows, np.arange(len(posts) + 1))
+        keys = posts["username"].astype(str).str.lower().to_numpy()
+        starts = np.flatnonzero(np.r_[True, keys[1:] != keys[:-1]]) if len(keys) else np.array([], dtype=int)
+        self.user_rows = {keys[start]: (start, end) for start, end in zip(starts, np.r_[starts[1:], len(keys)])}
+
+    def user_features(self, username):
+        """Caption feature rows of one user's posts."""
+        start, end = self.user_rows.get(str(username).lower(), (0, 0))
+        return self.posts.iloc[start:end]
+
+    def top_terms(self, username, k=TOP_TERMS):
+        """Highest summed TF-IDF terms over a user's captions, as ``(term, score)``."""
+        start, end = self.user_rows.get(str(username).lower(), (0, 0))
+        lo, hi = self.entry_offsets[start], self.entry_offsets[end]
+        if lo == hi:
+            return []
+        scores = np.bincount(self.columns[lo:hi], weights=self.values[lo:hi], minlength=len(self.vocabulary))
+        top = np.argsort(-scores)[:k]
+        return [(self.vocabulary[i], float(scores[i])) for i in top if scores[i] > 0]
+
+    def summary(self, username):
+        """Totals of a user's caption features."""
+        features = self.user_features(username)
+        hashtags = features["hashtags"].explode().dropna()
+        mentions = features["mentions"].explode().dropna()
+        return {
+            "posts": len(features),
+            "mean_length": float(features["length"].mean()) if len(features) else 0.0,
+            "hashtags_per_post": len(hashtags) / len(features) if len(features) else 0.0,
+            "emoji_per_post": float(features["emoji"].mean()) if len(features) else 0.0,
+            "top_hashtags": hashtags.value_counts().head(TOP_TERMS).to_dict(),
+            "top_mentions": mentions.value_counts().head(TOP_TERMS).to_dict(),
+        }
+
+    def hashtag_engagement(self, min_posts=MIN_HASHTAG_POSTS, limit=20):
+        """Hashtags ranked by how strongly using them goes with higher likes.
+
+        Likes are taken relative to each user's own mean so large accounts do
+        not dominate. ``lift`` is the mean relative likes of posts carrying
+        the hashtag, and ``correlation`` is the point-biserial correlation
+        between carrying it and relative likes.
+        """
+        posts = self.posts
+        likes = posts["likes"].to_numpy(dtype=float)
+        user_mean = posts.groupby("username")["likes"].transform("mean").to_numpy(dtype=float)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            relative = np.where(user_mean > 0, likes / user_mean, np.nan)
+        valid = ~np.isnan(relative)
+        exploded = posts["hashtags"].map(set).explode().dropna()
+        exploded = exploded[valid[exploded.index.to_numpy()]]
+        if exploded.empty:
+            return pd.DataFrame(columns=["hashtag", "posts", "lift", "correlation"])
+        codes, tags = pd.factorize(exploded)
+        n = int(valid.sum())
+        std = relative[valid].std()
+        with_count = np.bincount(codes, minlength=len(tags))
+        with_sum = np.bincount(codes, weights=relative[exploded.index.to_numpy()], minlength=len(tags))
+        with np.errstate(divide="ignore", invalid="ignore"):
+            with_mean = with_sum / with_count
+            without_mean = (relative[valid].sum() - with_sum) / (n - with_count)
+            correlation = (with_mean - without_mean) / std * np.sqrt(with_count * (n - with_count)) / n
+        table = pd.DataFrame({"hashtag": np.asarray(tags), "posts": with_count, "lift": with_mean,
+                              "correlation": correlation})
+        table = table[table["posts"] >= min_posts].dropna()
+        return table.sort_values("correlation", ascending=False).head(limit).reset_index(drop=True)
+
+
+def update_post_features(collection, user_ids=None, batch_size=FEATURE_BATCH_SIZE):
+    """Tokenize stored posts that are new or whose caption changed; returns how many were processed.
+
+    Features are cached per post in the post_features collection together
+    with a hash of the caption they came from. ``user_ids`` limits the check
+    to the posts of those profiles.
+    """
+    features = features_collection(collection)
+    query = {} if user_ids is None else {"user_id": {"$in": list(user_ids)}}
+    batch, pending = [], []
+    processed = 0
+
+    def check():
+        # Caption hashes are looked up for one batch of posts at a time
+        known = {doc["_id"]: doc["caption_hash"]
+                 for doc in features.find({"_id": {"$in": [post["_id"] for post in batch]}}, {"caption_hash": 1})}
+        pending.extend((post["_id"], post.get("caption") or "") for post in batch
+                       if known.get(post["_id"]) != caption_hash(post.get("caption")))
+
+    def flush():
+        batch = pd.DataFrame(pending, columns=["_id", "caption"])
+        extracted = extract_features(batch["caption"])
+        features.bulk_write([
+            ReplaceOne({"_id": post_id}, {
+                "_id": post_id, "caption_hash": caption_hash(caption), "length": int(row.length),
+                "words": int(row.words), "emoji": int(row.emoji), "hashtags": row.hashtags,
+                "mentions": row.mentions, "terms": row.terms,
+            }, upsert=True)
+            for post_id, caption, row in zip(batch["_id"], batch["caption"], extracted.itertuples(index=False))
+        ], ordered=False)
+
+    for post in posts_collection(collection).find(query, {"caption": 1}):
+        batch.append(post)
+        if len(batch) >= batch_size:
+            check()
+            batch = []
+        if len(pending) >= batch_size:
+            flush()
+            processed += len(pending)
+            pending = []
+    if batch:
+        check()
+    if pending:
+        flush()
+        processed += len(pending)
+    return processed
+
+
+class StoredCaptionFeatures:
+    """FeatureIndex over every post in MongoDB, rebuilt only after profiles are written.
+
+    Every write stamps the profile document, so the index is keyed on the
+    profiles stamped since its last rebuild (a ``$gt`` query on the
+    timestamp index). A call with no new writes costs that one query.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._index = None
+        self._watermark = None
+        self._seen = frozenset()  # (_id, timestamp) of the profiles stamped since the watermark
+
+    def index(self, collection):
+        with self._lock:
+            query = {} if self._watermark is None else {"timestamp": {"$gt": self._watermark - WATERMARK_OVERLAP}}
+            recent = list(collection.find(query, {"timestamp": 1, "user_info.ID": 1, "user_info.Username": 1}))
+            changed = [doc for doc in recent if (doc["_id"], doc.get("timestamp")) not in self._seen]
+            if self._index is None or changed:
+                started = time.time()
+                update_post_features(collection, None if self._index is None else
+                                     [owner_id(doc["user_info"]) for doc in changed if "user_info" in doc])
+                self._index = self._build(collection)
+                self._watermark = started
+                self._seen = frozenset((doc["_id"], doc.get("timestamp")) for doc in recent
+                                       if (doc.get("timestamp") or 0) > started - WATERMARK_OVERLAP)
+            return self._index
+
+    @staticmethod
+    def _build(collection):
+        posts = pd.DataFrame(list(posts_collection(collection).find({}, {"username": 1, "likes": 1})),
+                             columns=["_id", "username", "likes"]).rename(columns={"_id": "post_id"})
+        features = pd.DataFrame(list(features_collection(collection).find({}, {"caption_hash": 0})),
+                                columns=["_id", "length", "words", "emoji", "hashtags", "mentions", "terms"])
+        merged = posts.merge(features.rename(columns={"_id": "post_id"}), on="post_id", how="inner")
+        return FeatureIndex(merged)
+
+
+class DatasetCaptionFeatures:
+    """FeatureIndex over the posts of the training dataset, rebuilt once per dataset version."""
+
+    def __init__(self, analytics=engagement):
+        self.analytics = analytics
+        self._lock = threading.Lock()
+        self._version = None
+        self._index = None
+
+    def index(self):
+        self.analytics.refresh()
+        with self._lock:
+            version = self.analytics.store.version()
+            if version != self._version:
+                posts = self.analytics.posts
+                usernames = self.analytics.metrics["username"].to_numpy()[posts["profile"].to_numpy()]
+                frame = pd.DataFrame({"post_id": posts["post_id"].to_numpy(), "username": usernames,
+                                      "likes": posts["likes"].to_numpy()})
+                frame = frame.join(extract_features(posts["caption"]).reset_index(drop=True))
+                self._index = FeatureIndex(frame)
+                self._version = version
+            return self._index
+
+
+stored_features = StoredCaptionFeatures()
+dataset_features = DatasetCaptionFeatures()
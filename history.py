@@ -0,0 +1,210 @@
+import time
+from datetime import date, datetime
+from pymongo import ASCENDING, DESCENDING, UpdateOne
+
+# ===================== SCRAPE HISTORY =====================
+# Every scrape is recorded as either a full baseline snapshot or a delta of
+# the fields that changed since the previous scrape. A new baseline is taken
+# every BASELINE_EVERY scrapes so rebuilding any point in time reads at most
+# that many small documents. The latest snapshot of every profile is also
+# kept in a head document, so recording a scrape needs no replay and a batch
+# of scrapes reads all its heads with one query.
+BASELINE_EVERY = 30
+HEADS_COLLECTION = "history_heads"
+
+
+def history_heads(history):
+    return history.database[HEADS_COLLECTION]
+
+
+def ensure_history_indexes(history):
+    history.create_index([("username", ASCENDING), ("timestamp", ASCENDING)], name="username_timestamp")
+    history.create_index([("username", ASCENDING), ("kind", ASCENDING), ("timestamp", DESCENDING)], name="username_kind_timestamp")
+
+
+def to_timestamp(value):
+    """Accept epoch seconds, a date or a datetime and return epoch seconds."""
+    if isinstance(value, datetime):
+        return value.timestamp()
+    if isinstance(value, date):
+        return datetime(value.year, value.month, value.day).timestamp()
+    return float(value)
+
+
+def count_value(value):
+    """Counts are stored either as ints or as formatted strings like "12,345"."""
+    try:
+        return int(str(value).replace(",", ""))
+    except ValueError:
+        return 0
+
+
+def snapshot(user_info, images):
+    """The tracked subset of a scrape."""
+    return {
+        "followers": count_value(user_info.get("Followers", 0)),
+        "following": count_value(user_info.get("Following", 0)),
+        "biography": user_info.get("Biography", ""),
+        "posts": {str(image["ID"]): image.get("Likes", 0) for image in images},
+    }
+
+
+def diff(old, new):
+    """Field-level changes that turn snapshot ``old`` into ``new``."""
+    changes = {}
+    for field in ("followers", "following", "biography"):
+        if old.get(field) != new.get(field):
+            changes[field] = new.get(field)
+    old_posts, new_posts = old.get("posts", {}), new.get("posts", {})
+    added = {post_id: likes for post_id, likes in new_posts.items() if post_id not in old_posts}
+    removed = [post_id for post_id in old_posts if post_id not in new_posts]
+    likes = {post_id: count for post_id, count in new_posts.items()
+             if post_id in old_posts and old_posts[post_id] != count}
+    if added:
+        changes["posts_added"] = added
+    if removed:
+        changes["posts_removed"] = removed
+    if likes:
+        changes["likes"] = likes
+    return changes
+
+
+def apply(state, changes):
+    """Return ``state`` with a delta's ``changes`` applied."""
+    state = dict(state, posts=dict(state.get("posts", {})))
+    for field in ("followers", "following", "biography"):
+        if field in changes:
+            state[field] = changes[field]
+    for post_id in changes.get("posts_removed", []):
+        state["posts"].pop(post_id, None)
+    state["posts"].update(changes.get("posts_added", {}))
+    state["posts"].update(changes.get("likes", {}))
+    return state
+
+
+def _chain(history, username, until=None):
+    """Latest baseline at or before ``until`` and the deltas recorded after it."""
+    query = {"username": username, "kind": "baseline"}
+    if until is not None:
+        query["timestamp"] = {"$lte": until}
+    baseline = history.find_one(query, sort=[("timestamp", DESCENDING)])
+    if baseline is None:
+        return None, []
+    delta_time = {"$gt": baseline["timestamp"]}
+    if until is not None:
+        delta_time["$lte"] = until
+    deltas = list(history.find(
+        {"username": username, "kind": "delta", "timestamp": delta_time},
+        sort=[("timestamp", ASCENDING)]
+    ))
+    return baseline, deltas
+
+
+def state_at(history, username, when=None):
+    """Reconstruct the profile as last observed at ``when`` (default: now), or None."""
+    until = None if when is None else to_timestamp(when)
+    baseline, deltas = _chain(history, username, until)
+    if baseline is None:
+        return None
+    state = baseline["snapshot"]
+    for delta in deltas:
+        state = apply(state, delta["changes"])
+    return dict(state, timestamp=deltas[-1]["timestamp"] if deltas else baseline["timestamp"])
+
+
+def _load_heads(history, usernames):
+    """``{username: head}`` for the profiles that have history.
+
+    Heads are read with one query. Profiles recorded before heads existed
+    (history but no head) are rebuilt from their chain once.
+    """
+    heads = {head["_id"]: head for head in history_heads(history).find({"_id": {"$in": usernames}})}
+    missing = [username for username in usernames if username not in heads]
+    legacy = history.distinct("username", {"username": {"$in": missing}, "kind": "baseline"}) if missing else []
+    for username in legacy:
+        baseline, deltas = _chain(history, username)
+        state = baseline["snapshot"]
+        for delta in deltas:
+            state = apply(state, delta["changes"])
+        heads[username] = {"_id": username, "snapshot": state, "deltas": len(deltas)}
+    return heads
+
+
+def history_entries(history, scrapes):
+    """History documents and head updates for ``(user_info, images, timestamp)`` scrapes.
+
+    Returns ``(entries, head_operations)``; write them with record_scrapes.
+    """
+    usernames = list(dict.fromkeys(user_info["Username"] for user_info, _, _ in scrapes))
+    heads = _load_heads(history, usernames) if usernames else {}
+    entries = []
+    for user_info, images, timestamp in scrapes:
+        username = user_info["Username"]
+        timestamp = time.time() if timestamp is None else timestamp
+        current = snapshot(user_info, images)
+        head = heads.get(username)
+        if head is None or head["deltas"] >= BASELINE_EVERY - 1:
+            entries.append({"username": username, "kind": "baseline", "timestamp": timestamp, "snapshot": current})
+            deltas = 0
+        else:
+            entries.append({"username": username, "kind": "delta", "timestamp": timestamp,
+                            "changes": diff(head["snapshot"], current)})
+            deltas = head["deltas"] + 1
+        heads[username] = {"_id": username, "snapshot": current, "deltas": deltas, "timestamp": timestamp}
+    operations = [UpdateOne({"_id": username}, {"$set": heads[username]}, upsert=True) for username in usernames]
+    return entries, operations
+
+
+def record_scrapes(history, scrapes):
+    """Record ``(user_info, images, timestamp)`` scrapes with one insert and one bulk head update."""
+    entries, operations = history_entries(history, scrapes)
+    if entries:
+        history.insert_many(entries)
+        history_heads(history).bulk_write(operations, ordered=False)
+
+
+def record_scrape(history, user_info, images, timestamp=None):
+    record_scrapes(history, [(user_info, images, timestamp)])
+
+
+def timeline(history, username, start=None, end=None):
+    """States of a profile at every scrape in ``[start, end]``, oldest first.
+
+    Each item is ``(timestamp, state, changes)`` where ``changes`` is the
+    difference from the previous observation.
+    """
+    start = None if start is None else to_timestamp(start)
+    end = None if end is None else to_timestamp(end)
+    state = state_at(history, username, start) if start is not None else None
+    query = {"username": username}
+    if start is not None or end is not None:
+        query["timestamp"] = {}
+        if start is not None:
+            query["timestamp"]["$gt"] = start
+        if end is not None:
+            query["timestamp"]["$lte"] = end
+
+    points = []
+    if state is not None:
+        points.append((state["timestamp"], state, {}))
+    for entry in history.find(query, sort=[("timestamp", ASCENDING)]):
+        if entry["kind"] == "baseline":
+            new_state = entry["snapshot"]
+            changes = diff(state, new_state) if state is not None else {}
+        else:
+            new_state = apply(state, entry["changes"]) if state is not None else None
+            changes = entry["changes"]
+        if new_state is None:
+            continue
+        state = new_state
+        points.append((entry["timestamp"], state, changes))
+    return points
+
+
+def changes_between(history, username, start, end):
+    """Net change of a profile between two points in time, or None if unknown at ``end``."""
+    before = state_at(history, username, start)
+    after = state_at(history, username, end)
+    if after is None:
+        return None
+    return diff(before or {}, after)
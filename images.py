@@ -0,0 +1,163 @@
+import functools
+import hashlib
+import os
+import sqlite3
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+
+from cache import CACHE_DIR
+from metrics import timed, track_cache
+
+# ===================== THUMBNAIL CACHE =====================
+THUMBNAIL_DIR = os.path.join(CACHE_DIR, "thumbnails")
+PLACEHOLDER_PATH = "placeholder.png"
+
+# Grid thumbnails are sized for one of three columns in the wide layout;
+# the profile picture gets a little more room.
+GRID_IMAGE_WIDTH = 480
+PROFILE_IMAGE_WIDTH = 640
+DEFAULT_MAX_BYTES = 200 * 1024 * 1024
+PREFETCH_WORKERS = 8
+
+
+class ThumbnailCache:
+    """On-disk cache of downscaled images, stored by the hash of the original bytes.
+
+    A small URL index maps image URLs to content hashes so a rerun can find
+    the thumbnail without downloading anything. Identical images served from
+    different URLs share one file. The least recently used files are deleted
+    once the directory exceeds ``max_bytes``, together with the index rows
+    of images that no longer have a file at any width.
+    """
+
+    def __init__(self, directory=THUMBNAIL_DIR, max_bytes=DEFAULT_MAX_BYTES):
+        os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(os.path.join(directory, "index.sqlite3"), check_same_thread=False)
+        self._conn.execute("CREATE TABLE IF NOT EXISTS urls (url TEXT PRIMARY KEY, digest TEXT)")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS urls_digest ON urls (digest)")
+        self._conn.commit()
+        self._bytes = sum(entry.stat().st_size for entry in os.scandir(directory) if entry.name.endswith(".jpg"))
+
+    def _path(self, digest, width):
+        return os.path.join(self.directory, f"{digest}_{width}.jpg")
+
+    @staticmethod
+    def _digest(name):
+        return name.rsplit("_", 1)[0]
+
+    def get(self, url, width=GRID_IMAGE_WIDTH):
+        """Return the thumbnail path for ``url`` at ``width``, or None if not cached."""
+        with self._lock:
+            row = self._conn.execute("SELECT digest FROM urls WHERE url = ?", (url,)).fetchone()
+        path = None
+        if row is not None:
+            path = self._path(row[0], width)
+            try:
+                os.utime(path)  # mark as recently used
+            except OSError:
+                path = None
+        with self._lock:
+            if path is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        return path
+
+    def put(self, url, content, width=GRID_IMAGE_WIDTH):
+        """Store a downscaled copy of ``content`` and return its path."""
+        digest = hashlib.sha256(content).hexdigest()
+        path = self._path(digest, width)
+        if not os.path.exists(path):
+            from PIL import Image  # Only needed on a cache miss; keeps imports light
+            image = Image.open(BytesIO(content))
+            image.thumbnail((width, width * 2))
+            buffer = BytesIO()
+            image.convert("RGB").save(buffer, format="JPEG", quality=85, optimize=True)
+            # Write to a temp name first so concurrent readers never see a partial file
+            tmp_path = f"{path}.{threading.get_ident()}.tmp"
+            with open(tmp_path, "wb") as file:
+                file.write(buffer.getvalue())
+            with self._lock:
+                # Another thread may have stored the same image meanwhile; count it once
+                if not os.path.exists(path):
+                    self._bytes += buffer.tell()
+                os.replace(tmp_path, path)
+        with self._lock:
+            self._conn.execute("INSERT OR REPLACE INTO urls VALUES (?, ?)", (url, digest))
+            self._conn.commit()
+            if self._bytes > self.max_bytes:
+                self._evict()
+        return path
+
+    def _evict(self):
+        """Delete least recently used thumbnails until the byte budget is met."""
+        entries = sorted(
+            (entry for entry in os.scandir(self.directory) if entry.name.endswith(".jpg")),
+            key=lambda entry: entry.stat().st_mtime,
+        )
+        removed = set()
+        for position, entry in enumerate(entries):
+            if self._bytes <= self.max_bytes:
+                break
+            size = entry.stat().st_size
+            try:
+                os.remove(entry.path)
+            except OSError:
+                continue
+            self._bytes -= size
+            removed.add(position)
+        # URLs of images evicted at every width would only ever miss
+        kept = {self._digest(entry.name) for position, entry in enumerate(entries) if position not in removed}
+        orphaned = {self._digest(entries[position].name) for position in removed} - kept
+        if orphaned:
+            self._conn.executemany("DELETE FROM urls WHERE digest = ?", [(digest,) for digest in orphaned])
+            self._conn.commit()
+
+
+thumbnail_cache = ThumbnailCache()
+track_cache("thumbnails", thumbnail_cache)
+
+
+@functools.lru_cache(maxsize=None)
+def placeholder_image(width=GRID_IMAGE_WIDTH):
+    """Placeholder shown when an image cannot be loaded, read from disk only once."""
+    from PIL import Image
+    try:
+        image = Image.open(PLACEHOLDER_PATH)
+        image.load()
+    except OSError:
+        image = Image.new("RGB", (width, width), (230, 230, 230))
+    return image
+
+
+def cached_image(http_client, url, width=GRID_IMAGE_WIDTH):
+    """Return a thumbnail path for ``url``, downloading it on a cache miss, or None."""
+    if not url or url == "N/A":
+        return None
+    path = thumbnail_cache.get(url, width)
+    if path is not None:
+        return path
+    try:
+        with timed("image_download"):
+            response = http_client.get(url, timeout=5)
+            if response.status_code == 200:
+                return thumbnail_cache.put(url, response.content, width)
+    except Exception:
+        pass  # Handle errors silently
+    return None
+
+
+def prefetch_images(http_client, urls, width=GRID_IMAGE_WIDTH, max_workers=PREFETCH_WORKERS):
+    """Resolve many image URLs in parallel; returns ``{url: path or None}``."""
+    urls = list(dict.fromkeys(urls))
+    if not urls:
+        return {}
+    with ThreadPoolExecutor(max_workers=min(max_workers, len(urls))) as executor:
+        paths = executor.map(lambda url: cached_image(http_client, url, width), urls)
+        return dict(zip(urls, paths))
@@ -0,0 +1,246 @@
+import asyncio
+import json
+import os
+import random
+import sqlite3
+import threading
+import time
+import httpx
+
+from batch import RateLimitedTransport, TokenBucket
+from cache import CACHE_DIR
+from scraper import ScrapeError, fetch_user, make_async_client
+
+# ===================== SCRAPE JOB QUEUE =====================
+JOBS_PATH = os.path.join(CACHE_DIR, "jobs.sqlite3")
+MAX_ATTEMPTS = 5
+BACKOFF_BASE = 2.0  # Seconds before the first retry, doubled on every attempt
+BACKOFF_MAX = 300.0
+LEASE_SECONDS = 300.0  # A claimed job whose worker died is handed out again after this
+IDLE_POLL = 1.0
+
+PENDING, RUNNING, DONE, FAILED = "pending", "running", "done", "failed"
+
+
+def backoff_delay(attempts, retry_after=None, base=BACKOFF_BASE, cap=BACKOFF_MAX):
+    """Seconds to wait before retry number ``attempts``.
+
+    Exponential backoff with full jitter, so workers that failed together do
+    not retry together; never shorter than the server's Retry-After.
+    """
+    delay = random.uniform(0, min(cap, base * 2 ** (attempts - 1)))
+    if retry_after is not None:
+        delay = max(delay, min(retry_after, cap))
+    return delay
+
+
+class JobQueue:
+    """Persistent queue of usernames to scrape, shared by workers and processes.
+
+    A username is queued at most once at a time: submitting it again while
+    it is pending or running is a no-op, while a finished job is queued anew.
+    Claims are leased, so jobs held by a crashed worker become available
+    again after ``lease_seconds``. ``claim``, ``next_due`` and ``counts``
+    can be limited to the jobs of some usernames, e.g. one batch.
+    """
+
+    def __init__(self, path=JOBS_PATH, lease_seconds=LEASE_SECONDS):
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.lease_seconds = lease_seconds
+        self._lock = threading.Lock()
+        # Autocommit mode; claims open their own write transaction
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None, timeout=30)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS jobs ("
+            "key TEXT PRIMARY KEY, username TEXT, status TEXT, attempts INTEGER, "
+            "next_attempt_at REAL, lease_until REAL, last_error TEXT, last_status INTEGER, updated_at REAL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS jobs_due ON jobs (status, next_attempt_at)")
+
+    def submit(self, usernames):
+        """Queue ``usernames``; returns how many were not already queued."""
+        now = time.time()
+        queued = 0
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                for username in dict.fromkeys(u.strip() for u in usernames if u.strip()):
+                    cursor = self._conn.execute(
+                        "INSERT INTO jobs VALUES (?, ?, ?, 0, ?, NULL, NULL, NULL, ?) "
+                        "ON CONFLICT (key) DO UPDATE SET status = excluded.status, attempts = 0, "
+                        "next_attempt_at = excluded.next_attempt_at, last_error = NULL, last_status = NULL, "
+                        "updated_at = excluded.updated_at WHERE jobs.status IN (?, ?)",
+                        (username.lower(), username, PENDING, now, now, DONE, FAILED),
+                    )
+                    queued += cursor.rowcount
+                self._conn.execute("COMMIT")
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+        return queued
+
+    @staticmethod
+    def _scope(usernames):
+        """SQL condition and parameters selecting the jobs of ``usernames`` (all jobs if None)."""
+        if usernames is None:
+            return "1", ()
+        keys = list(dict.fromkeys(u.strip().lower() for u in usernames if u.strip()))
+        # One JSON parameter instead of one per key, however large the batch
+        return "key IN (SELECT value FROM json_each(?))", (json.dumps(keys),)
+
+    def claim(self, usernames=None):
+        """Lease the next due job (of ``usernames``, if given) and return ``(username, attempts)``, or None."""
+        now = time.time()
+        scope, scope_params = self._scope(usernames)
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                row = self._conn.execute(
+                    "SELECT key, username, attempts FROM jobs "
+                    f"WHERE ((status = ? AND next_attempt_at <= ?) OR (status = ? AND lease_until <= ?)) AND {scope} "
+                    "ORDER BY next_attempt_at LIMIT 1",
+                    (PENDING, now, RUNNING, now, *scope_params),
+                ).fetchone()
+                if row is not None:
+                    self._conn.execute(
+                        "UPDATE jobs SET status = ?, attempts = attempts + 1, lease_until = ?, updated_at = ? "
+                        "WHERE key = ?",
+                        (RUNNING, now + self.lease_seconds, now, row[0]),
+                    )
+                self._conn.execute("COMMIT")
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+        return None if row is None else (row[1], row[2] + 1)
+
+    def _finish(self, username, status, error=None, status_code=None, next_attempt_at=None):
+        with self._lock:
+            self._conn.execute(
+                "UPDATE jobs SET status = ?, last_error = ?, last_status = ?, lease_until = NULL, "
+                "next_attempt_at = COALESCE(?, next_attempt_at), updated_at = ? WHERE key = ?",
+                (status, error, status_code, next_attempt_at, time.time(), username.lower()),
+            )
+
+    def complete(self, username):
+        self._finish(username, DONE)
+
+    def complete_many(self, usernames):
+        for username in usernames:
+            self._finish(username, DONE)
+
+    def retry(self, username, delay, error=None, status_code=None):
+        """Put a job back in the queue, due in ``delay`` seconds."""
+        self._finish(username, PENDING, error, status_code, time.time() + delay)
+
+    def fail(self, username, error, status_code=None):
+        self._finish(username, FAILED, error, status_code)
+
+    def next_due(self, usernames=None):
+        """Seconds until a job may become claimable (0 if one is due now), or None if none is left."""
+        scope, scope_params = self._scope(usernames)
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT MIN(CASE status WHEN ? THEN next_attempt_at ELSE lease_until END) "
+                f"FROM jobs WHERE status IN (?, ?) AND {scope}",
+                (PENDING, PENDING, RUNNING, *scope_params),
+            ).fetchone()
+        return None if row[0] is None else max(0.0, row[0] - time.time())
+
+    def counts(self, usernames=None):
+        """Number of jobs per status."""
+        scope, scope_params = self._scope(usernames)
+        with self._lock:
+            rows = self._conn.execute(
+                f"SELECT status, COUNT(*) FROM jobs WHERE {scope} GROUP BY status", scope_params
+            ).fetchall()
+        return {PENDING: 0, RUNNING: 0, DONE: 0, FAILED: 0, **dict(rows)}
+
+    def failures(self, limit=100):
+        """Most recent permanent failures as ``(username, error)``."""
+        with self._lock:
+            return self._conn.execute(
+                "SELECT username, last_error FROM jobs WHERE status = ? ORDER BY updated_at DESC LIMIT ?",
+                (FAILED, limit),
+            ).fetchall()
+
+
+async def process_queue(queue, concurrency=5, requests_per_minute=20, on_result=None, max_attempts=MAX_ATTEMPTS,
+                        force_refresh=False, transport=None, flush=None, usernames=None, **comment_options):
+    """Run ``concurrency`` workers that scrape queued jobs until the queue is drained.
+
+    Transient failures (throttling, server errors, network errors) are retried
+    up to ``max_attempts`` times with exponential backoff; a Retry-After from
+    the server also pauses the shared request budget. ``on_result`` is called
+    with ``(done, total, username, user_info, images)`` once a job succeeds or
+    fails for good, where ``user_info`` is the error message on failure and
+    ``total`` counts the jobs that were open when the run started.
+
+    Without ``flush`` a job is marked done as soon as on_result returns. A
+    caller that buffers results passes its ``flush`` instead and completes
+    jobs itself once their profiles are written (BulkUpserter's
+    ``on_flush=queue.complete_many``); until then they stay leased, so a
+    crash hands them out again. ``flush`` is called whenever no job is due
+    and when the run ends.
+
+    ``usernames`` limits the run to the jobs of those usernames, so a batch
+    does not drain jobs queued by other runs.
+    """
+    limiter = TokenBucket(requests_per_minute / 60.0)
+    if transport is None:
+        limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+        transport = httpx.AsyncHTTPTransport(limits=limits)
+    counts = queue.counts(usernames)
+    total = counts[PENDING] + counts[RUNNING]
+    done = 0
+
+    def finished(username, user_info, images):
+        nonlocal done, total
+        done += 1
+        total = max(total, done)
+        if on_result is not None:
+            on_result(done, total, username, user_info, images)
+
+    async with make_async_client(RateLimitedTransport(limiter, transport), force_refresh) as async_client:
+
+        async def worker():
+            while True:
+                job = queue.claim(usernames)
+                if job is None:
+                    if flush is not None:
+                        flush()
+                    wait = queue.next_due(usernames)
+                    if wait is None:
+                        return
+                    await asyncio.sleep(min(max(wait, 0.05), IDLE_POLL))
+                    continue
+                username, attempts = job
+                try:
+                    user_info, images = await fetch_user(username, async_client, **comment_options)
+                except ScrapeError as e:
+                    if e.retry_after:
+                        limiter.defer(e.retry_after)
+                    if e.transient and attempts < max_attempts:
+                        queue.retry(username, backoff_delay(attempts, e.retry_after), str(e), e.status_code)
+                    else:
+                        queue.fail(username, str(e), e.status_code)
+                        finished(username, str(e), [])
+                    continue
+                except Exception as e:
+                    queue.fail(username, f"An error occurred: {e}")
+                    finished(username, f"An error occurred: {e}", [])
+                    continue
+                finished(username, user_info, images)
+                if flush is None:
+                    queue.complete(username)
+
+        await asyncio.gather(*(worker() for _ in range(concurrency)))
+    if flush is not None:
+        flush()
+    return queue.counts(usernames)
+
+
+def run_queue(queue, concurrency=5, requests_per_minute=20, on_result=None, **options):
+    """Synchronous entry point for process_queue."""
+    return asyncio.run(process_queue(queue, concurrency, requests_per_minute, on_result, **options))
@@ -0,0 +1,195 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+import httpx
+
+from cache import CACHE_DIR
+from metrics import InstrumentedTransport, track_cache
+
+# ===================== LLM INFERENCE =====================
+# Any server speaking the Ollama HTTP API (/api/generate) can answer
+# behavior questions; point SOCIALSCAN_LLM_URL at it.
+LLM_URL = os.environ.get("SOCIALSCAN_LLM_URL", "http://localhost:11434")
+LLM_MODEL = os.environ.get("SOCIALSCAN_LLM_MODEL", "llama3.1")
+LLM_TIMEOUT = 120.0
+LLM_BATCH_WORKERS = 4
+COMPLETION_CACHE_PATH = os.path.join(CACHE_DIR, "completions.sqlite3")
+TOP_CAPTIONS = 5
+
+
+def behavior_snapshot(username, behavior):
+    """The part of a behavior analysis that goes into the prompt."""
+    return {
+        "username": username,
+        "category": behavior["category"],
+        "related_profiles": behavior["related_profiles"],
+        "top_captions": [caption for _, caption in behavior["sorted_likes_captions"][:TOP_CAPTIONS]],
+        "avg_likes": round(float(behavior["avg_likes"]), 2),
+    }
+
+
+def build_prompt(snapshot, query):
+    prompt = f"Generate a response for {snapshot['username']}, a {snapshot['category']} influencer. "
+    prompt += f"Related profiles: {snapshot['related_profiles']}. "
+    prompt += f"Top performing captions include: {', '.join(snapshot['top_captions'])}. "
+    prompt += f"Average engagement score: {snapshot['avg_likes']:.2f}. Query: {query}"
+    return prompt
+
+
+def completion_key(model, snapshot, query):
+    """Stable hash of everything that determines a completion."""
+    payload = json.dumps({"model": model, "snapshot": snapshot, "query": query.strip()}, sort_keys=True, default=str)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class CompletionCache:
+    """Persistent cache of finished completions, keyed by completion_key."""
+
+    def __init__(self, path=COMPLETION_CACHE_PATH):
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS completions (key TEXT PRIMARY KEY, model TEXT, response TEXT, created_at REAL)"
+        )
+        self._conn.commit()
+
+    def get(self, key):
+        with self._lock:
+            row = self._conn.execute("SELECT response FROM completions WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            return row[0]
+
+    def set(self, key, model, response):
+        with self._lock:
+            self._conn.execute("INSERT OR REPLACE INTO completions VALUES (?, ?, ?, ?)",
+                               (key, model, response, time.time()))
+            self._conn.commit()
+
+    def clear(self):
+        with self._lock:
+            self._conn.execute("DELETE FROM completions")
+            self._conn.commit()
+
+
+class OllamaClient:
+    """Minimal client for the Ollama /api/generate endpoint.
+
+    ``transport`` replaces the network transport, e.g. with an
+    httpx.MockTransport standing in for the server.
+    """
+
+    def __init__(self, base_url=LLM_URL, model=LLM_MODEL, timeout=LLM_TIMEOUT, transport=None, options=None):
+        self.model = model
+        self.options = options or {}
+        self.http = httpx.Client(base_url=base_url, timeout=httpx.Timeout(timeout, connect=5.0),
+                                 transport=InstrumentedTransport(transport))
+
+    def _payload(self, prompt, stream):
+        payload = {"model": self.model, "prompt": prompt, "stream": stream}
+        if self.options:
+            payload["options"] = self.options
+        return payload
+
+    def stream(self, prompt):
+        """Yield response fragments as the server produces them."""
+        with self.http.stream("POST", "/api/generate", json=self._payload(prompt, True)) as response:
+            response.raise_for_status()
+            for line in response.iter_lines():
+                if not line:
+                    continue
+                chunk = json.loads(line)
+                if chunk.get("error"):
+                    raise RuntimeError(chunk["error"])
+                if chunk.get("response"):
+                    yield chunk["response"]
+                if chunk.get("done"):
+                    break
+
+    def complete(self, prompt):
+        response = self.http.post("/api/generate", json=self._payload(prompt, False))
+        response.raise_for_status()
+        return response.json().get("response", "")
+
+
+llm_client = OllamaClient()
+completion_cache = CompletionCache()
+track_cache("completions", completion_cache)
+
+
+def ask(username, behavior, query, client=None, cache=None):
+    """Answer ``query`` about a user, yielding the text as it streams in.
+
+    ``behavior`` is the analysis already computed for the user. A cached
+    answer for the same snapshot and query is yielded at once; a fresh one
+    is cached once the stream completes.
+    """
+    client = client or llm_client
+    cache = cache or completion_cache
+    snapshot = behavior_snapshot(username, behavior)
+    key = completion_key(client.model, snapshot, query)
+    cached = cache.get(key)
+    if cached is not None:
+        yield cached
+        return
+    parts = []
+    for part in client.stream(build_prompt(snapshot, query)):
+        parts.append(part)
+        yield part
+    cache.set(key, client.model, "".join(parts))
+
+
+def ask_many(items, client=None, cache=None, max_workers=LLM_BATCH_WORKERS, on_result=None):
+    """Answer many ``(username, behavior, query)`` items; returns answers in input order.
+
+    Cached answers are returned directly and the rest are requested from the
+    server ``max_workers`` at a time, with identical questions sent once.
+    A failed item's answer is the error message. ``on_result`` is called with
+    ``(done, total, username, answer)`` as answers become available.
+    """
+    client = client or llm_client
+    cache = cache or completion_cache
+    answers = [None] * len(items)
+    pending = {}
+    done = 0
+    for index, (username, behavior, query) in enumerate(items):
+        snapshot = behavior_snapshot(username, behavior)
+        key = completion_key(client.model, snapshot, query)
+        cached = cache.get(key)
+        if cached is not None:
+            answers[index] = cached
+            done += 1
+            if on_result is not None:
+                on_result(done, len(items), username, cached)
+        else:
+            pending.setdefault(key, (build_prompt(snapshot, query), []))[1].append(index)
+
+    def generate(key, prompt):
+        try:
+            response = client.complete(prompt)
+        except Exception as e:
+            return f"❌ Error generating content: {e}"
+        cache.set(key, client.model, response)
+        return response
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = {executor.submit(generate, key, prompt): indexes for key, (prompt, indexes) in pending.items()}
+        for future in as_completed(futures):
+            answer = future.result()
+            for index in futures[future]:
+                answers[index] = answer
+                done += 1
+                if on_result is not None:
+                    on_result(done, len(items), items[index][0], answer)
+    return answers
@@ -0,0 +1,429 @@
+import bisect
+import functools
+import math
+import os
+import threading
+import time
+import httpx
+from pymongo import monitoring
+
+# ===================== METRICS REGISTRY =====================
+# In-process counters, gauges and latency histograms. The diagnostics panel
+# reads them through snapshot helpers, and render_prometheus() writes them in
+# the Prometheus text format for a node_exporter textfile collector; set
+# SOCIALSCAN_METRICS_FILE to have them written there periodically.
+METRICS_FILE = os.environ.get("SOCIALSCAN_METRICS_FILE")
+METRICS_INTERVAL = 15.0
+LATENCY_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+# name: (type, help)
+FAMILIES = {
+    "socialscan_stage_seconds": ("histogram", "Wall time of pipeline stages."),
+    "socialscan_http_request_seconds": ("histogram", "Time from sending a request to receiving response headers."),
+    "socialscan_http_responses_total": ("counter", "HTTP responses by endpoint and status code."),
+    "socialscan_http_errors_total": ("counter", "HTTP requests that failed without a response."),
+    "socialscan_http_received_bytes_total": ("counter", "Response body bytes read off the network."),
+    "socialscan_mongo_command_seconds": ("histogram", "MongoDB command round trips."),
+    "socialscan_mongo_command_failures_total": ("counter", "MongoDB commands that returned an error."),
+    "socialscan_cache_lookups_total": ("counter", "Cache lookups by cache and result."),
+    "socialscan_cache_hit_ratio": ("gauge", "Share of cache lookups answered from the cache."),
+    "socialscan_queue_depth": ("gauge", "Work items waiting or in progress, by queue and state."),
+    "socialscan_startup_seconds": ("gauge", "Duration of the first app script run in this process (cold start)."),
+}
+
+# URL fragments that name an endpoint in HTTP metrics; anything else is "other"
+ENDPOINTS = {
+    "/users/web_profile_info/": "profile",
+    "/comments/": "comments",
+    "/api/generate": "llm",
+    "cdninstagram.com": "image",
+    "fbcdn.net": "image",
+}
+
+
+def _label_key(labels):
+    return tuple(sorted((name, str(value)) for name, value in labels.items()))
+
+
+class Histogram:
+    """Cumulative-bucket histogram, the layout Prometheus expects."""
+
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+
+    def quantile(self, q):
+        """Estimate of the ``q`` quantile, interpolated within its bucket like histogram_quantile()."""
+        if not self.count:
+            return math.nan
+        rank = q * self.count
+        seen = 0
+        for i, count in enumerate(self.counts):
+            if seen + count >= rank and count:
+                lower = self.buckets[i - 1] if i else 0.0
+                if i == len(self.buckets):
+                    return lower
+                return lower + (self.buckets[i] - lower) * (rank - seen) / count
+            seen += count
+        return self.buckets[-1]
+
+
+class MetricsRegistry:
+    """Thread-safe store of every metric, keyed by family name and label set.
+
+    ``on_collect`` callbacks run before each snapshot or export, for values
+    that are cheaper to read on demand (cache counters, queue sizes).
+    """
+
+    def __init__(self, families=FAMILIES):
+        self.families = dict(families)
+        self._values = {}
+        self._histograms = {}
+        self._collectors = []
+        self._lock = threading.Lock()
+
+    def inc(self, name, amount=1, **labels):
+        with self._lock:
+            key = (name, _label_key(labels))
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def set(self, name, value, **labels):
+        with self._lock:
+            self._values[(name, _label_key(labels))] = value
+
+    def set_default(self, name, value, **labels):
+        """Set a value only if it has none yet; returns the value in place."""
+        with self._lock:
+            return self._values.setdefault((name, _label_key(labels)), value)
+
+    def observe(self, name, value, **labels):
+        with self._lock:
+            key = (name, _label_key(labels))
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = self._histograms[key] = Histogram()
+            histogram.observe(value)
+
+    def on_collect(self, callback):
+        with self._lock:
+            self._collectors.append(callback)
+        return callback
+
+    def collect(self):
+        """Run the collect callbacks; a failing one is skipped rather than breaking the export."""
+        for callback in list(self._collectors):
+            try:
+                callback()
+            except Exception:
+                pass
+
+    def values(self, name):
+        """``{labels: value}`` for one counter or gauge family."""
+        with self._lock:
+            return {labels: value for (family, labels), value in self._values.items() if family == name}
+
+    def histograms(self, name):
+        """``{labels: Histogram}`` for one histogram family."""
+        with self._lock:
+            return {labels: histogram for (family, labels), histogram in self._histograms.items() if family == name}
+
+    def reset(self):
+        with self._lock:
+            self._values.clear()
+            self._histograms.clear()
+
+    def render_prometheus(self):
+        """Every metric in the Prometheus text exposition format."""
+        self.collect()
+        with self._lock:
+            values = sorted(self._values.items())
+            histograms = sorted(self._histograms.items(), key=lambda item: item[0])
+        lines = []
+        for name, (kind, help_text) in self.families.items():
+            samples = []
+            if kind == "histogram":
+                for (family, labels), histogram in histograms:
+                    if family != name:
+                        continue
+                    cumulative = 0
+                    for bound, count in zip(histogram.buckets + (math.inf,), histogram.counts):
+                        cumulative += count
+                        le = "+Inf" if bound == math.inf else repr(bound)
+                        samples.append(f"{name}_bucket{_format_labels(labels + (('le', le),))} {cumulative}")
+                    samples.append(f"{name}_sum{_format_labels(labels)} {histogram.sum!r}")
+                    samples.append(f"{name}_count{_format_labels(labels)} {histogram.count}")
+            else:
+                samples = [f"{name}{_format_labels(labels)} {value!r}"
+                           for (family, labels), value in values if family == name]
+            if samples:
+                lines += [f"# HELP {name} {help_text}", f"# TYPE {name} {kind}"] + samples
+        return "\n".join(lines) + "\n"
+
+    def write_textfile(self, path):
+        """Write the Prometheus export to ``path`` atomically, as textfile collectors require."""
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            f.write(self.render_prometheus())
+        os.replace(tmp_path, path)
+
+
+def _format_labels(labels):
+    if not labels:
+        return ""
+    escaped = (str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"') for _, value in labels)
+    return "{" + ",".join(f'{name}="{value}"' for (name, _), value in zip(labels, escaped)) + "}"
+
+
+metrics = MetricsRegistry()
+
+
+def histogram_summary(name, registry=metrics):
+    """One row per label set of a histogram: its labels, count, mean and p50/p95 in milliseconds."""
+    rows = []
+    for labels, histogram in sorted(registry.histograms(name).items()):
+        rows.append({
+            **dict(labels),
+            "count": histogram.count,
+            "mean_ms": 1000 * histogram.sum / histogram.count if histogram.count else math.nan,
+            "p50_ms": 1000 * histogram.quantile(0.5),
+            "p95_ms": 1000 * histogram.quantile(0.95),
+        })
+    return rows
+
+
+def value_summary(name, registry=metrics):
+    """One row per label set of a counter or gauge: its labels and value."""
+    return [{**dict(labels), "value": value} for labels, value in sorted(registry.values(name).items())]
+
+
+# ===================== INSTRUMENTATION =====================
+class timed:
+    """Record the wall time of a block or function under ``socialscan_stage_seconds{stage=...}``.
+
+    Use as ``with timed("csv_parse"):`` or as a ``@timed("csv_parse")``
+    decorator. Time spent in a block that raises is recorded too.
+    """
+
+    def __init__(self, stage, registry=metrics):
+        self.stage = stage
+        self.registry = registry
+        self._started = []
+
+    def __enter__(self):
+        self._started.append(time.perf_counter())
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.registry.observe("socialscan_stage_seconds", time.perf_counter() - self._started.pop(), stage=self.stage)
+
+    def __call__(self, function):
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            with timed(self.stage, self.registry):
+                return function(*args, **kwargs)
+        return wrapper
+
+
+def endpoint_label(url):
+    url = str(url)
+    for fragment, endpoint in ENDPOINTS.items():
+        if fragment in url:
+            return endpoint
+    return "other"
+
+
+class _CountingStream(httpx.SyncByteStream, httpx.AsyncByteStream):
+    """Response body wrapper that reports how many bytes were read once it is closed."""
+
+    def __init__(self, stream, on_close):
+        self._stream = stream
+        self._on_close = on_close
+        self._bytes = 0
+
+    def __iter__(self):
+        for chunk in self._stream:
+            self._bytes += len(chunk)
+            yield chunk
+
+    async def __aiter__(self):
+        async for chunk in self._stream:
+            self._bytes += len(chunk)
+            yield chunk
+
+    def _report(self):
+        if self._on_close is not None:
+            self._on_close(self._bytes)
+            self._on_close = None
+
+    def close(self):
+        self._report()
+        if hasattr(self._stream, "close"):
+            self._stream.close()
+
+    async def aclose(self):
+        self._report()
+        if hasattr(self._stream, "aclose"):
+            await self._stream.aclose()
+
+
+class InstrumentedTransport(httpx.BaseTransport, httpx.AsyncBaseTransport):
+    """httpx transport that times requests and counts status codes and body bytes per endpoint.
+
+    Wraps the network transport, so cached responses served above it are
+    not counted as traffic.
+    """
+
+    def __init__(self, transport=None, registry=metrics):
+        self.transport = transport
+        self.registry = registry
+
+    def _record(self, request, started, response=None):
+        endpoint = endpoint_label(request.url)
+        self.registry.observe("socialscan_http_request_seconds", time.perf_counter() - started, endpoint=endpoint)
+        if response is None:
+            self.registry.inc("socialscan_http_errors_total", endpoint=endpoint)
+            return response
+        self.registry.inc("socialscan_http_responses_total", endpoint=endpoint, status=response.status_code)
+
+        def received(size):
+            self.registry.inc("socialscan_http_received_bytes_total", size, endpoint=endpoint)
+
+        try:
+            received(len(response.content))  # Transports that return the body already read
+        except httpx.ResponseNotRead:
+            response.stream = _CountingStream(response.stream, received)
+        return response
+
+    def handle_request(self, request):
+        if self.transport is None:
+            self.transport = httpx.HTTPTransport()
+        started = time.perf_counter()
+        try:
+            response = self.transport.handle_request(request)
+        except Exception:
+            self._record(request, started)
+            raise
+        return self._record(request, started, response)
+
+    async def handle_async_request(self, request):
+        if self.transport is None:
+            self.transport = httpx.AsyncHTTPTransport()
+        started = time.perf_counter()
+        try:
+            response = await self.transport.handle_async_request(request)
+        except Exception:
+            self._record(request, started)
+            raise
+        return self._record(request, started, response)
+
+    def close(self):
+        if self.transport is not None:
+            self.transport.close()
+
+    async def aclose(self):
+        if self.transport is not None:
+            await self.transport.aclose()
+
+
+class MongoCommandMetrics(monitoring.CommandListener):
+    """pymongo command listener timing every command per command name and collection.
+
+    Pass an instance to ``MongoClient(event_listeners=[...])``.
+    """
+
+    def __init__(self, registry=metrics):
+        self.registry = registry
+        self._collections = {}
+        self._lock = threading.Lock()
+
+    def started(self, event):
+        target = event.command.get(event.command_name)
+        with self._lock:
+            self._collections[(event.connection_id, event.request_id)] = target if isinstance(target, str) else ""
+
+    def _finish(self, event):
+        with self._lock:
+            return self._collections.pop((event.connection_id, event.request_id), "")
+
+    def succeeded(self, event):
+        self.registry.observe("socialscan_mongo_command_seconds", event.duration_micros / 1e6,
+                              command=event.command_name, collection=self._finish(event))
+
+    def failed(self, event):
+        collection = self._finish(event)
+        self.registry.observe("socialscan_mongo_command_seconds", event.duration_micros / 1e6,
+                              command=event.command_name, collection=collection)
+        self.registry.inc("socialscan_mongo_command_failures_total", command=event.command_name,
+                          collection=collection)
+
+
+mongo_listener = MongoCommandMetrics()
+
+
+def track_cache(name, cache, registry=metrics):
+    """Export the ``hits`` and ``misses`` counters of ``cache`` under its ``name``."""
+    def collect():
+        hits, misses = cache.hits, cache.misses
+        registry.set("socialscan_cache_lookups_total", hits, cache=name, result="hit")
+        registry.set("socialscan_cache_lookups_total", misses, cache=name, result="miss")
+        registry.set("socialscan_cache_hit_ratio", hits / (hits + misses) if hits + misses else 0.0, cache=name)
+    return registry.on_collect(collect)
+
+
+def track_queue(name, counts, registry=metrics):
+    """Export the ``{state: size}`` mapping returned by ``counts()`` as the depth of queue ``name``."""
+    def collect():
+        for state, size in counts().items():
+            registry.set("socialscan_queue_depth", size, queue=name, state=state)
+    return registry.on_collect(collect)
+
+
+def queue_depth(name, state, delta, registry=metrics):
+    """Move the depth of a live queue (e.g. profiles waiting for a batch slot) by ``delta``."""
+    registry.inc("socialscan_queue_depth", delta, queue=name, state=state)
+
+
+def set_queue_depth(name, state, size, registry=metrics):
+    registry.set("socialscan_queue_depth", size, queue=name, state=state)
+
+
+def record_run(seconds, registry=metrics):
+    """Time one app script run; the process's first run is also kept as its startup time."""
+    registry.observe("socialscan_stage_seconds", seconds, stage="script_run")
+    registry.set_default("socialscan_startup_seconds", seconds)
+
+
+_exporter = None
+_exporter_lock = threading.Lock()
+
+
+def start_textfile_exporter(path=METRICS_FILE, interval=METRICS_INTERVAL, registry=metrics):
+    """Rewrite ``path`` every ``interval`` seconds from a daemon thread; one per process.
+
+    Does nothing if ``path`` is empty. Returns the running thread, if any.
+    """
+    global _exporter
+    if not path:
+        return None
+    with _exporter_lock:
+        if _exporter is None or not _exporter.is_alive():
+            def run():
+                while True:
+                    try:
+                        registry.write_textfile(path)
+                    except OSError:
+                        pass
+                    time.sleep(interval)
+
+            _exporter = threading.Thread(target=run, name="metrics-textfile", daemon=True)
+            _exporter.start()
+        return _exporter
@@ -0,0 +1,84 @@
+from collections.abc import Mapping
+
+# ===================== PROFILE AND POST MODELS =====================
+# Scrape results are held as slotted objects instead of dicts. A slotted
+# instance stores its values in a fixed array, with no per-instance dict of
+# key strings, so a batch holding thousands of profiles in flight needs a
+# fraction of the memory. Records read like the dicts the rest of the code
+# uses (``user_info["Followers"]``, ``image.get("Caption")``) and convert to
+# plain dicts for MongoDB.
+
+
+class Record(Mapping):
+    """Read-only mapping view of ``__slots__`` under the document keys in ``FIELDS``.
+
+    ``FIELDS`` maps each document key to the slot that holds it and
+    ``DEFAULTS`` gives the value of slots left out of the constructor.
+    Slots outside ``FIELDS`` are kept off the document.
+    """
+    __slots__ = ()
+    FIELDS = {}
+    DEFAULTS = {}
+
+    def __init__(self, **values):
+        for slot in self.__slots__:
+            if slot in values:
+                setattr(self, slot, values[slot])
+            else:
+                default = self.DEFAULTS.get(slot)
+                # Lists are copied so records never share a default
+                setattr(self, slot, list(default) if isinstance(default, list) else default)
+
+    @classmethod
+    def from_document(cls, document):
+        """Build a record from a stored document (or any mapping with the document keys)."""
+        return cls(**{slot: document[key] for key, slot in cls.FIELDS.items() if key in document})
+
+    def to_document(self):
+        return {key: getattr(self, slot) for key, slot in self.FIELDS.items()}
+
+    def __getitem__(self, key):
+        try:
+            slot = self.FIELDS[key]
+        except KeyError:
+            raise KeyError(key) from None
+        return getattr(self, slot)
+
+    def __iter__(self):
+        return iter(self.FIELDS)
+
+    def __len__(self):
+        return len(self.FIELDS)
+
+    def __repr__(self):
+        return f"{type(self).__name__}({self.to_document()!r})"
+
+
+class Profile(Record):
+    """The profile fields of one scrape, keyed like the stored ``user_info``."""
+    __slots__ = ("username", "full_name", "id", "category", "business_category", "phone", "email", "biography",
+                 "bio_links", "homepage", "followers", "following", "facebook_id", "is_private", "is_verified",
+                 "profile_image", "video_count", "image_count", "saved_count", "collections_count",
+                 "related_profiles")
+    FIELDS = {
+        "Username": "username", "Full Name": "full_name", "ID": "id", "Category": "category",
+        "Business Category": "business_category", "Phone": "phone", "Email": "email", "Biography": "biography",
+        "Bio Links": "bio_links", "Homepage": "homepage", "Followers": "followers", "Following": "following",
+        "Facebook ID": "facebook_id", "Is Private": "is_private", "Is Verified": "is_verified",
+        "Profile Image": "profile_image", "Video Count": "video_count", "Image Count": "image_count",
+        "Saved Count": "saved_count", "Collections Count": "collections_count",
+        "Related Profiles": "related_profiles",
+    }
+    DEFAULTS = dict({slot: "N/A" for slot in __slots__}, bio_links=[], related_profiles=[], followers=0,
+                    following=0, video_count=0, image_count=0, saved_count=0, collections_count=0)
+
+
+class Post(Record):
+    """One post of a scrape, keyed like the scraper's image dicts.
+
+    ``comment_total`` is the comment count Instagram reports for the post;
+    it decides whether comments are fetched and is not stored.
+    """
+    __slots__ = ("id", "source", "likes", "caption", "comments", "comment_total")
+    FIELDS = {"ID": "id", "Source": "source", "Likes": "likes", "Caption": "caption", "Comments": "comments"}
+    DEFAULTS = {"id": "N/A", "source": "N/A", "likes": 0, "caption": "N/A", "comments": [], "comment_total": 0}
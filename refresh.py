@@ -0,0 +1,107 @@
+import math
+import time
+
+from batch import run_batch
+from storage import USERNAME_FIELD, update_changed
+
+# ===================== REFRESH SCHEDULER =====================
+# Profiles are refreshed in order of how likely they are to have changed
+# since their last scrape. Each profile's change rate is estimated from the
+# scrape history, and the chance it has changed after ``age`` hours is
+# 1 - exp(-rate * age).
+RATE_WINDOW_DAYS = 30
+PRIOR_CHANGES = 1.0  # Smoothing: every profile is assumed to change about once...
+PRIOR_HOURS = 24.0  # ...a day until its history says otherwise
+POSTS_WITH_COMMENTS = 12  # Posts per profile assumed to need comment requests
+REFRESH_INTERVAL = 3600
+
+
+def requests_per_profile(comment_pages=0):
+    """Estimated requests one refresh costs."""
+    return 1 + comment_pages * POSTS_WITH_COMMENTS
+
+
+def change_rates(history, since):
+    """Observed changes per hour for every username with history since ``since``."""
+    pipeline = [
+        {"$match": {"timestamp": {"$gte": since}}},
+        {"$group": {
+            "_id": "$username",
+            "changes": {"$sum": {"$cond": [
+                {"$gt": [{"$size": {"$objectToArray": {"$ifNull": ["$changes", {}]}}}, 0]}, 1, 0
+            ]}},
+            "first": {"$min": "$timestamp"},
+            "last": {"$max": "$timestamp"},
+        }},
+    ]
+    return {
+        row["_id"]: (row["changes"] + PRIOR_CHANGES) / ((row["last"] - row["first"]) / 3600 + PRIOR_HOURS)
+        for row in history.aggregate(pipeline)
+    }
+
+
+def refresh_candidates(collection, history, limit, now=None, window_days=RATE_WINDOW_DAYS):
+    """The ``limit`` stored profiles most likely to be out of date, most urgent first.
+
+    Returns ``(username, score, age_hours)`` tuples; the score is the
+    estimated probability that the profile changed since it was scraped.
+    """
+    now = time.time() if now is None else now
+    rates = change_rates(history, now - window_days * 86400)
+    default_rate = PRIOR_CHANGES / PRIOR_HOURS
+    candidates = []
+    for document in collection.find({}, {"_id": 0, USERNAME_FIELD: 1, "timestamp": 1}):
+        username = document.get("user_info", {}).get("Username")
+        if not username:
+            continue
+        age = max(0.0, (now - document.get("timestamp", 0)) / 3600)
+        score = 1 - math.exp(-rates.get(username, default_rate) * age)
+        candidates.append((username, score, age))
+    candidates.sort(key=lambda candidate: (candidate[1], candidate[2]), reverse=True)
+    return candidates[:limit]
+
+
+def refresh_cycle(collection, history, requests_per_hour, comment_pages=0, concurrency=5, on_result=None,
+                  **options):
+    """Refresh as many of the stalest profiles as one hour of request budget allows.
+
+    Scrapes run at the budget's rate and only changed fields are written
+    back. ``on_result`` is called with ``(done, total, username, changed)``
+    where ``changed`` is the list of changed fields, None for a profile
+    written in full, or the error message if the scrape failed. Returns a
+    summary of the cycle; profiles written in full count as ``written``.
+    """
+    limit = max(1, int(requests_per_hour // requests_per_profile(comment_pages)))
+    planned = refresh_candidates(collection, history, limit)
+    summary = {"planned": len(planned), "changed": 0, "written": 0, "unchanged": 0, "failed": 0, "fields": {}}
+
+    def saved(done, total, username, user_info, images):
+        if isinstance(user_info, str):
+            summary["failed"] += 1
+            changed = user_info
+        else:
+            changed = update_changed(collection, user_info, images, history, with_comments=comment_pages > 0)
+            summary["written" if changed is None else "changed" if changed else "unchanged"] += 1
+            for field in changed or []:
+                summary["fields"][field] = summary["fields"].get(field, 0) + 1
+        if on_result is not None:
+            on_result(done, total, username, changed)
+
+    if planned:
+        run_batch([username for username, _, _ in planned], concurrency, requests_per_hour / 60, saved,
+                  comment_pages=comment_pages, **options)
+    return summary
+
+
+def run_scheduler(collection, history, requests_per_hour, interval=REFRESH_INTERVAL, cycles=None, on_cycle=None,
+                  **options):
+    """Run a refresh cycle every ``interval`` seconds (forever unless ``cycles`` is given)."""
+    cycle = 0
+    while cycles is None or cycle < cycles:
+        started = time.monotonic()
+        summary = refresh_cycle(collection, history, requests_per_hour, **options)
+        if on_cycle is not None:
+            on_cycle(summary)
+        cycle += 1
+        if cycles is None or cycle < cycles:
+            time.sleep(max(0.0, interval - (time.monotonic() - started)))
@@ -0,0 +1,374 @@
+import asyncio
+import contextvars
+import functools
+import json
+import time
+from email.utils import parsedate_to_datetime
+import httpx
+
+from cache import ResponseCache, CachingTransport
+from metrics import InstrumentedTransport, queue_depth, timed, track_cache
+from models import Post, Profile
+
+# ===================== HTTP CLIENT =====================
+HEADERS = {
+    "x-ig-app-id": "936619743392459",
+    "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/62.0.3202.94 Safari/537.36",
+    "Accept-Language": "en-US,en;q=0.9,ru;q=0.8",
+    "Accept-Encoding": "gzip, deflate, br",
+    "Accept": "/",
+}
+
+PROFILE_URL = "https://i.instagram.com/api/v1/users/web_profile_info/?username={username}"
+COMMENTS_URL = "https://i.instagram.com/api/v1/media/{media_id}/comments/"
+
+# Comment stage defaults: posts fetched in parallel, pages followed per post,
+# and the wall-clock budget (seconds) for all comments of one profile
+COMMENT_CONCURRENCY = 4
+COMMENT_MAX_PAGES = 5
+COMMENT_DEADLINE = 20.0
+
+# Connection pool and timeouts of the HTTP clients
+HTTP_TIMEOUT = httpx.Timeout(15.0, connect=5.0)
+HTTP_LIMITS = httpx.Limits(max_connections=20, max_keepalive_connections=10, keepalive_expiry=30.0)
+
+# Responses worth retrying later: throttling, timeouts and server errors
+TRANSIENT_STATUS_CODES = {408, 425, 429, 500, 502, 503, 504}
+
+# Profile and comment responses are cached on disk; see cache.DEFAULT_TTLS
+response_cache = ResponseCache()
+track_cache("responses", response_cache)
+
+
+@functools.lru_cache(maxsize=None)
+def http_client():
+    """Process-wide client for synchronous requests such as image downloads.
+
+    Built on first use, since setting up TLS takes noticeable time at import.
+    """
+    transport = CachingTransport(response_cache, InstrumentedTransport(httpx.HTTPTransport(limits=HTTP_LIMITS)))
+    return httpx.Client(headers=HEADERS, timeout=HTTP_TIMEOUT, transport=transport)
+
+
+def make_async_client(transport=None, force_refresh=False, **kwargs):
+    """Build an AsyncClient whose requests go through the response cache.
+
+    ``transport`` is the network transport behind the cache (a plain
+    AsyncHTTPTransport by default); it is wrapped in an InstrumentedTransport
+    unless it sets ``instrumented`` itself. ``force_refresh`` skips cache reads.
+    """
+    transport = transport or httpx.AsyncHTTPTransport(limits=HTTP_LIMITS)
+    if not getattr(transport, "instrumented", False):
+        transport = InstrumentedTransport(transport)
+    transport = CachingTransport(response_cache, transport, force_refresh)
+    kwargs.setdefault("timeout", HTTP_TIMEOUT)
+    return httpx.AsyncClient(headers=HEADERS, transport=transport, **kwargs)
+
+
+class ScrapeError(Exception):
+    """Raised when a profile response cannot be turned into user data.
+
+    ``status_code`` and ``retry_after`` (seconds) are set for HTTP errors, and
+    ``transient`` tells whether the same request may succeed later.
+    """
+
+    def __init__(self, message, status_code=None, retry_after=None, transient=None):
+        super().__init__(message)
+        self.status_code = status_code
+        self.retry_after = retry_after
+        self.transient = status_code in TRANSIENT_STATUS_CODES if transient is None else transient
+
+
+def retry_after_seconds(value):
+    """Parse a Retry-After header (delay in seconds or an HTTP date); None if absent or invalid."""
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+# ===================== RESPONSE PARSING =====================
+# Keys of the web_profile_info payload read by parse_user and parse_post.
+# Every other key is dropped from each object as soon as it is decoded, so
+# thumbnails, dimensions, previews and the rest never outlive the parse.
+PROFILE_KEYS = frozenset({
+    "data", "user", "edges", "node", "count", "text", "url", "id", "username", "full_name", "category_name",
+    "business_category_name", "business_phone_number", "business_email", "biography", "bio_links",
+    "external_url", "edge_followed_by", "edge_follow", "fbid", "is_private", "is_verified", "profile_pic_url_hd",
+    "edge_felix_video_timeline", "edge_owner_to_timeline_media", "edge_saved_media", "edge_related_profiles",
+    "display_url", "edge_liked_by", "edge_media_to_caption", "edge_media_to_comment",
+})
+
+
+def keep_profile_keys(pairs):
+    return {key: value for key, value in pairs if key in PROFILE_KEYS}
+
+
+def extract_user_node(result):
+    """Validate a web_profile_info response and return its user node, reduced to PROFILE_KEYS."""
+    if result.status_code != 200:
+        raise ScrapeError(f"Failed to retrieve data. Status code: {result.status_code}",
+                          result.status_code, retry_after_seconds(result.headers.get("Retry-After")))
+
+    try:
+        data = json.loads(result.content, object_pairs_hook=keep_profile_keys)
+    except json.JSONDecodeError:
+        # Throttled sessions get an HTML login page instead of JSON
+        raise ScrapeError("Error decoding JSON response from the server.", transient=True)
+
+    user_info = data.get("data", {}).get("user", {})
+    if not user_info:
+        raise ScrapeError("User not found or unable to retrieve data.")
+    return user_info
+
+
+def parse_user(user_info):
+    """Extract the user details shown in the UI and stored in MongoDB."""
+    return Profile(
+        username=user_info.get("username", "N/A"),
+        full_name=user_info.get("full_name", "N/A"),
+        id=user_info.get("id", "N/A"),
+        category=user_info.get("category_name", "N/A"),
+        business_category=user_info.get("business_category_name", "N/A"),
+        phone=user_info.get("business_phone_number", "N/A"),
+        email=user_info.get("business_email", "N/A"),
+        biography=user_info.get("biography", "N/A"),
+        bio_links=[link.get("url") for link in user_info.get("bio_links", []) if link.get("url")],
+        homepage=user_info.get("external_url", "N/A"),
+        followers=user_info.get("edge_followed_by", {}).get("count", 0),
+        following=user_info.get("edge_follow", {}).get("count", 0),
+        facebook_id=user_info.get("fbid", "N/A"),
+        is_private=user_info.get("is_private", "N/A"),
+        is_verified=user_info.get("is_verified", "N/A"),
+        profile_image=user_info.get("profile_pic_url_hd", "N/A"),
+        video_count=user_info.get("edge_felix_video_timeline", {}).get("count", 0),
+        image_count=user_info.get("edge_owner_to_timeline_media", {}).get("count", 0),
+        saved_count=user_info.get("edge_saved_media", {}).get("count", 0),
+        collections_count=user_info.get("edge_saved_media", {}).get("count", 0),
+        related_profiles=[profile.get("node", {}).get("username", "N/A") for profile in user_info.get("edge_related_profiles", {}).get("edges", [])],
+    )
+
+
+def post_nodes(user_info):
+    """Return the timeline media nodes of a raw user node."""
+    return [edge.get("node", {}) for edge in user_info.get("edge_owner_to_timeline_media", {}).get("edges", [])]
+
+
+def parse_post(image_node, comments=None):
+    """Extract the fields of a single post."""
+    return Post(
+        id=image_node.get("id", "N/A"),
+        source=image_node.get("display_url", "N/A"),
+        likes=image_node.get("edge_liked_by", {}).get("count", 0),
+        caption=image_node.get("edge_media_to_caption", {}).get("edges", [{}])[0].get("node", {}).get("text", "N/A"),
+        comments=[] if comments is None else comments,
+        comment_total=image_node.get("edge_media_to_comment", {}).get("count", 0),
+    )
+
+
+def parse_profile(result):
+    """Validate a web_profile_info response and return ``(Profile, [Post, ...])`` without comments."""
+    user_info = extract_user_node(result)
+    return parse_user(user_info), [parse_post(image_node) for image_node in post_nodes(user_info)]
+
+
+def parse_comments(comments_data):
+    return [comment.get("text", "") for comment in comments_data.get("comments", [])]
+
+
+def next_comments_cursor(comments_data):
+    """Return the cursor of the next comments page, or None on the last page."""
+    if comments_data.get("has_more_comments") is False:
+        return None
+    return comments_data.get("next_max_id") or None
+
+
+# ===================== COMMENT STAGE =====================
+class NetworkClock:
+    """Stage clock that stops while the stage is held up only by the rate limiter.
+
+    The clock stops while requests of the stage wait for a rate-limit token
+    and none of its requests are on the network: waiting alongside a request
+    in flight costs the stage nothing. fetch_comments installs one in
+    ``rate_limit_clock``; the rate-limited transport of batch runs calls
+    ``pause`` before its wait, ``resume`` once it has a token and ``done``
+    when the response arrives.
+    """
+
+    def __init__(self):
+        self._started = time.monotonic()
+        self._paused = 0.0
+        self._waiting = 0
+        self._sending = 0
+        self._pause_started = None
+
+    def _stalled(self):
+        return self._waiting > 0 and self._sending == 0
+
+    def _changed(self, was_stalled):
+        if self._stalled() and not was_stalled:
+            self._pause_started = time.monotonic()
+        elif was_stalled and not self._stalled():
+            self._paused += time.monotonic() - self._pause_started
+
+    def pause(self):
+        was_stalled = self._stalled()
+        self._waiting += 1
+        self._changed(was_stalled)
+
+    def resume(self, sending=True):
+        """A request stopped waiting; ``sending`` if it went on to the network."""
+        was_stalled = self._stalled()
+        self._waiting -= 1
+        self._sending += sending
+        self._changed(was_stalled)
+
+    def done(self):
+        was_stalled = self._stalled()
+        self._sending -= 1
+        self._changed(was_stalled)
+
+    def elapsed(self):
+        now = time.monotonic()
+        paused = self._paused + (now - self._pause_started if self._stalled() else 0.0)
+        return now - self._started - paused
+
+
+rate_limit_clock = contextvars.ContextVar("rate_limit_clock", default=None)
+
+
+async def fetch_post_comments(async_client, media_id, max_pages=COMMENT_MAX_PAGES, sink=None):
+    """Fetch up to ``max_pages`` pages of comments for one post, following cursors.
+
+    Pages are appended to ``sink`` as they arrive so a caller that cancels the
+    task at a deadline still keeps everything fetched so far.
+    """
+    comments = sink if sink is not None else []
+    cursor = None
+    for _ in range(max_pages):
+        params = {"max_id": cursor} if cursor else None
+        response = await async_client.get(COMMENTS_URL.format(media_id=media_id), params=params)
+        if response.status_code != 200:
+            break
+        comments_data = response.json()
+        comments.extend(parse_comments(comments_data))
+        cursor = next_comments_cursor(comments_data)
+        if not cursor:
+            break
+    return comments
+
+
+async def fetch_comments(async_client, posts, concurrency=COMMENT_CONCURRENCY,
+                         max_pages=COMMENT_MAX_PAGES, deadline=COMMENT_DEADLINE):
+    """Fetch comments for every Post that has any, fanning out across posts.
+
+    At most ``concurrency`` posts are fetched at once. Whatever has not
+    finished after ``deadline`` seconds of network time is cancelled, and the
+    comments collected up to that point are returned. Network time is wall
+    time minus the stretches in which every request of the stage is waiting
+    for a token of a shared rate limiter (batch, queue and crawl runs) and
+    none is on the network, so a tight request budget does not truncate
+    comment threads while waits that overlap a request in flight still
+    count. Returns ``{media_id: [text, ...]}``.
+    """
+    semaphore = asyncio.Semaphore(concurrency)
+    collected = {}
+
+    async def fetch_one(media_id):
+        queue_depth("comments", "waiting", 1)
+        state = "waiting"
+        try:
+            async with semaphore:
+                queue_depth("comments", "waiting", -1)
+                queue_depth("comments", "running", 1)
+                state = "running"
+                await fetch_post_comments(async_client, media_id, max_pages, collected[media_id])
+        finally:
+            queue_depth("comments", state, -1)
+
+    clock = NetworkClock()
+    # Tasks copy the current context, so every request of this stage sees the clock
+    token = rate_limit_clock.set(clock)
+    tasks = []
+    try:
+        for post in posts:
+            if post.comment_total > 0:
+                media_id = post.id
+                collected[media_id] = []
+                tasks.append(asyncio.create_task(fetch_one(media_id)))
+    finally:
+        rate_limit_clock.reset(token)
+    if not tasks:
+        return collected
+
+    done, pending = set(), set(tasks)
+    while pending:
+        remaining = deadline - clock.elapsed()
+        if remaining <= 0:
+            break
+        finished, pending = await asyncio.wait(pending, timeout=remaining)
+        done |= finished
+    for task in pending:
+        task.cancel()
+    if pending:
+        await asyncio.gather(*pending, return_exceptions=True)
+    for task in done:
+        # A failed post keeps whatever pages it fetched before the error
+        task.exception()
+    return collected
+
+
+# ===================== INSTAGRAM SCRAPER FUNCTIONS =====================
+def scrape_user(username: str, force_refresh=False, **comment_options):
+    """Scrape Instagram user's data and extract relevant info, including all available images, captions, and comments."""
+    async def scrape():
+        async with make_async_client(force_refresh=force_refresh) as async_client:
+            return await scrape_user_async(username, async_client, **comment_options)
+
+    return asyncio.run(scrape())
+
+
+async def scrape_user_async(username: str, async_client: httpx.AsyncClient,
+                            comment_concurrency=COMMENT_CONCURRENCY, comment_pages=COMMENT_MAX_PAGES,
+                            comment_deadline=COMMENT_DEADLINE):
+    """Scrape a profile, then run the comment stage across its posts."""
+    try:
+        return await fetch_user(username, async_client, comment_concurrency, comment_pages, comment_deadline)
+    except ScrapeError as e:
+        return str(e), []
+    except Exception as e:
+        return f"An error occurred: {e}", []
+
+
+async def fetch_user(username: str, async_client: httpx.AsyncClient,
+                     comment_concurrency=COMMENT_CONCURRENCY, comment_pages=COMMENT_MAX_PAGES,
+                     comment_deadline=COMMENT_DEADLINE):
+    """Like scrape_user_async, but failures raise ScrapeError instead of returning a message."""
+    user, posts = await fetch_profile(username, async_client)
+
+    # Extract Images, Captions, and Comments
+    with timed("comment_fanout"):
+        comments = await fetch_comments(
+            async_client, posts,
+            concurrency=comment_concurrency, max_pages=comment_pages, deadline=comment_deadline
+        )
+    for post in posts:
+        post.comments = comments.get(post.id, [])
+
+    return user, posts
+
+
+async def fetch_profile(username: str, async_client: httpx.AsyncClient):
+    """Fetch and parse a profile; the raw response is released before the comment stage starts."""
+    with timed("profile_fetch"):
+        try:
+            result = await async_client.get(PROFILE_URL.format(username=username))
+        except httpx.TransportError as e:
+            raise ScrapeError(f"An error occurred: {e}", transient=True) from e
+        return parse_profile(result)
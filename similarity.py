@@ -0,0 +1,220 @@
+import json
+import os
+import threading
+import numpy as np
+import pandas as pd
+
+from analytics import engagement
+from cache import CACHE_DIR
+from features import dataset_features
+
+# ===================== SIMILAR PROFILES =====================
+# Every profile is one unit vector made of three blocks: its captions' TF-IDF
+# hashed into TEXT_DIMENSIONS buckets, a few log-scaled engagement and caption
+# statistics, and its category hashed into CATEGORY_DIMENSIONS buckets.
+# Hashing keeps the layout fixed as profiles come and go, so stored vectors
+# stay valid and only new or changed profiles need computing.
+SIMILARITY_DIR = os.path.join(CACHE_DIR, "similarity")
+TEXT_DIMENSIONS = 256
+CATEGORY_DIMENSIONS = 32
+STAT_COLUMNS = ["followers", "mean_likes", "median_likes", "p90_likes", "engagement_rate", "posts",
+                "mean_length", "hashtags_per_post", "emoji_per_post"]
+BLOCK_WEIGHTS = {"text": 0.6, "stats": 0.3, "category": 0.1}
+QUERY_BLOCK_ROWS = 16384
+TOP_SIMILAR = 10
+
+
+def _hash_buckets(values, dimensions):
+    """Bucket and sign of every string in ``values``, stable across runs."""
+    hashes = pd.util.hash_array(np.asarray(values, dtype=object))
+    return (hashes % dimensions).astype(np.int64), np.where((hashes >> np.uint64(32)) & np.uint64(1), 1.0, -1.0)
+
+
+def _unit_rows(matrix):
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    return np.divide(matrix, norms, out=np.zeros_like(matrix), where=norms > 0)
+
+
+def profile_vectors(feature_index, profiles):
+    """Vectors of the profiles in ``profiles`` (username, category and STAT_COLUMNS metrics), as float32."""
+    keys = profiles["username"].astype(str).str.lower().to_numpy()
+    position = {key: i for i, key in enumerate(keys)}
+    n = len(profiles)
+
+    # Text block: each post's TF-IDF entries summed into its profile's hashed buckets
+    text = np.zeros((n, TEXT_DIMENSIONS))
+    post_owner = np.array([position.get(key, -1) for key in feature_index.posts["username"].astype(str).str.lower()],
+                          dtype=np.int64)
+    if len(feature_index.values):
+        owner = post_owner[feature_index.rows]
+        keep = owner >= 0
+        buckets, signs = _hash_buckets(feature_index.vocabulary, TEXT_DIMENSIONS)
+        columns = feature_index.columns[keep]
+        np.add.at(text, (owner[keep], buckets[columns]), signs[columns] * feature_index.values[keep])
+
+    # Stats block: log-scaled so accounts of very different sizes stay comparable
+    stats = np.log1p(np.clip(profiles[STAT_COLUMNS].to_numpy(dtype=float), 0, None))
+    stats = np.nan_to_num(stats)
+
+    category = np.zeros((n, CATEGORY_DIMENSIONS))
+    buckets, _ = _hash_buckets(profiles["category"].fillna("Unknown").astype(str).str.lower(), CATEGORY_DIMENSIONS)
+    category[np.arange(n), buckets] = 1.0
+
+    blocks = [_unit_rows(text) * BLOCK_WEIGHTS["text"], _unit_rows(stats) * BLOCK_WEIGHTS["stats"],
+              category * BLOCK_WEIGHTS["category"]]
+    return _unit_rows(np.hstack(blocks)).astype(np.float32)
+
+
+class SimilarityIndex:
+    """Profile vectors kept on disk, with cosine top-k search.
+
+    Rows are keyed by lowercased username and carry a fingerprint of the
+    data they were computed from, so callers can recompute only the rows
+    whose fingerprint changed.
+    """
+
+    def __init__(self, path=SIMILARITY_DIR):
+        self.path = path
+        self.usernames = []
+        self.fingerprints = np.zeros(0, dtype=np.uint64)
+        self.vectors = np.zeros((0, 0), dtype=np.float32)
+        self._rows = {}
+        self.load()
+
+    def load(self):
+        vectors_path = os.path.join(self.path, "vectors.npy")
+        if not os.path.exists(vectors_path):
+            return
+        with open(os.path.join(self.path, "usernames.json"), encoding="utf-8") as f:
+            self.usernames = json.load(f)
+        self.fingerprints = np.load(os.path.join(self.path, "fingerprints.npy"))
+        self.vectors = np.load(vectors_path)
+        self._rows = {username.lower(): row for row, username in enumerate(self.usernames)}
+
+    def save(self):
+        os.makedirs(self.path, exist_ok=True)
+        np.save(os.path.join(self.path, "vectors.npy"), self.vectors)
+        np.save(os.path.join(self.path, "fingerprints.npy"), self.fingerprints)
+        with open(os.path.join(self.path, "usernames.json"), "w", encoding="utf-8") as f:
+            json.dump(self.usernames, f)
+
+    def __len__(self):
+        return len(self.usernames)
+
+    def stale(self, usernames, fingerprints):
+        """Mask of the given profiles that are missing or whose fingerprint differs."""
+        rows = np.array([self._rows.get(str(username).lower(), -1) for username in usernames], dtype=np.int64)
+        stored = np.where(rows >= 0, self.fingerprints[np.clip(rows, 0, None)] if len(self) else 0, 0)
+        return (rows < 0) | (stored != fingerprints)
+
+    def upsert(self, usernames, vectors, fingerprints):
+        """Replace the rows of known profiles and append new ones."""
+        if not len(self):
+            self.vectors = np.zeros((0, vectors.shape[1]), dtype=np.float32)
+        new_rows = []
+        for username, vector, fingerprint in zip(usernames, vectors, fingerprints):
+            row = self._rows.get(str(username).lower())
+            if row is None:
+                new_rows.append((username, vector, fingerprint))
+            else:
+                self.vectors[row] = vector
+                self.fingerprints[row] = fingerprint
+        if new_rows:
+            start = len(self.usernames)
+            self.usernames += [username for username, _, _ in new_rows]
+            self.vectors = np.vstack([self.vectors, np.array([vector for _, vector, _ in new_rows], dtype=np.float32)])
+            self.fingerprints = np.concatenate([self.fingerprints,
+                                                np.array([fp for _, _, fp in new_rows], dtype=np.uint64)])
+            self._rows.update({username.lower(): start + i for i, (username, _, _) in enumerate(new_rows)})
+
+    def retain(self, usernames):
+        """Drop every profile not in ``usernames``."""
+        keep = sorted(self._rows[key] for key in {str(u).lower() for u in usernames} if key in self._rows)
+        if len(keep) == len(self):
+            return
+        self.usernames = [self.usernames[row] for row in keep]
+        self.vectors = self.vectors[keep]
+        self.fingerprints = self.fingerprints[keep]
+        self._rows = {username.lower(): row for row, username in enumerate(self.usernames)}
+
+    def query(self, username, k=TOP_SIMILAR):
+        """The ``k`` profiles most similar to ``username`` as ``(username, similarity)``, or None if unknown."""
+        row = self._rows.get(str(username).lower())
+        if row is None:
+            return None
+        vector = self.vectors[row]
+        best_rows, best_scores = np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.float32)
+        # Score one block of rows at a time and keep a running top k
+        for start in range(0, len(self), QUERY_BLOCK_ROWS):
+            scores = self.vectors[start:start + QUERY_BLOCK_ROWS] @ vector
+            if start <= row < start + len(scores):
+                scores[row - start] = -np.inf
+            top = np.argpartition(-scores, min(k, len(scores) - 1))[:k]
+            best_rows = np.concatenate([best_rows, top + start])
+            best_scores = np.concatenate([best_scores, scores[top]])
+            if len(best_rows) > k:
+                keep = np.argpartition(-best_scores, k - 1)[:k]
+                best_rows, best_scores = best_rows[keep], best_scores[keep]
+        order = np.argsort(-best_scores)
+        return [(self.usernames[best_rows[i]], float(best_scores[i])) for i in order if np.isfinite(best_scores[i])]
+
+
+class DatasetSimilarity:
+    """SimilarityIndex over the profiles of the training dataset.
+
+    On a new dataset version only profiles whose metrics or posts changed
+    are re-vectorized, and the index on disk is updated.
+    """
+
+    def __init__(self, analytics=engagement, features=dataset_features, path=SIMILARITY_DIR):
+        self.analytics = analytics
+        self.features = features
+        self.path = path
+        self._lock = threading.Lock()
+        self._version = None
+        self._index = None
+
+    def _profiles(self, feature_index):
+        metrics = self.analytics.metrics.copy()
+        categories = self.analytics.data.get("user_info.Category")
+        metrics["category"] = categories.to_numpy() if categories is not None else "Unknown"
+        posts = feature_index.posts.assign(key=feature_index.posts["username"].astype(str).str.lower())
+        caption_stats = posts.groupby("key").agg(
+            mean_length=("length", "mean"),
+            hashtags_per_post=("hashtags", lambda tags: tags.str.len().mean()),
+            emoji_per_post=("emoji", "mean"),
+        )
+        metrics = metrics.join(caption_stats, on=metrics["username"].astype(str).str.lower())
+        metrics = metrics.dropna(subset=["username"]).drop_duplicates("username")
+
+        # Fingerprint: the profile's own values plus the sum of its posts' hashes
+        post_hashes = pd.Series(pd.util.hash_pandas_object(posts[["post_id", "likes", "terms"]].astype(str),
+                                                           index=False).to_numpy(), index=posts["key"])
+        post_sums = post_hashes.groupby(level=0).sum()
+        own = pd.util.hash_pandas_object(metrics[["username", "category"] + STAT_COLUMNS].astype(str), index=False)
+        post_sums = post_sums.reindex(metrics["username"].astype(str).str.lower(), fill_value=0)
+        fingerprints = own.to_numpy() + post_sums.to_numpy(dtype=np.uint64)
+        return metrics.reset_index(drop=True), fingerprints
+
+    def index(self):
+        feature_index = self.features.index()
+        with self._lock:
+            version = self.analytics.store.version()
+            if self._index is None:
+                self._index = SimilarityIndex(self.path)
+            if version != self._version:
+                profiles, fingerprints = self._profiles(feature_index)
+                stale = self._index.stale(profiles["username"], fingerprints)
+                if stale.any():
+                    changed = profiles[stale].reset_index(drop=True)
+                    self._index.upsert(changed["username"], profile_vectors(feature_index, changed),
+                                       fingerprints[stale])
+                before = len(self._index)
+                self._index.retain(profiles["username"])
+                if stale.any() or len(self._index) != before:
+                    self._index.save()
+                self._version = version
+            return self._index
+
+
+similar_profiles = DatasetSimilarity()
@@ -0,0 +1,373 @@
+"""Headless SocialScan runner.
+
+    python -m socialscan batch usernames.txt
+    python -m socialscan queue usernames.txt
+    python -m socialscan work
+    python -m socialscan crawl seed1 seed2 --depth 2 --visited-path crawl.sqlite3
+    python -m socialscan refresh --requests-per-hour 600 --loop
+    python -m socialscan dataset training_data --format parquet
+
+``batch`` scrapes every username in the file (one per line, ``#`` starts a
+comment) into MongoDB without the Streamlit UI. ``queue`` adds the names to
+the persistent job queue and ``work`` drains it, retrying transient failures;
+several ``work`` processes can share one queue. ``crawl`` follows related
+profiles outward from seed accounts and stores the graph; with
+``--visited-path`` a stopped crawl resumes where it left off. ``refresh``
+re-scrapes the stored profiles most likely to have changed within an hourly
+request budget, writing back only what changed. ``dataset`` renders the
+profiles stored since its previous run into fine-tuning records and appends
+them to sharded JSONL or Parquet files. Progress goes to stderr and a
+JSON summary of the run to stdout. With ``--metrics-file`` (or
+SOCIALSCAN_METRICS_FILE) timings and counters are written there in the
+Prometheus text format while the command runs and once more when it ends.
+"""
+import argparse
+import json
+import os
+import sys
+import time
+
+
+from batch import run_batch
+from history import ensure_history_indexes
+from crawler import CRAWL_MAX_DEPTH, CRAWL_MAX_PROFILES, run_crawl
+from jobs import JOBS_PATH, MAX_ATTEMPTS, JobQueue, run_queue
+from metrics import METRICS_FILE, metrics, start_textfile_exporter, track_queue
+from refresh import REFRESH_INTERVAL, run_scheduler
+from scraper import response_cache
+from storage import BulkUpserter, connect, ensure_indexes, migrate_storage
+from training import (DEFAULT_TOKENIZER, MAX_TOKENS, MIN_TOKENS, SHARD_ROWS, TRAINING_DIR, TRAINING_FORMATS,
+                      build_dataset, reset_dataset)
+
+# ===================== HEADLESS BATCH RUNNER =====================
+MONGO_URI = os.environ.get("SOCIALSCAN_MONGO_URI", "mongodb://localhost:27017/")
+MONGO_DB = os.environ.get("SOCIALSCAN_MONGO_DB", "SocialScan")
+CHUNK_SIZE = 200  # Profiles scraped and written between journal checkpoints
+
+
+def read_usernames(path):
+    """Usernames listed in ``path``, de-duplicated in file order."""
+    usernames = []
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            username = line.split("#", 1)[0].strip().lstrip("@")
+            if username:
+                usernames.append(username)
+    return list(dict.fromkeys(usernames))
+
+
+class Journal:
+    """Append-only JSONL record of finished usernames.
+
+    Each line is ``{"username", "status", "error", "ts"}`` with status
+    ``done`` or ``failed``. Reading it back tells a restarted run what to
+    skip; a truncated last line left by a crash is ignored.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.done = set()
+        self.failed = {}
+        if os.path.exists(path):
+            with open(path, encoding="utf-8") as f:
+                for line in f:
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        continue
+                    if entry.get("status") == "done":
+                        self.done.add(entry["username"])
+                        self.failed.pop(entry["username"], None)
+                    else:
+                        self.failed[entry["username"]] = entry.get("error")
+        self.file = open(path, "a", encoding="utf-8")
+
+    def record(self, username, status, error=None):
+        entry = {"username": username, "status": status, "error": error, "ts": time.time()}
+        self.file.write(json.dumps(entry, ensure_ascii=False) + "\n")
+        if status == "done":
+            self.done.add(username)
+            self.failed.pop(username, None)
+        else:
+            self.failed[username] = error
+
+    def checkpoint(self):
+        """Make everything recorded so far durable."""
+        self.file.flush()
+        os.fsync(self.file.fileno())
+
+    def close(self):
+        self.checkpoint()
+        self.file.close()
+
+
+def open_storage(args):
+    """The users and history collections, with their indexes and migrations in place."""
+    db = connect(args.mongo_uri)[args.db]
+    collection, history = db["users"], db["history"]
+    ensure_indexes(collection)
+    ensure_history_indexes(history)
+    migrate_storage(collection)
+    return collection, history
+
+
+def batch_command(args):
+    usernames = read_usernames(args.usernames)
+    journal = Journal(args.journal or args.usernames + ".journal.jsonl")
+    pending = [username for username in usernames
+               if username not in journal.done and (args.retry_failed or username not in journal.failed)]
+    skipped = len(usernames) - len(pending)
+    print(f"{len(usernames)} usernames, {skipped} already in the journal, {len(pending)} to scrape",
+          file=sys.stderr)
+
+    collection, history = open_storage(args)
+
+    succeeded = failed = 0
+    started = time.monotonic()
+    comment_options = {"comment_pages": args.comment_pages}
+    try:
+        with BulkUpserter(collection, history=history) as upserter:
+            for start in range(0, len(pending), args.chunk_size):
+                chunk = pending[start:start + args.chunk_size]
+                saved = []
+
+                def on_result(done, total, username, user_info, images):
+                    nonlocal failed
+                    if isinstance(user_info, str):
+                        failed += 1
+                        journal.record(username, "failed", user_info)
+                    else:
+                        upserter.add(user_info, images)
+                        saved.append(username)
+
+                run_batch(chunk, args.concurrency, args.requests_per_minute, on_result,
+                          force_refresh=args.force_refresh, **comment_options)
+                # Journal successes only once their documents are in MongoDB
+                upserter.flush()
+                for username in saved:
+                    journal.record(username, "done")
+                succeeded += len(saved)
+                journal.checkpoint()
+                print(f"{start + len(chunk)}/{len(pending)} scraped, {failed} failed", file=sys.stderr)
+    finally:
+        journal.close()
+
+    elapsed = time.monotonic() - started
+    stats = {
+        "usernames": len(usernames),
+        "skipped": skipped,
+        "attempted": succeeded + failed,
+        "succeeded": succeeded,
+        "failed": failed,
+        "inserted": upserter.inserted,
+        "updated": upserter.updated,
+        "elapsed_seconds": round(elapsed, 3),
+        "profiles_per_second": round((succeeded + failed) / elapsed, 3) if elapsed > 0 else None,
+        "response_cache": response_cache.stats(),
+    }
+    json.dump(stats, sys.stdout)
+    print()
+    return 0 if failed == 0 else 1
+
+
+def queue_command(args):
+    usernames = read_usernames(args.usernames)
+    queue = JobQueue(args.queue)
+    queued = queue.submit(usernames)
+    json.dump({"usernames": len(usernames), "queued": queued, "jobs": queue.counts()}, sys.stdout)
+    print()
+    return 0
+
+
+def work_command(args):
+    queue = JobQueue(args.queue)
+    track_queue("jobs", queue.counts)
+    collection, history = open_storage(args)
+    succeeded = failed = 0
+    started = time.monotonic()
+
+    # Jobs are marked done only once their profiles are in MongoDB
+    with BulkUpserter(collection, history=history, on_flush=queue.complete_many) as upserter:
+
+        def on_result(done, total, username, user_info, images):
+            nonlocal succeeded, failed
+            if isinstance(user_info, str):
+                failed += 1
+                print(f"{username}: {user_info}", file=sys.stderr)
+            else:
+                upserter.add(user_info, images)
+                succeeded += 1
+            if done % 50 == 0 or done == total:
+                print(f"{done}/{total} finished, {failed} failed", file=sys.stderr)
+
+        jobs = run_queue(queue, args.concurrency, args.requests_per_minute, on_result,
+                         max_attempts=args.max_attempts, force_refresh=args.force_refresh,
+                         comment_pages=args.comment_pages, flush=upserter.flush)
+
+    elapsed = time.monotonic() - started
+    stats = {
+        "succeeded": succeeded,
+        "failed": failed,
+        "inserted": upserter.inserted,
+        "updated": upserter.updated,
+        "elapsed_seconds": round(elapsed, 3),
+        "profiles_per_second": round((succeeded + failed) / elapsed, 3) if elapsed > 0 else None,
+        "jobs": jobs,
+        "response_cache": response_cache.stats(),
+    }
+    json.dump(stats, sys.stdout)
+    print()
+    return 0 if failed == 0 else 1
+
+
+def crawl_command(args):
+    collection, history = open_storage(args)
+    started = time.monotonic()
+
+    with BulkUpserter(collection, history=history) as upserter:
+
+        def on_result(done, total, username, user_info, images):
+            if isinstance(user_info, str):
+                print(f"{username}: {user_info}", file=sys.stderr)
+            else:
+                upserter.add(user_info, images)
+            if done % 50 == 0:
+                print(f"{done} profiles fetched", file=sys.stderr)
+
+        summary = run_crawl(collection, args.seeds, args.depth, args.max_profiles, concurrency=args.concurrency,
+                            requests_per_minute=args.requests_per_minute, on_result=on_result,
+                            force_refresh=args.force_refresh, comment_pages=args.comment_pages,
+                            visited_path=args.visited_path)
+
+    elapsed = time.monotonic() - started
+    summary.update({
+        "inserted": upserter.inserted,
+        "updated": upserter.updated,
+        "elapsed_seconds": round(elapsed, 3),
+        "profiles_per_second": round(summary["fetched"] / elapsed, 3) if elapsed > 0 else None,
+        "response_cache": response_cache.stats(),
+    })
+    json.dump(summary, sys.stdout)
+    print()
+    return 0
+
+
+def refresh_command(args):
+    collection, history = open_storage(args)
+
+    def on_result(done, total, username, changed):
+        if isinstance(changed, str):
+            print(f"{username}: {changed}", file=sys.stderr)
+        elif done % 50 == 0 or done == total:
+            print(f"{done}/{total} refreshed", file=sys.stderr)
+
+    def on_cycle(summary):
+        json.dump(dict(summary, response_cache=response_cache.stats()), sys.stdout)
+        print(flush=True)
+
+    run_scheduler(collection, history, args.requests_per_hour, interval=args.interval,
+                  cycles=None if args.loop else 1, on_cycle=on_cycle, comment_pages=args.comment_pages,
+                  concurrency=args.concurrency, on_result=on_result)
+    return 0
+
+
+def dataset_command(args):
+    collection, _ = open_storage(args)
+    if args.rebuild:
+        reset_dataset(args.output)
+    started = reported = time.monotonic()
+
+    def on_progress(summary):
+        nonlocal reported
+        if time.monotonic() - reported >= 5:
+            reported = time.monotonic()
+            print(f"{summary['profiles']} profiles read, {summary['written']} records written", file=sys.stderr)
+
+    summary = build_dataset(collection, args.output, args.format, args.workers, args.tokenizer,
+                            args.min_tokens, args.max_tokens, args.shard_rows, on_progress=on_progress)
+    elapsed = time.monotonic() - started
+    summary.update({
+        "elapsed_seconds": round(elapsed, 3),
+        "profiles_per_second": round(summary["profiles"] / elapsed, 3) if elapsed > 0 else None,
+    })
+    json.dump(summary, sys.stdout)
+    print()
+    return 0
+
+
+def add_scrape_arguments(parser):
+    parser.add_argument("--concurrency", type=int, default=5, help="profiles in flight at once")
+    parser.add_argument("--requests-per-minute", type=int, default=20, help="request budget shared by all workers")
+    parser.add_argument("--comment-pages", type=int, default=5, help="comment pages fetched per post")
+    parser.add_argument("--force-refresh", action="store_true", help="bypass the response cache")
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(prog="socialscan", description=__doc__.splitlines()[0])
+    parser.add_argument("--mongo-uri", default=MONGO_URI, help="MongoDB connection string")
+    parser.add_argument("--db", default=MONGO_DB, help="MongoDB database name")
+    parser.add_argument("--metrics-file", default=METRICS_FILE, help="Prometheus textfile to write metrics to")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    batch = commands.add_parser("batch", help="scrape a file of usernames into MongoDB")
+    batch.add_argument("usernames", help="text file with one username per line")
+    batch.add_argument("--journal", help="journal path (default: <usernames>.journal.jsonl)")
+    batch.add_argument("--retry-failed", action="store_true", help="scrape usernames that failed in earlier runs")
+    batch.add_argument("--chunk-size", type=int, default=CHUNK_SIZE, help="profiles per journal checkpoint")
+    add_scrape_arguments(batch)
+    batch.set_defaults(handler=batch_command)
+
+    queue = commands.add_parser("queue", help="add a file of usernames to the job queue")
+    queue.add_argument("usernames", help="text file with one username per line")
+    queue.add_argument("--queue", default=JOBS_PATH, help="job queue database")
+    queue.set_defaults(handler=queue_command)
+
+    work = commands.add_parser("work", help="scrape queued jobs into MongoDB until the queue is empty")
+    work.add_argument("--queue", default=JOBS_PATH, help="job queue database")
+    work.add_argument("--max-attempts", type=int, default=MAX_ATTEMPTS, help="tries per job on transient errors")
+    add_scrape_arguments(work)
+    work.set_defaults(handler=work_command)
+
+    crawl = commands.add_parser("crawl", help="crawl related profiles outward from seed usernames")
+    crawl.add_argument("seeds", nargs="+", help="usernames to start from")
+    crawl.add_argument("--depth", type=int, default=CRAWL_MAX_DEPTH, help="hops to follow from the seeds")
+    crawl.add_argument("--max-profiles", type=int, default=CRAWL_MAX_PROFILES, help="profiles fetched at most")
+    crawl.add_argument("--visited-path", help="SQLite file of visited usernames; rerun with it to resume a crawl")
+    add_scrape_arguments(crawl)
+    crawl.set_defaults(handler=crawl_command)
+
+    refresh = commands.add_parser("refresh", help="re-scrape the stored profiles most likely to be out of date")
+    refresh.add_argument("--requests-per-hour", type=int, default=600, help="request budget of one refresh cycle")
+    refresh.add_argument("--comment-pages", type=int, default=0,
+                         help="comment pages fetched per post (0 keeps the stored comments)")
+    refresh.add_argument("--concurrency", type=int, default=5, help="profiles in flight at once")
+    refresh.add_argument("--loop", action="store_true", help="run a cycle every --interval seconds")
+    refresh.add_argument("--interval", type=float, default=REFRESH_INTERVAL, help="seconds between cycles")
+    refresh.set_defaults(handler=refresh_command)
+
+    dataset = commands.add_parser("dataset", help="build fine-tuning data from the stored profiles")
+    dataset.add_argument("output", nargs="?", default=TRAINING_DIR, help="directory of the shards and build state")
+    dataset.add_argument("--format", choices=TRAINING_FORMATS, default="jsonl", help="shard file format")
+    dataset.add_argument("--workers", type=int, default=None, help="worker processes (default: all cores)")
+    dataset.add_argument("--tokenizer", default=DEFAULT_TOKENIZER,
+                         help="Hugging Face tokenizer for the length filter, or 'approx'")
+    dataset.add_argument("--min-tokens", type=int, default=MIN_TOKENS, help="shortest record kept")
+    dataset.add_argument("--max-tokens", type=int, default=MAX_TOKENS, help="longest record kept")
+    dataset.add_argument("--shard-rows", type=int, default=SHARD_ROWS, help="records per shard file")
+    dataset.add_argument("--rebuild", action="store_true", help="discard earlier shards and start over")
+    dataset.set_defaults(handler=dataset_command)
+    return parser
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    start_textfile_exporter(args.metrics_file)
+    try:
+        return args.handler(args)
+    finally:
+        if args.metrics_file:
+            metrics.write_textfile(args.metrics_file)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,513 @@
+import threading
+import time
+from datetime import datetime
+from pymongo import ASCENDING, DESCENDING, DeleteMany, MongoClient, ReplaceOne, UpdateOne
+from pymongo.errors import OperationFailure
+
+from history import count_value, record_scrape, record_scrapes
+from metrics import mongo_listener, timed
+
+# ===================== MONGODB PERSISTENCE =====================
+# Profiles live in the users collection; their posts and comments are kept in
+# sibling collections of the same database, keyed by owner_id.
+USERNAME_FIELD = "user_info.Username"
+# Lowercased username, indexed for case-insensitive prefix search
+USERNAME_KEY_FIELD = "username_key"
+POSTS_COLLECTION = "posts"
+COMMENTS_COLLECTION = "comments"
+COUNT_FIELDS = ("Followers", "Following")
+# Signed CDN URLs get a new query string on every scrape; change checks
+# compare them without it
+SIGNED_URL_FIELDS = ("Profile Image", "source")
+# One marker document records which migrations the stored documents have been
+# through, so an up-to-date database is not scanned on every start
+SCHEMA_COLLECTION = "schema"
+SCHEMA_VERSION = 2  # 1: posts moved out of profiles, 2: username keys backfilled
+
+BULK_MAX_OPS = 200
+BULK_MAX_SECONDS = 5.0
+
+# Pool and timeout settings of every MongoClient; a server that is down fails
+# fast instead of stalling a page for pymongo's default 30 seconds
+MONGO_CLIENT_OPTIONS = {
+    "maxPoolSize": 20,
+    "minPoolSize": 0,
+    "maxIdleTimeMS": 60_000,
+    "waitQueueTimeoutMS": 10_000,
+    "connectTimeoutMS": 5_000,
+    "serverSelectionTimeoutMS": 5_000,
+    "socketTimeoutMS": 120_000,
+}
+
+
+def connect(uri, **options):
+    """MongoClient with MONGO_CLIENT_OPTIONS (overridable) and command metrics.
+
+    Creating it does not block: connections are opened in the background and
+    on first use.
+    """
+    return MongoClient(uri, **{**MONGO_CLIENT_OPTIONS, **options}, event_listeners=[mongo_listener])
+
+
+def posts_collection(collection):
+    return collection.database[POSTS_COLLECTION]
+
+
+def schema_collection(collection):
+    return collection.database[SCHEMA_COLLECTION]
+
+
+def comments_collection(collection):
+    return collection.database[COMMENTS_COLLECTION]
+
+
+def ensure_indexes(collection):
+    """Create the username, post and comment indexes.
+
+    Returns False if the username index could not be made unique: a
+    collection that already holds duplicate usernames cannot take a unique
+    index, so in that case a plain index is created to keep lookups fast.
+    """
+    posts = posts_collection(collection)
+    posts.create_index([("user_id", ASCENDING), ("position", ASCENDING)], name="user_position")
+    posts.create_index([("likes", DESCENDING)], name="likes")
+    comments = comments_collection(collection)
+    comments.create_index([("post_id", ASCENDING), ("position", ASCENDING)], name="post_position")
+    comments.create_index([("user_id", ASCENDING)], name="user_id")
+    collection.create_index([("user_info.Followers", DESCENDING)], name="followers")
+    # Keyset pages of the saved-profile search are ordered by (username_key, _id)
+    if "username_key" in collection.index_information():
+        collection.drop_index("username_key")
+    collection.create_index([(USERNAME_KEY_FIELD, ASCENDING), ("_id", ASCENDING)], name="username_key_id")
+    # Incremental readers (exports by date, the training data builder) select by scrape time
+    collection.create_index([("timestamp", ASCENDING)], name="timestamp")
+    try:
+        collection.create_index([(USERNAME_FIELD, ASCENDING)], unique=True, name="username_unique")
+        return True
+    except OperationFailure:
+        collection.create_index([(USERNAME_FIELD, ASCENDING)], name="username")
+        return False
+
+
+def username_key(username):
+    return str(username).strip().lower()
+
+
+def unsigned(field, value):
+    """``value`` as compared by update_changed: signed URLs lose their query string."""
+    if field in SIGNED_URL_FIELDS and isinstance(value, str):
+        return value.split("?", 1)[0]
+    return value
+
+
+def owner_id(user_info):
+    """Key of a profile's posts and comments: its user ID, or its username if the scrape had no ID.
+
+    Profiles without an ID would otherwise all share the key ``"N/A"`` and
+    overwrite each other's posts.
+    """
+    user_id = user_info.get("ID")
+    if user_id is None or user_id in ("", "N/A"):
+        return "username:" + username_key(user_info["Username"])
+    return str(user_id)
+
+
+def typed_user_info(user_info):
+    """Copy of ``user_info`` (a dict or a models.Profile) with follower/following counts as integers."""
+    user_info = user_info.to_document() if hasattr(user_info, "to_document") else dict(user_info)
+    for field in COUNT_FIELDS:
+        if field in user_info:
+            user_info[field] = count_value(user_info[field])
+    return user_info
+
+
+def user_document(user_info, images):
+    """Build the stored profile document for one scrape (posts are stored separately)."""
+    return {
+        "user_info": typed_user_info(user_info),
+        USERNAME_KEY_FIELD: username_key(user_info["Username"]),
+        "post_count": len(images),
+        "timestamp": time.time(),
+        "scrape_date": datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    }
+
+
+def post_documents(user_info, images, timestamp):
+    """One document per post, in the order the profile lists them."""
+    return [{
+        "_id": str(image["ID"]),
+        "user_id": owner_id(user_info),
+        "username": user_info["Username"],
+        "position": position,
+        "source": image.get("Source"),
+        "likes": count_value(image.get("Likes", 0)),
+        "caption": image.get("Caption"),
+        "comment_count": len(image.get("Comments", [])),
+        "timestamp": timestamp,
+    } for position, image in enumerate(images)]
+
+
+def comment_documents(user_info, images):
+    return [{
+        "post_id": str(image["ID"]),
+        "user_id": owner_id(user_info),
+        "position": position,
+        "text": text,
+    } for image in images for position, text in enumerate(image.get("Comments", []))]
+
+
+def write_posts(collection, scrapes):
+    """Replace the stored posts and comments of every ``(user_info, images, timestamp)``.
+
+    Uses one bulk_write for posts plus one delete and one insert for comments,
+    however many profiles are written.
+    """
+    posts = posts_collection(collection)
+    comments = comments_collection(collection)
+    user_ids, post_ids, post_ops, new_comments = [], [], [], []
+    for user_info, images, timestamp in scrapes:
+        user_ids.append(owner_id(user_info))
+        for document in post_documents(user_info, images, timestamp):
+            post_ids.append(document["_id"])
+            post_ops.append(ReplaceOne({"_id": document["_id"]}, document, upsert=True))
+        new_comments.extend(comment_documents(user_info, images))
+
+    # Posts no longer on the profile are dropped, mirroring the latest scrape
+    posts.delete_many({"user_id": {"$in": user_ids}, "_id": {"$nin": post_ids}})
+    if post_ops:
+        posts.bulk_write(post_ops, ordered=False)
+    comments.delete_many({"user_id": {"$in": user_ids}})
+    if new_comments:
+        comments.insert_many(new_comments, ordered=False)
+
+
+@timed("mongo_write")
+def upsert_user(collection, user_info, images, history=None):
+    """Insert or replace a user, its posts and comments; returns True if the user already existed.
+
+    If a ``history`` collection is given the scrape is also recorded there.
+    """
+    document = user_document(user_info, images)
+    if history is not None:
+        record_scrape(history, user_info, images, document["timestamp"])
+    write_posts(collection, [(user_info, images, document["timestamp"])])
+    result = collection.update_one(
+        {USERNAME_FIELD: user_info["Username"]},
+        {"$set": document, "$unset": {"images": ""}},
+        upsert=True
+    )
+    return result.matched_count > 0
+
+
+@timed("mongo_write")
+def update_changed(collection, user_info, images, history=None, with_comments=True):
+    """Write only the parts of a fresh scrape that differ from the stored profile.
+
+    Changed profile fields and posts are updated in place, new posts are
+    added and vanished ones dropped. Comments are rewritten only for posts
+    whose comment count changed, and left alone entirely when the scrape was
+    made without comments (``with_comments=False``). Signed URLs count as
+    changed only if they differ without their query strings, and are not
+    rewritten otherwise. Returns the names of the changed profile fields
+    plus ``"posts"`` if any post changed, or None if the profile was not
+    stored yet and was written in full.
+    """
+    stored = collection.find_one({USERNAME_FIELD: user_info["Username"]}, {"user_info": 1, "images": 1})
+    if stored is None or "images" in stored:
+        upsert_user(collection, user_info, images, history)
+        return None
+
+    timestamp = time.time()
+    if history is not None:
+        record_scrape(history, user_info, images, timestamp)
+
+    user_id = owner_id(user_info)
+    posts = posts_collection(collection)
+    stored_posts = {post["_id"]: post for post in posts.find(
+        {"user_id": user_id}, {"position": 1, "source": 1, "likes": 1, "caption": 1, "comment_count": 1}
+    )}
+    post_ops, recomment = [], []
+    documents = post_documents(user_info, images, timestamp)
+    for document, image in zip(documents, images):
+        old = stored_posts.get(document["_id"])
+        if old is None:
+            post_ops.append(ReplaceOne({"_id": document["_id"]}, document, upsert=True))
+            recomment.append((document["_id"], image))
+            continue
+        fields = ["position", "source", "likes", "caption"] + (["comment_count"] if with_comments else [])
+        update = {field: document[field] for field in fields
+                  if unsigned(field, old.get(field)) != unsigned(field, document[field])}
+        if update:
+            post_ops.append(UpdateOne({"_id": document["_id"]}, {"$set": update}))
+        if with_comments and "comment_count" in update:
+            recomment.append((document["_id"], image))
+    removed = [post_id for post_id in stored_posts if post_id not in {document["_id"] for document in documents}]
+    if removed:
+        post_ops.append(DeleteMany({"_id": {"$in": removed}}))
+    if post_ops:
+        posts.bulk_write(post_ops, ordered=False)
+
+    comments = comments_collection(collection)
+    stale = removed + [post_id for post_id, _ in recomment]
+    if stale:
+        comments.delete_many({"post_id": {"$in": stale}})
+    new_comments = comment_documents(user_info, [image for _, image in recomment])
+    if new_comments:
+        comments.insert_many(new_comments, ordered=False)
+
+    current = typed_user_info(user_info)
+    changed = [field for field, value in current.items()
+               if unsigned(field, stored["user_info"].get(field)) != unsigned(field, value)]
+    document = {f"user_info.{field}": current[field] for field in changed}
+    document.update(post_count=len(images), timestamp=timestamp,
+                    scrape_date=datetime.fromtimestamp(timestamp).strftime("%Y-%m-%d %H:%M:%S"))
+    collection.update_one({"_id": stored["_id"]}, {"$set": document})
+    return changed + (["posts"] if post_ops else [])
+
+
+# Post fields read back for display and export
+POST_PROJECTION = {"user_id": 1, "source": 1, "likes": 1, "caption": 1, "comment_count": 1}
+
+
+def load_posts_for(collection, user_ids, with_comments=True):
+    """Posts of several users in profile order, as ``{user_id: images}`` in the scraper's format.
+
+    Reads all posts with one query and, if wanted, all their comments with
+    another. Without comments each post's ``Comments`` list is empty and its
+    ``Comment Count`` tells how many can be read with load_comments.
+    """
+    user_ids = [str(user_id) for user_id in user_ids]
+    post_list = list(posts_collection(collection).find({"user_id": {"$in": user_ids}}, POST_PROJECTION).sort(
+        [("user_id", ASCENDING), ("position", ASCENDING)]
+    ))
+    comments_by_post = {}
+    if with_comments and post_list:
+        cursor = comments_collection(collection).find(
+            {"post_id": {"$in": [post["_id"] for post in post_list]}}, {"_id": 0, "post_id": 1, "text": 1}
+        ).sort([("post_id", ASCENDING), ("position", ASCENDING)])
+        for comment in cursor:
+            comments_by_post.setdefault(comment["post_id"], []).append(comment["text"])
+
+    images_by_user = {user_id: [] for user_id in user_ids}
+    for post in post_list:
+        images_by_user[post["user_id"]].append({
+            "ID": post["_id"],
+            "Source": post.get("source"),
+            "Likes": post.get("likes", 0),
+            "Caption": post.get("caption"),
+            "Comments": comments_by_post.get(post["_id"], []),
+            "Comment Count": post.get("comment_count", 0),
+        })
+    return images_by_user
+
+
+def load_posts(collection, user_id, with_comments=True):
+    """Posts of a user in profile order, in the scraper's image format."""
+    return load_posts_for(collection, [user_id], with_comments)[str(user_id)]
+
+
+def load_comments(collection, post_id):
+    """Comment texts of one post, in their original order."""
+    cursor = comments_collection(collection).find({"post_id": str(post_id)}, {"_id": 0, "text": 1}).sort(
+        "position", ASCENDING
+    )
+    return [comment["text"] for comment in cursor]
+
+
+def load_user(collection, username, with_comments=True):
+    """Return ``(user_info, images)`` for a stored user, or None.
+
+    Documents written before posts moved to their own collection still
+    carry an embedded ``images`` array, which is returned as is.
+    """
+    document = collection.find_one({USERNAME_FIELD: username}, {"_id": 0, "user_info": 1, "images": 1})
+    if document is None:
+        return None
+    if "images" in document:
+        return document.get("user_info"), document.get("images", [])
+    return document.get("user_info"), load_posts(collection, owner_id(document["user_info"]), with_comments)
+
+
+def backfill_username_keys(collection):
+    """Add the search key to documents saved before it existed; returns how many changed."""
+    result = collection.update_many(
+        {USERNAME_KEY_FIELD: {"$exists": False}, USERNAME_FIELD: {"$type": "string"}},
+        [{"$set": {USERNAME_KEY_FIELD: {"$toLower": f"${USERNAME_FIELD}"}}}]
+    )
+    return result.modified_count
+
+
+def search_usernames(collection, prefix="", after=None, limit=25):
+    """One page of saved profiles whose username starts with ``prefix``, in username order.
+
+    The match is case-insensitive and served from the username_key_id index.
+    Pages are keyset-paginated on ``(username_key, _id)``, so profiles whose
+    keys collide are neither skipped nor repeated: pass the ``next_after`` of
+    the previous page as ``after``. Returns ``(rows, next_after)`` with rows
+    of ``(username, scrape_date)``; ``next_after`` is None on the last page.
+    """
+    prefix = username_key(prefix)
+    key_range = {"$gte": prefix}
+    if prefix:
+        key_range["$lt"] = prefix + "\uffff"
+    query = {USERNAME_KEY_FIELD: key_range}
+    if after is not None:
+        after_key, after_id = after
+        query["$or"] = [{USERNAME_KEY_FIELD: {"$gt": after_key}},
+                        {USERNAME_KEY_FIELD: after_key, "_id": {"$gt": after_id}}]
+    documents = list(collection.find(
+        query, {USERNAME_KEY_FIELD: 1, USERNAME_FIELD: 1, "scrape_date": 1}
+    ).sort([(USERNAME_KEY_FIELD, ASCENDING), ("_id", ASCENDING)]).limit(limit + 1))
+    last = documents[limit - 1] if len(documents) > limit else None
+    next_after = (last[USERNAME_KEY_FIELD], last["_id"]) if last is not None else None
+    rows = [(document["user_info"]["Username"], document.get("scrape_date", "Unknown date"))
+            for document in documents[:limit]]
+    return rows, next_after
+
+
+def migrate_storage(collection):
+    """Run the migrations the stored documents have not been through yet.
+
+    The version reached is kept in a marker document, so once a database is
+    current this is a single lookup instead of unindexed scans. Returns the
+    number of profiles whose posts were moved out.
+    """
+    schema = schema_collection(collection)
+    version = (schema.find_one({"_id": "schema"}) or {}).get("version", 0)
+    migrated = 0
+    if version < 1:
+        migrated = migrate_embedded_posts(collection)
+    if version < 2:
+        backfill_username_keys(collection)
+    if version < SCHEMA_VERSION:
+        schema.update_one({"_id": "schema"}, {"$set": {"version": SCHEMA_VERSION}}, upsert=True)
+    return migrated
+
+
+def migrate_embedded_posts(collection, batch_size=BULK_MAX_OPS):
+    """Move posts out of legacy documents and convert their counts to integers.
+
+    Returns the number of migrated profiles; a no-op once nothing is left.
+    """
+    migrated = 0
+    batch = []
+
+    def flush():
+        write_posts(collection, [(user_info, images, timestamp) for _, user_info, images, timestamp in batch])
+        collection.bulk_write([
+            UpdateOne({"_id": _id}, {"$set": {"user_info": typed_user_info(user_info), "post_count": len(images)},
+                                     "$unset": {"images": ""}})
+            for _id, user_info, images, _ in batch
+        ], ordered=False)
+
+    cursor = collection.find({"images": {"$exists": True}}, {"user_info": 1, "images": 1, "timestamp": 1})
+    for document in cursor:
+        user_info = document.get("user_info", {})
+        if "Username" not in user_info:
+            continue
+        batch.append((document["_id"], user_info, document.get("images") or [], document.get("timestamp")))
+        if len(batch) >= batch_size:
+            flush()
+            migrated += len(batch)
+            batch = []
+    if batch:
+        flush()
+        migrated += len(batch)
+    return migrated
+
+
+class BulkUpserter:
+    """Buffers user upserts and writes them with one unordered bulk_write.
+
+    The buffer is flushed once it holds ``max_ops`` users or its oldest entry
+    is ``max_seconds`` old, and on close. The age limit is enforced by a
+    timer, so a stream that goes quiet is still written; a timer flush runs
+    (and calls ``on_flush``) on the timer's thread, and its error is raised
+    by the next add, flush or close. Repeated usernames inside one buffer
+    collapse to the latest scrape. With a ``history`` collection each
+    flushed scrape is also recorded there with one insert_many. ``on_flush``
+    is called with the usernames of every flush once they are written.
+    """
+
+    def __init__(self, collection, max_ops=BULK_MAX_OPS, max_seconds=BULK_MAX_SECONDS, history=None,
+                 on_flush=None):
+        self.collection = collection
+        self.history = history
+        self.on_flush = on_flush
+        self.max_ops = max_ops
+        self.max_seconds = max_seconds
+        self.inserted = 0
+        self.updated = 0
+        self._buffer = {}
+        self._lock = threading.Lock()
+        self._timer = None
+        self._error = None
+
+    def _raise_timer_error(self):
+        error, self._error = self._error, None
+        if error is not None:
+            raise error
+
+    def _timed_flush(self):
+        try:
+            self._flush()
+        except Exception as e:
+            self._error = e
+
+    def add(self, user_info, images):
+        self._raise_timer_error()
+        document = user_document(user_info, images)
+        with self._lock:
+            if not self._buffer and self.max_seconds is not None:
+                self._timer = threading.Timer(self.max_seconds, self._timed_flush)
+                self._timer.daemon = True
+                self._timer.start()
+            self._buffer[user_info["Username"]] = (user_info, images, document)
+            full = len(self._buffer) >= self.max_ops
+        if full:
+            self.flush()
+
+    def flush(self):
+        self._raise_timer_error()
+        self._flush()
+
+    @timed("mongo_write")
+    def _flush(self):
+        # Held while writing, so a timer flush and a caller's flush never interleave
+        with self._lock:
+            if self._timer is not None:
+                self._timer.cancel()
+                self._timer = None
+            if not self._buffer:
+                return
+            buffered = list(self._buffer.values())
+            self._buffer = {}
+            self._write(buffered)
+
+    def _write(self, buffered):
+        if self.history is not None:
+            record_scrapes(self.history, [
+                (user_info, images, document["timestamp"]) for user_info, images, document in buffered
+            ])
+        write_posts(self.collection, [
+            (user_info, images, document["timestamp"]) for user_info, images, document in buffered
+        ])
+        operations = [
+            UpdateOne({USERNAME_FIELD: user_info["Username"]}, {"$set": document, "$unset": {"images": ""}}, upsert=True)
+            for user_info, _, document in buffered
+        ]
+        result = self.collection.bulk_write(operations, ordered=False)
+        self.inserted += result.upserted_count
+        self.updated += result.matched_count
+        if self.on_flush is not None:
+            self.on_flush([user_info["Username"] for user_info, _, _ in buffered])
+
+    def close(self):
+        self.flush()
+        self._raise_timer_error()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
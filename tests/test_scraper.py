@@ -0,0 +1,33 @@
+import time
+
+import scraper
+from batch import run_batch
+from benchmarks.replay import FixtureServer
+from scraper import NetworkClock
+
+
+def test_network_clock_stops_only_when_every_request_waits(monkeypatch):
+    now = [0.0]
+    monkeypatch.setattr(scraper.time, "monotonic", lambda: now[0])
+    clock = NetworkClock()
+    clock.pause()
+    clock.resume()  # first request on the network
+    clock.pause()  # second request waits meanwhile
+    now[0] = 1.0
+    assert clock.elapsed() == 1.0
+    clock.done()  # only the waiting request is left
+    now[0] = 3.0
+    assert clock.elapsed() == 1.0
+    clock.resume()
+    now[0] = 3.5
+    assert clock.elapsed() == 1.5
+
+
+def test_comment_deadline_expires_under_rate_limiter():
+    server = FixtureServer(latency=0.2, comment_pages=5)
+    started = time.perf_counter()
+    (_, _, images), = run_batch(["fixture_user"], requests_per_minute=240, transport=server.transport(),
+                                force_refresh=True, comment_deadline=1.0)
+    # The profile request plus 1s of comment pages, not all 5 pages of every post
+    assert time.perf_counter() - started < 3.0
+    assert server.requests < 1 + 5 * len(images)
@@ -0,0 +1,66 @@
+import glob
+import json
+import os
+
+import pytest
+
+from storage import BulkUpserter, ensure_indexes
+from training import build_dataset
+
+mongomock = pytest.importorskip("mongomock")
+
+
+def stored_collection(profiles):
+    collection = mongomock.MongoClient().db.users
+    ensure_indexes(collection)
+    with BulkUpserter(collection) as upserter:
+        for n in range(profiles):
+            user_info = {"Username": f"user{n}", "ID": str(1000 + n), "Category": "Artist", "Followers": 5000 + n,
+                         "Biography": f"Bio {n}", "Related Profiles": [f"user{n + 1}"]}
+            images = [{"ID": f"{n}_{i}", "Source": "N/A", "Likes": 100 * (i + 1) + n,
+                       "Caption": f"Post {i} of user {n} #art", "Comments": []} for i in range(5)]
+            upserter.add(user_info, images)
+    return collection
+
+
+def shard_rows(directory):
+    rows = []
+    for path in sorted(glob.glob(os.path.join(directory, "part-*.jsonl"))):
+        with open(path, encoding="utf-8") as f:
+            rows += [json.loads(line) for line in f]
+    return rows
+
+
+def test_interrupted_build_resumes_without_losing_or_repeating(tmp_path):
+    collection = stored_collection(20)  # 6 records per profile
+    directory = str(tmp_path / "data")
+    complete = build_dataset(collection, str(tmp_path / "reference"), workers=1, tokenizer="approx",
+                             shard_rows=50, batch_size=5)
+
+    class Interrupted(Exception):
+        pass
+
+    def interrupt_after_two_batches(summary):
+        if summary["profiles"] >= 10:
+            raise Interrupted
+
+    with pytest.raises(Interrupted):
+        build_dataset(collection, directory, workers=1, tokenizer="approx", shard_rows=50, batch_size=5,
+                      on_progress=interrupt_after_two_batches)
+    resumed = build_dataset(collection, directory, workers=1, tokenizer="approx", shard_rows=50, batch_size=5)
+
+    rows = shard_rows(directory)
+    hashes = [row["hash"] for row in rows]
+    assert len(hashes) == len(set(hashes))
+    assert sorted(hashes) == sorted(row["hash"] for row in shard_rows(str(tmp_path / "reference")))
+    assert resumed["total_records"] == complete["total_records"] == 120
+    assert not glob.glob(os.path.join(directory, "*.tmp"))
+
+
+def test_rerun_only_adds_new_records(tmp_path):
+    collection = stored_collection(4)
+    directory = str(tmp_path / "data")
+    first = build_dataset(collection, directory, workers=1, tokenizer="approx")
+    again = build_dataset(collection, directory, workers=1, tokenizer="approx")
+    assert first["written"] == 24
+    assert again["written"] == 0 and again["total_records"] == 24
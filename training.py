@@ -0,0 +1,427 @@
+import hashlib
+import json
+import os
+import re
+import sqlite3
+import statistics
+import time
+from collections import Counter, deque
+from concurrent.futures import ProcessPoolExecutor
+
+from export import WRITERS, iter_profile_batches
+from features import HASHTAG_PATTERN, MENTION_PATTERN
+from history import count_value
+from metrics import timed
+
+# ===================== FINE-TUNING DATASET =====================
+# Stored profiles are rendered into Alpaca-style instruction/input/output
+# records: one behavioral analysis per profile and one engagement record
+# per captioned post. Records are hashed, tokenized and length-filtered in a
+# process pool, de-duplicated against every record written before, and
+# appended to numbered shards in the output directory:
+#
+#     dataset = load_dataset("json", data_files="training_data/part-*.jsonl", split="train")
+#
+# ``text`` holds the record already formatted with ALPACA_PROMPT (append the
+# tokenizer's EOS token before training). Runs are incremental: manifest.json
+# keeps a scrape-time watermark, so a run only reads profiles scraped or
+# refreshed since the previous one.
+TRAINING_DIR = "training_data"
+MANIFEST_NAME = "manifest.json"
+HASHES_NAME = "hashes.sqlite3"
+TRAINING_FORMATS = ("jsonl", "parquet")
+TRAINING_BATCH_SIZE = 500  # Profiles per pool task
+SHARD_ROWS = 100_000
+MAX_TOKENS = 512  # The notebook trains with max_length=512
+MIN_TOKENS = 16
+DEFAULT_TOKENIZER = "gpt2"
+# Documents are timestamped when they are built and may reach MongoDB a few
+# seconds later (see storage.BulkUpserter), so each run re-reads a little of
+# the previous one; the content hashes drop the repeats
+WATERMARK_OVERLAP = 60.0
+TOP_HASHTAGS = 5
+TOP_MENTIONS = 3
+# Profile inputs are capped so a whole profile fits the token limit: the
+# first related profiles and the captions of the most liked posts, clipped
+INPUT_RELATED = 5
+INPUT_CAPTIONS = 6
+INPUT_CAPTION_CHARS = 100
+
+ALPACA_PROMPT = """Below is an instruction that describes a task, paired with an input that provides further context. Write a response that appropriately completes the request.
+
+### Instruction:
+{}
+
+### Input:
+{}
+
+### Response:
+{}"""
+
+PROFILE_INSTRUCTION = "Behavioral Analysis"
+POST_INSTRUCTION = "Estimate how this post performed for the account."
+
+RECORD_COLUMNS = [
+    ("instruction", "string"), ("input", "string"), ("output", "string"), ("text", "string"),
+    ("kind", "string"), ("username", "string"), ("tokens", "int"), ("hash", "string"),
+]
+
+# (minimum engagement rate, description), highest first
+ENGAGEMENT_TIERS = [(0.06, "very high"), (0.03, "high"), (0.01, "average"), (0.0, "low")]
+
+
+def _text(value):
+    return "" if value is None or value == "N/A" else str(value).strip()
+
+
+def _join(values, limit):
+    return ", ".join(str(value) for value in values[:limit]) if isinstance(values, list) else _text(values)
+
+
+def _clip(text, limit):
+    return text if len(text) <= limit else text[:limit - 1].rstrip() + "…"
+
+
+def engagement_tier(rate):
+    for threshold, name in ENGAGEMENT_TIERS:
+        if rate >= threshold:
+            return name
+    return "low"
+
+
+def profile_record(user_info, posts):
+    """The behavioral analysis record of one profile, or None without posts to describe.
+
+    ``posts`` is a list of ``(likes, caption)`` pairs. The input follows the
+    fields of the notebook's formatting_prompts_func.
+    """
+    if not posts:
+        return None
+    username = _text(user_info.get("Username"))
+    category = _text(user_info.get("Category")) or "uncategorized"
+    followers = count_value(user_info.get("Followers", 0))
+    likes = [count for count, _ in posts]
+    captions = [caption for _, caption in posts if caption]
+    top_captions = [caption for _, caption in sorted(posts, key=lambda post: -post[0]) if caption][:INPUT_CAPTIONS]
+    source = (f"Username: {username}, Biography: {_text(user_info.get('Biography'))}, Category: {category}, "
+              f"Related Profiles: {_join(user_info.get('Related Profiles', []), INPUT_RELATED)}, "
+              f"Captions: {', '.join(_clip(caption, INPUT_CAPTION_CHARS) for caption in top_captions)}, "
+              f"Image Likes: {', '.join(str(count) for count in likes)}")
+
+    mean_likes = statistics.fmean(likes)
+    lines = [f"{username} is a {category} account with {followers:,} followers."]
+    summary = (f"Across {len(likes)} recent posts they average {mean_likes:,.0f} likes "
+               f"(median {statistics.median(likes):,.0f}")
+    if followers > 0:
+        rate = mean_likes / followers
+        summary += f"), an engagement rate of {rate:.2%}, which is {engagement_tier(rate)}."
+    else:
+        summary += ")."
+    lines.append(summary)
+    best_likes, best_caption = max(posts, key=lambda post: post[0])
+    if best_caption:
+        lines.append(f"Their best performing post ({best_likes:,} likes) reads: \"{best_caption}\"")
+    text = " ".join(captions).lower()
+    hashtags = Counter(re.findall(HASHTAG_PATTERN, text)).most_common(TOP_HASHTAGS)
+    if hashtags:
+        lines.append(f"Hashtags they use most: {', '.join(tag for tag, _ in hashtags)}.")
+    mentions = Counter(re.findall(MENTION_PATTERN, text)).most_common(TOP_MENTIONS)
+    if mentions:
+        lines.append(f"They often mention {', '.join(mention for mention, _ in mentions)}.")
+    if captions:
+        words = statistics.fmean(len(caption.split()) for caption in captions)
+        style = "short" if words < 8 else "medium-length" if words < 25 else "long"
+        lines.append(f"They write {style} captions ({words:.0f} words on average)"
+                     f" on {len(captions)} of {len(likes)} posts.")
+    return {"kind": "profile", "username": username, "instruction": PROFILE_INSTRUCTION,
+            "input": source, "output": " ".join(lines)}
+
+
+def post_records(user_info, posts):
+    """One engagement record per captioned post, relative to the profile's other posts."""
+    if not posts:
+        return []
+    username = _text(user_info.get("Username"))
+    category = _text(user_info.get("Category")) or "uncategorized"
+    followers = count_value(user_info.get("Followers", 0))
+    mean_likes = statistics.fmean(likes for likes, _ in posts)
+    records = []
+    for likes, caption in posts:
+        if not caption:
+            continue
+        output = f"This post received {likes:,} likes"
+        if mean_likes > 0:
+            output += f", {likes / mean_likes:.1f}x the account's average of {mean_likes:,.0f}"
+        if followers > 0:
+            output += f" and {likes / followers:.2%} of its {followers:,} followers"
+        records.append({"kind": "post", "username": username, "instruction": POST_INSTRUCTION,
+                        "input": f"Username: {username}, Category: {category}, Followers: {followers:,}, "
+                                 f"Caption: {caption}",
+                        "output": output + "."})
+    return records
+
+
+def render(user_info, images):
+    """All training records of one stored profile."""
+    posts = [(count_value(image.get("Likes", 0)), _text(image.get("Caption"))) for image in images]
+    records = post_records(user_info, posts)
+    profile = profile_record(user_info, posts)
+    if profile is not None:
+        records.insert(0, profile)
+    return records
+
+
+def content_hash(record):
+    """Hash of a record's instruction, input and output with whitespace and case folded."""
+    content = "\x1f".join(" ".join(record[field].split()).lower() for field in ("instruction", "input", "output"))
+    return hashlib.sha1(content.encode("utf-8")).hexdigest()
+
+
+# ===================== WORKER PROCESSES =====================
+_count_tokens = None
+
+
+def approximate_tokens(text):
+    """Rough BPE token count (words and punctuation, long words split) for runs without a tokenizer."""
+    return sum(1 + len(piece) // 6 for piece in re.findall(r"\w+|[^\w\s]", text))
+
+
+def load_token_counter(tokenizer):
+    """A function returning the token counts of a list of texts.
+
+    ``tokenizer`` names a Hugging Face tokenizer, or is ``"approx"`` to use
+    approximate_tokens.
+    """
+    if tokenizer == "approx":
+        return lambda texts: [approximate_tokens(text) for text in texts]
+    try:
+        from transformers import AutoTokenizer
+    except ImportError:
+        raise RuntimeError("Tokenizing requires transformers (pip install transformers); "
+                           "or use --tokenizer approx")
+    loaded = AutoTokenizer.from_pretrained(tokenizer)
+    return lambda texts: [len(ids) for ids in loaded(texts, add_special_tokens=False)["input_ids"]]
+
+
+def init_worker(tokenizer):
+    global _count_tokens
+    _count_tokens = load_token_counter(tokenizer)
+
+
+def render_batch(scrapes, min_tokens=MIN_TOKENS, max_tokens=MAX_TOKENS):
+    """Render, hash, tokenize and length-filter the records of ``(user_info, images)`` pairs.
+
+    Runs in a pool worker. Returns the kept records and the number dropped
+    for length.
+    """
+    records = [record for user_info, images in scrapes for record in render(user_info, images)]
+    for record in records:
+        record["text"] = ALPACA_PROMPT.format(record["instruction"], record["input"], record["output"])
+    # Fast tokenizers encode a whole batch in parallel native code
+    kept = []
+    for record, tokens in zip(records, _count_tokens([record["text"] for record in records]) if records else []):
+        if min_tokens <= tokens <= max_tokens:
+            record["tokens"] = tokens
+            record["hash"] = content_hash(record)
+            kept.append(record)
+    return kept, len(records) - len(kept)
+
+
+# ===================== SHARDS AND BUILD STATE =====================
+class BuildState:
+    """The finished shards and the content hashes of their records, in SQLite.
+
+    A shard and its hashes are recorded in one transaction, after the shard
+    file is in place, so the hashes on disk are exactly those of records in
+    finished shards. An interrupted build therefore neither loses records
+    (their hashes were never stored) nor repeats them.
+    """
+
+    def __init__(self, path):
+        self._conn = sqlite3.connect(path)
+        self._conn.execute("CREATE TABLE IF NOT EXISTS hashes (hash BLOB PRIMARY KEY) WITHOUT ROWID")
+        self._conn.execute("CREATE TABLE IF NOT EXISTS shards (name TEXT PRIMARY KEY, rows INTEGER, created REAL)")
+        self._conn.commit()
+
+    def __contains__(self, digest):
+        return self._conn.execute("SELECT 1 FROM hashes WHERE hash = ?", (bytes.fromhex(digest),)).fetchone() is not None
+
+    def __len__(self):
+        return self._conn.execute("SELECT COUNT(*) FROM hashes").fetchone()[0]
+
+    def shards(self):
+        return [{"name": name, "rows": rows, "created": created}
+                for name, rows, created in self._conn.execute("SELECT name, rows, created FROM shards ORDER BY name")]
+
+    def finish_shard(self, name, rows, digests):
+        with self._conn:
+            self._conn.execute("INSERT OR REPLACE INTO shards VALUES (?, ?, ?)", (name, rows, time.time()))
+            self._conn.executemany("INSERT OR IGNORE INTO hashes VALUES (?)",
+                                   ((bytes.fromhex(digest),) for digest in digests))
+
+    def close(self):
+        self._conn.close()
+
+
+class ShardWriter:
+    """Appends records to numbered shards of at most ``shard_rows`` rows.
+
+    A shard is written under a temporary name and renamed when it is full
+    or the writer is closed, so readers globbing ``part-*`` never see a
+    partial file. ``on_shard`` is called with each finished shard's name,
+    row count and record hashes.
+    """
+
+    def __init__(self, directory, fmt, first_index, shard_rows=SHARD_ROWS, on_shard=None):
+        self.directory = directory
+        self.fmt = fmt
+        self.index = first_index
+        self.shard_rows = shard_rows
+        self.on_shard = on_shard
+        self._writer = None
+        self._rows = 0
+        self._digests = []
+
+    def _open(self):
+        self._name = f"part-{self.index:05d}.{self.fmt}"
+        self._tmp_path = os.path.join(self.directory, self._name + ".tmp")
+        self._writer = WRITERS[self.fmt](self._tmp_path, RECORD_COLUMNS)
+        self._rows = 0
+        self._digests = []
+
+    def write(self, records):
+        while records:
+            if self._writer is None:
+                self._open()
+            chunk, records = records[:self.shard_rows - self._rows], records[self.shard_rows - self._rows:]
+            self._writer.write([{name: record[name] for name, _ in RECORD_COLUMNS} for record in chunk])
+            self._rows += len(chunk)
+            self._digests.extend(record["hash"] for record in chunk)
+            if self._rows >= self.shard_rows:
+                self._finish()
+
+    def _finish(self):
+        self._writer.close()
+        os.replace(self._tmp_path, os.path.join(self.directory, self._name))
+        self._writer = None
+        self.index += 1
+        if self.on_shard is not None:
+            self.on_shard(self._name, self._rows, self._digests)
+
+    def close(self):
+        if self._writer is not None:
+            self._finish()
+
+
+def load_manifest(directory):
+    path = os.path.join(directory, MANIFEST_NAME)
+    if not os.path.exists(path):
+        return {"watermark": None, "shards": [], "records": 0}
+    with open(path, encoding="utf-8") as f:
+        return json.load(f)
+
+
+def save_manifest(directory, manifest):
+    path = os.path.join(directory, MANIFEST_NAME)
+    with open(path + ".tmp", "w", encoding="utf-8") as f:
+        json.dump(manifest, f, indent=2)
+    os.replace(path + ".tmp", path)
+
+
+def reset_dataset(directory):
+    """Delete the shards, hashes and manifest of a previous build in ``directory``."""
+    if not os.path.isdir(directory):
+        return
+    for name in os.listdir(directory):
+        if name.startswith("part-") or name in (MANIFEST_NAME, HASHES_NAME):
+            os.remove(os.path.join(directory, name))
+
+
+# ===================== DATASET BUILDER =====================
+@timed("training_build")
+def build_dataset(collection, directory=TRAINING_DIR, fmt="jsonl", workers=None, tokenizer=DEFAULT_TOKENIZER,
+                  min_tokens=MIN_TOKENS, max_tokens=MAX_TOKENS, shard_rows=SHARD_ROWS,
+                  batch_size=TRAINING_BATCH_SIZE, on_progress=None):
+    """Append records for profiles scraped since the last build to the shards in ``directory``.
+
+    Profiles stream from MongoDB ``batch_size`` at a time and are rendered
+    by ``workers`` processes (all cores by default; 1 renders in this
+    process). At most two batches per worker are in flight, so memory stays
+    bounded however large the collection is. ``on_progress`` is called with
+    the running summary after every batch. Returns the summary of the run.
+    """
+    if fmt not in TRAINING_FORMATS:
+        raise ValueError(f"Unknown training data format: {fmt}")
+    os.makedirs(directory, exist_ok=True)
+    for name in os.listdir(directory):
+        if name.startswith("part-") and name.endswith(".tmp"):
+            os.remove(os.path.join(directory, name))  # left by an interrupted run
+
+    manifest = load_manifest(directory)
+    state = BuildState(os.path.join(directory, HASHES_NAME))
+    # The build state is authoritative; manifest.json mirrors it for readers
+    manifest["shards"] = state.shards()
+    manifest["records"] = sum(shard["rows"] for shard in manifest["shards"])
+    if manifest["shards"] and manifest.get("format", fmt) != fmt:
+        state.close()
+        raise ValueError(f"{directory} holds {manifest['format']} shards; rebuild it to switch to {fmt}")
+    manifest["format"] = fmt
+    manifest["tokenizer"] = tokenizer
+    started = time.time()
+    since = manifest["watermark"] - WATERMARK_OVERLAP if manifest["watermark"] is not None else None
+    workers = workers or os.cpu_count() or 1
+    unsaved = set()  # hashes of the records in the shard being written
+    summary = {"profiles": 0, "rendered": 0, "written": 0, "duplicates": 0, "length_filtered": 0, "shards": []}
+
+    def shard_done(name, rows, digests):
+        state.finish_shard(name, rows, digests)
+        unsaved.difference_update(digests)
+        manifest["shards"].append({"name": name, "rows": rows, "created": time.time()})
+        manifest["records"] += rows
+        save_manifest(directory, manifest)
+        summary["shards"].append(name)
+
+    writer = ShardWriter(directory, fmt, len(manifest["shards"]), shard_rows, shard_done)
+
+    def collect(result):
+        records, filtered = result
+        fresh = []
+        for record in records:
+            if record["hash"] not in unsaved and record["hash"] not in state:
+                unsaved.add(record["hash"])
+                fresh.append(record)
+        summary["rendered"] += len(records) + filtered
+        summary["length_filtered"] += filtered
+        summary["duplicates"] += len(records) - len(fresh)
+        summary["written"] += len(fresh)
+        writer.write(fresh)
+        if on_progress is not None:
+            on_progress(summary)
+
+    batches = iter_profile_batches(collection, start=since, batch_size=batch_size)
+    try:
+        if workers <= 1:
+            init_worker(tokenizer)
+            for batch in batches:
+                summary["profiles"] += len(batch)
+                collect(render_batch([(user_info, images) for user_info, images, _ in batch], min_tokens, max_tokens))
+        else:
+            with ProcessPoolExecutor(workers, initializer=init_worker, initargs=(tokenizer,)) as executor:
+                pending = deque()
+                for batch in batches:
+                    summary["profiles"] += len(batch)
+                    pending.append(executor.submit(
+                        render_batch, [(user_info, images) for user_info, images, _ in batch], min_tokens, max_tokens
+                    ))
+                    if len(pending) >= 2 * workers:
+                        collect(pending.popleft().result())
+                while pending:
+                    collect(pending.popleft().result())
+        writer.close()
+    finally:
+        state.close()
+
+    manifest["watermark"] = started
+    save_manifest(directory, manifest)
+    summary["total_records"] = manifest["records"]
+    return summary